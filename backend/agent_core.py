@@ -1,7 +1,24 @@
+import asyncio
+import threading
+from typing import Any, Dict, Iterator
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_core.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """獲取進程內共用的背景事件循環（異步驅動的連接池綁定事件循環，需跨請求重用）。"""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="agent-event-loop", daemon=True).start()
+        return _loop
+
 def create_agent(llm, tools, prompt):
     """創建並返回一個 LangChain Agent。"""
     agent = create_react_agent(llm, tools, prompt)
@@ -40,4 +57,89 @@ Final Answer: [給使用者的最終回答]
     return PromptTemplate.from_template(template, partial_variables={"tool_names": ", ".join([tool.name for tool in tools])})
 
 
+class ReActStreamParser:
+    """把單次 LLM 輸出的 token 流拆分為思考 (thought) 與最終答案 (token) 兩種事件。"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.emitted = 0
+        self.final_index = -1
+        self.strip_leading = False
+
+    def feed(self, chunk: str) -> Iterator[Dict[str, Any]]:
+        """加入新的 token, 產生可以安全輸出的事件。"""
+        self.buffer += chunk
+        if self.final_index < 0:
+            index = self.buffer.find(FINAL_ANSWER_MARKER)
+            if index < 0:
+                # 保留可能被切開的標記前綴, 避免把 "Final Ans" 當成思考輸出
+                safe_end = max(self.emitted, len(self.buffer) - len(FINAL_ANSWER_MARKER))
+                yield from self._emit("thought", safe_end)
+                return
+            yield from self._emit("thought", index)
+            self.final_index = index + len(FINAL_ANSWER_MARKER)
+            self.emitted = max(self.emitted, self.final_index)
+            self.strip_leading = True
+        yield from self._emit("token", len(self.buffer))
+
+    def flush(self) -> Iterator[Dict[str, Any]]:
+        """LLM 輸出結束時送出剩餘內容。"""
+        yield from self._emit("thought" if self.final_index < 0 else "token", len(self.buffer))
+
+    def _emit(self, event_type: str, end: int) -> Iterator[Dict[str, Any]]:
+        if end > self.emitted:
+            content = self.buffer[self.emitted:end]
+            self.emitted = end
+            if event_type == "token" and self.strip_leading:
+                content = content.lstrip()
+                self.strip_leading = not content
+            if content:
+                yield {"type": event_type, "content": content}
+
+
+def _chunk_text(chunk) -> str:
+    """取出 chat model chunk 的文字內容。"""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+
+def stream_agent_events(agent_executor, inputs: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """以同步產生器的方式執行 Agent, 逐步產生思考、工具調用與最終答案 token 事件。
+
+    事件格式:
+        {"type": "thought", "content": ...}
+        {"type": "tool_start", "tool": ..., "input": ...}
+        {"type": "tool_end", "tool": ..., "output": ...}
+        {"type": "token", "content": ...}
+        {"type": "final", "content": ...}
+    """
+    loop = get_event_loop()
+    events = agent_executor.astream_events(inputs, version="v2")
+    parsers: Dict[str, ReActStreamParser] = {}
+    try:
+        while True:
+            try:
+                event = asyncio.run_coroutine_threadsafe(events.__anext__(), loop).result()
+            except StopAsyncIteration:
+                break
 
+            kind = event["event"]
+            run_id = event.get("run_id")
+            if kind == "on_chat_model_stream":
+                parser = parsers.setdefault(run_id, ReActStreamParser())
+                yield from parser.feed(_chunk_text(event["data"].get("chunk")))
+            elif kind == "on_chat_model_end":
+                parser = parsers.pop(run_id, None)
+                if parser:
+                    yield from parser.flush()
+            elif kind == "on_tool_start":
+                yield {"type": "tool_start", "tool": event["name"], "input": event["data"].get("input")}
+            elif kind == "on_tool_end":
+                yield {"type": "tool_end", "tool": event["name"], "output": str(event["data"].get("output", ""))}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                output = event["data"].get("output") or {}
+                yield {"type": "final", "content": output.get("output", "") if isinstance(output, dict) else str(output)}
+    finally:
+        asyncio.run_coroutine_threadsafe(events.aclose(), loop).result()
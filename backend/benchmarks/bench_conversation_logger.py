@@ -0,0 +1,89 @@
+"""
+ConversationLogger 寫入微基準測試
+比較舊的「每次寫入開關連接」方式、持久連接 (WAL) 與批次提交的 inserts/sec
+
+用法: python benchmarks/bench_conversation_logger.py [--count 2000] [--group-size 64]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_manager import ConversationLogger
+
+
+def legacy_log_message(db_path: str, session_id: str, speaker: str, message: str) -> int:
+    """舊實現: 每次寫入都新建連接、提交並關閉 (rollback journal 模式)."""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO conversation_logs (session_id, timestamp, speaker, message)
+        VALUES (?, ?, ?, ?)
+    """, (session_id, datetime.now(), speaker, message))
+    message_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return message_id
+
+
+def bench_legacy(directory: str, count: int) -> float:
+    db_path = os.path.join(directory, "legacy.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE conversation_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            timestamp DATETIME,
+            speaker TEXT,
+            message TEXT,
+            processed BOOLEAN DEFAULT FALSE
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+    start = time.perf_counter()
+    for i in range(count):
+        legacy_log_message(db_path, "bench-session", "user", f"測試訊息 {i}")
+    return count / (time.perf_counter() - start)
+
+
+def bench_logger(directory: str, name: str, count: int, group_size: int) -> float:
+    logger = ConversationLogger(os.path.join(directory, f"{name}.db"), group_commit_size=group_size)
+    start = time.perf_counter()
+    for i in range(count):
+        logger.log_message("bench-session", "user", f"測試訊息 {i}")
+    logger.flush()
+    elapsed = time.perf_counter() - start
+    logger.close()
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ConversationLogger 寫入基準測試")
+    parser.add_argument("--count", type=int, default=2000, help="寫入訊息數量")
+    parser.add_argument("--group-size", type=int, default=64, help="批次提交的訊息數量")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [
+            ("舊實現 (每次開關連接)", bench_legacy(directory, args.count)),
+            ("持久連接 + WAL", bench_logger(directory, "wal", args.count, 1)),
+            (f"持久連接 + WAL + 批次提交 ({args.group_size})",
+             bench_logger(directory, "group", args.count, args.group_size)),
+        ]
+
+    baseline = results[0][1]
+    print(f"寫入 {args.count} 條訊息:")
+    for label, rate in results:
+        print(f"  {label:<36} {rate:>10.0f} inserts/sec  ({rate / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
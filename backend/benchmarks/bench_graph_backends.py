@@ -0,0 +1,102 @@
+"""
+圖譜後端壓測
+以合成的提取結果測量寫入吞吐量與搜索延遲, 預設只測進程內後端 (不需要 Neo4j),
+提供 --neo4j 時同時測量 NEO4J_URI 上的 Neo4j 後端
+
+用法: python benchmarks/bench_graph_backends.py [--messages 2000] [--batch 32] [--queries 500] [--neo4j]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_backends import InMemoryGraphBackend
+
+SURNAMES = "陳林黃張李王吳劉蔡楊"
+GIVEN_NAMES = ["小明", "志強", "美玲", "家豪", "淑芬", "建國", "雅婷", "俊傑"]
+PROJECTS = ["Project Phoenix", "CRM 升級", "年度預算", "官網改版", "數據平台"]
+
+
+def make_payload(rng: random.Random, prefix: str):
+    """生成一條典型的提取結果: 兩至三個人物、一個專案、關係、事件與摘要."""
+    people = [f"{prefix}{rng.choice(SURNAMES)}{rng.choice(GIVEN_NAMES)}" for _ in range(rng.randint(2, 3))]
+    project = f"{prefix}{rng.choice(PROJECTS)}"
+    return {
+        "entities": [
+            {"name": name, "type": "Person", "attributes": {"職位": rng.choice(["經理", "工程師", "設計師"])}}
+            for name in people
+        ] + [{"name": project, "type": "Project", "attributes": {"進度": f"{rng.randint(0, 100)}%"}}],
+        "relations": [{"source": name, "target": project, "type": "參與"} for name in people],
+        "events": [{"description": f"{people[0]} 提交 {project} 報告", "actor": people[0], "date": "2025-07-25"}],
+        "summary": f"{people[0]} 負責 {project}",
+    }
+
+
+def bench_backend(name: str, backend, payloads, batch: int, queries):
+    start = time.perf_counter()
+    for i in range(0, len(payloads), batch):
+        backend.store_knowledge_batch([(payload, i + j) for j, payload in enumerate(payloads[i:i + batch])])
+    write_elapsed = time.perf_counter() - start
+
+    latencies, hits = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        results = backend.search_entities(query, limit=5)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += bool(results)
+    latencies.sort()
+    print(f"{name}:")
+    print(f"  寫入 {len(payloads)} 條知識: {len(payloads) / write_elapsed:,.0f} 條/秒")
+    print(f"  搜索 {len(queries)} 次: p50 {statistics.median(latencies):.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms, 命中率 {hits / len(queries):.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="圖譜後端壓測")
+    parser.add_argument("--messages", type=int, default=2000, help="寫入的提取結果數量")
+    parser.add_argument("--batch", type=int, default=32, help="每次寫入合併的提取結果數量")
+    parser.add_argument("--queries", type=int, default=500, help="搜索次數")
+    parser.add_argument("--neo4j", action="store_true", help="同時測量 Neo4j 後端")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    payloads = [make_payload(rng, "bench") for _ in range(args.messages)]
+    queries = [rng.choice([f"{rng.choice(SURNAMES)}{rng.choice(GIVEN_NAMES)}", rng.choice(PROJECTS), "經理"])
+               for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        backend = InMemoryGraphBackend(snapshot_path=os.path.join(directory, "graph.json"))
+        bench_backend("進程內後端", backend, payloads, args.batch, queries)
+        start = time.perf_counter()
+        backend.close()
+        print(f"  快照: {time.perf_counter() - start:.2f} 秒, {backend.get_stats()}")
+
+    if args.neo4j:
+        from memory_manager import Neo4jMemoryStore
+        store = Neo4jMemoryStore(
+            os.getenv("NEO4J_URI", "neo4j://localhost:7687"),
+            os.getenv("NEO4J_USER", "neo4j"),
+            os.getenv("NEO4J_PASSWORD", "password")
+        )
+        try:
+            bench_backend("Neo4j 後端", store, payloads, args.batch, queries)
+        finally:
+            # 清理測試數據 (名稱均以 bench 開頭)
+            with store.driver.session() as session:
+                session.run("""
+                    MATCH (n)
+                    WHERE n.name STARTS WITH 'bench' OR n.text STARTS WITH 'bench'
+                       OR n.description STARTS WITH 'bench'
+                    DETACH DELETE n
+                """).consume()
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
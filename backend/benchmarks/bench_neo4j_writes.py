@@ -0,0 +1,160 @@
+"""
+Neo4j 知識寫入基準測試
+比較舊的「每個實體/關係/屬性一次 tx.run」寫法與 UNWIND 批次語句的往返次數,
+提供 --neo4j 時另外在真實數據庫上比較每次提取的寫入延遲
+
+用法: python benchmarks/bench_neo4j_writes.py [--neo4j] [--repeat 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_manager import Neo4jMemoryStore
+
+
+class RecordingTx:
+    """只記錄語句的假事務, 用於統計往返次數."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def run(self, query, parameters=None, **kwargs):
+        self.calls += 1
+
+
+def legacy_create_knowledge_graph(tx, data, source_log_id):
+    """舊實現: 逐條寫入實體、關係、屬性與事件."""
+    for entity in data.get("entities", []):
+        props = {"name": entity["name"]}
+        if entity.get("attributes"):
+            props.update(entity["attributes"])
+        tx.run(f"MERGE (n:`{entity['type']}` {{name: $name}}) SET n += $props", name=entity["name"], props=props)
+    for relation in data.get("relations", []):
+        tx.run("""
+            MATCH (source {name: $source_name})
+            MATCH (target {name: $target_name})
+            MERGE (source)-[r:RELATED_TO]->(target)
+            SET r.type = $rel_type
+        """, source_name=relation["source"], target_name=relation["target"], rel_type=relation["type"])
+    for entity in data.get("entities", []):
+        for key, value in (entity.get("attributes") or {}).items():
+            tx.run(f"MATCH (e {{name: $name}}) SET e.`{key}` = $value", name=entity["name"], value=value)
+    for event in data.get("events", []):
+        tx.run("CREATE (e:Event {description: $desc, date: $date, source_log_id: $source_log_id})",
+               desc=event["description"], date=event.get("date"), source_log_id=source_log_id)
+        if event.get("actor"):
+            tx.run("""
+                MATCH (e:Event {description: $desc})
+                MATCH (p:Person {name: $actor_name})
+                MERGE (p)-[:PERFORMED]->(e)
+            """, desc=event["description"], actor_name=event["actor"])
+    if data.get("summary"):
+        tx.run("CREATE (s:Summary {text: $text, source_log_id: $source_log_id})",
+               text=data["summary"], source_log_id=source_log_id)
+
+
+def make_payload(prefix, entities, labels, attributes, relations, events):
+    """生成測試用的提取結果 (名稱帶前綴, 避免與真實數據衝突)."""
+    label_names = ["BenchPerson", "BenchProject", "BenchCompany", "BenchPlace", "BenchTopic"][:labels]
+    payload = {
+        "entities": [
+            {
+                "name": f"{prefix}-entity-{i}",
+                "type": label_names[i % len(label_names)],
+                "attributes": {f"attr_{j}": f"value {j}" for j in range(attributes)},
+            }
+            for i in range(entities)
+        ],
+        "relations": [
+            {"source": f"{prefix}-entity-{i % entities}", "target": f"{prefix}-entity-{(i + 1) % entities}",
+             "type": "WORKS_WITH"}
+            for i in range(relations)
+        ],
+        "events": [
+            {"description": f"{prefix} event {i}", "date": "2024-01-01", "actor": f"{prefix}-entity-0"}
+            for i in range(events)
+        ],
+        "summary": f"{prefix} summary",
+    }
+    return payload
+
+
+SCENARIOS = {
+    "典型提取": dict(entities=3, labels=2, attributes=2, relations=2, events=1),
+    "大型提取": dict(entities=50, labels=5, attributes=4, relations=60, events=10),
+}
+
+
+def count_round_trips(write_fn, payload) -> int:
+    tx = RecordingTx()
+    write_fn(tx, payload, 1)
+    return tx.calls
+
+
+def measure_latency(driver, write_fn, payload_factory, repeat: int) -> float:
+    """返回每次提取寫入的平均毫秒數."""
+    elapsed = 0.0
+    with driver.session() as session:
+        for _ in range(repeat):
+            payload = payload_factory()
+            start = time.perf_counter()
+            session.execute_write(write_fn, payload, 1)
+            elapsed += time.perf_counter() - start
+    return elapsed / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Neo4j 知識寫入基準測試")
+    parser.add_argument("--neo4j", action="store_true", help="連接 NEO4J_URI 測量真實寫入延遲")
+    parser.add_argument("--repeat", type=int, default=20, help="每個場景的重複次數")
+    args = parser.parse_args()
+
+    def batched(tx, data, source_log_id):
+        for query, params in Neo4jMemoryStore.build_write_statements(data, source_log_id):
+            tx.run(query, params)
+
+    print("每次提取的 tx.run 往返次數:")
+    for name, spec in SCENARIOS.items():
+        payload = make_payload("bench", **spec)
+        legacy = count_round_trips(legacy_create_knowledge_graph, payload)
+        unwind = count_round_trips(batched, payload)
+        print(f"  {name:<8} 舊實現 {legacy:>4}   UNWIND {unwind:>3}   ({legacy / unwind:.1f}x)")
+
+    if not args.neo4j:
+        return
+
+    from neo4j import GraphDatabase
+    driver = GraphDatabase.driver(
+        os.getenv("NEO4J_URI", "neo4j://localhost:7687"),
+        auth=(os.getenv("NEO4J_USER", "neo4j"), os.getenv("NEO4J_PASSWORD", "password"))
+    )
+    run_id = uuid.uuid4().hex[:8]
+    try:
+        print("每次提取的平均寫入延遲:")
+        for name, spec in SCENARIOS.items():
+            results = []
+            for label, write_fn in (("舊實現", legacy_create_knowledge_graph), ("UNWIND", batched)):
+                factory = lambda: make_payload(f"bench-{run_id}-{uuid.uuid4().hex[:6]}", **spec)
+                results.append((label, measure_latency(driver, write_fn, factory, args.repeat)))
+            (_, legacy_ms), (_, unwind_ms) = results
+            print(f"  {name:<8} 舊實現 {legacy_ms:>8.1f} ms   UNWIND {unwind_ms:>8.1f} ms   "
+                  f"({legacy_ms / unwind_ms:.1f}x)")
+    finally:
+        # 清理測試數據
+        with driver.session() as session:
+            session.run("""
+                MATCH (n)
+                WHERE any(label IN labels(n) WHERE label STARTS WITH 'Bench')
+                   OR n.description STARTS WITH 'bench' OR n.text STARTS WITH 'bench'
+                DETACH DELETE n
+            """)
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
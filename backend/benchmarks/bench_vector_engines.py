@@ -0,0 +1,129 @@
+"""
+向量引擎基準測試
+以合成的聚類向量 (單位長度, 與句向量的分佈相近) 比較 QuantizedVectorStore (flat / ivf) 與 chromadb:
+建索引時間、查詢延遲 (p50 / p95)、相對 float32 精確搜索的 recall@k、與 chromadb 結果的重疊率、
+記憶體佔用 (搜索時掃描的位元組) 與磁碟佔用; 向量直接寫入, 不經過嵌入函數
+
+用法: python benchmarks/bench_vector_engines.py [--vectors 20000] [--dim 384] [--clusters 200] [--queries 200] [--k 10]
+      [--probe N] [--skip-chroma]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_engine import QuantizedVectorStore
+
+
+def make_vectors(count: int, dim: int, clusters: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    if clusters <= 0:
+        # 無聚類結構的均勻隨機向量: IVF 的最壞情況
+        vectors = rng.normal(size=(count, dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size=count)] + 0.6 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def exact_top_k(vectors, queries, k: int):
+    distances = (np.einsum("ij,ij->i", vectors, vectors)[None, :] - 2.0 * queries @ vectors.T)
+    return [set(np.argsort(row)[:k].tolist()) for row in distances]
+
+
+def run_queries(search, queries, k: int):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids = search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append({int(value) for value in ids})
+    return results, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def report(name: str, build_seconds: float, results, truth, p50: float, p95: float,
+           memory_bytes: int, disk_bytes: int, reference=None):
+    recall = np.mean([len(found & expected) / len(expected) for found, expected in zip(results, truth)])
+    line = (f"  {name:<18} 建索引 {build_seconds:>6.2f} 秒  p50 {p50:>7.2f} ms  p95 {p95:>7.2f} ms  "
+            f"recall {recall:.3f}  記憶體 {memory_bytes / 2**20:>7.1f} MiB  磁碟 {disk_bytes / 2**20:>7.1f} MiB")
+    if reference is not None:
+        overlap = np.mean([len(found & other) / max(len(other), 1) for found, other in zip(results, reference)])
+        line += f"  與 chromadb 重疊 {overlap:.3f}"
+    print(line)
+
+
+def bench_quantized(name: str, directory: str, vectors, queries, truth, k: int, reference, **options):
+    store = QuantizedVectorStore(path=os.path.join(directory, name), add_chunk_size=len(vectors), **options)
+    items = [(i, "", None) for i in range(len(vectors))]
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), 4096):
+        store.store_embeddings(items[offset:offset + 4096], vectors[offset:offset + 4096])
+    if options.get("index") == "ivf" and store.get_stats()["index"] != "ivf":
+        store.train_ivf()
+    build_seconds = time.perf_counter() - start
+    results, p50, p95 = run_queries(lambda query, n: store.search_by_vector(query, n)["ids"][0], queries, k)
+    stats = store.get_stats()
+    report(name, build_seconds, results, truth, p50, p95, stats["scan_bytes"], stats["disk_bytes"], reference)
+
+
+def bench_chroma(directory: str, vectors, queries, truth, k: int):
+    import chromadb
+    path = os.path.join(directory, "chroma")
+    collection = chromadb.PersistentClient(path=path).get_or_create_collection(name="bench")
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), 4096):
+        block = vectors[offset:offset + 4096]
+        collection.add(ids=[str(offset + i) for i in range(len(block))], embeddings=block.tolist())
+    build_seconds = time.perf_counter() - start
+    results, p50, p95 = run_queries(
+        lambda query, n: collection.query(query_embeddings=[query.tolist()], n_results=n)["ids"][0], queries, k
+    )
+    # HNSW 索引常駐記憶體: float32 向量加上每個節點的鄰接表 (以預設 M=16 估算)
+    memory_bytes = len(vectors) * (vectors.shape[1] * 4 + 16 * 2 * 4)
+    report("chromadb (hnsw)", build_seconds, results, truth, p50, p95, memory_bytes, directory_size(path))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量引擎基準測試")
+    parser.add_argument("--vectors", type=int, default=20000, help="索引的向量數量")
+    parser.add_argument("--dim", type=int, default=384, help="向量維度 (all-MiniLM-L6-v2 為 384)")
+    parser.add_argument("--clusters", type=int, default=200, help="合成數據的主題數量 (0 = 均勻隨機向量)")
+    parser.add_argument("--queries", type=int, default=200, help="查詢數量")
+    parser.add_argument("--k", type=int, default=10, help="每次查詢返回的結果數量")
+    parser.add_argument("--rerank-factor", type=int, default=None, help="重排候選倍數 (預設 VECTOR_RERANK_FACTOR)")
+    parser.add_argument("--probe", type=int, default=None, help="IVF 探測的聚類數量 (預設 VECTOR_IVF_PROBE)")
+    parser.add_argument("--skip-chroma", action="store_true", help="不測試 chromadb")
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors, args.dim, args.clusters)
+    queries = make_vectors(args.queries, args.dim, args.clusters, seed=7)
+    truth = exact_top_k(vectors, queries, args.k)
+    print(f"{args.vectors} 條 {args.dim} 維向量, {args.queries} 次查詢, top-{args.k} "
+          f"(float32 原始向量 {vectors.nbytes / 2**20:.1f} MiB):")
+
+    with tempfile.TemporaryDirectory() as directory:
+        reference = None
+        if not args.skip_chroma:
+            try:
+                reference = bench_chroma(directory, vectors, queries, truth, args.k)
+            except ImportError:
+                print("  chromadb 未安裝, 跳過")
+        bench_quantized("quantized flat", directory, vectors, queries, truth, args.k, reference,
+                        index="flat", rerank_factor=args.rerank_factor)
+        bench_quantized("quantized ivf", directory, vectors, queries, truth, args.k, reference,
+                        index="ivf", rerank_factor=args.rerank_factor, ivf_probe=args.probe, ivf_min_size=0)
+
+
+if __name__ == "__main__":
+    main()
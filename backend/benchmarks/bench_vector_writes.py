@@ -0,0 +1,105 @@
+"""
+向量寫入基準測試
+比較逐條 store_message、批量 store_messages (不同分塊大小) 與 VectorWriteBuffer 的寫入速率 (條/秒),
+每個場景使用獨立的臨時索引; 預設使用 chromadb 的預設嵌入函數,
+--hash-embedding 改用本地雜湊嵌入, 只測量 chromadb 的索引開銷
+
+用法: python benchmarks/bench_vector_writes.py [--messages 2000] [--chunks 32,128,512] [--hash-embedding]
+"""
+
+import argparse
+import hashlib
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_manager import VectorMemoryStore
+from vector_write_buffer import VectorWriteBuffer
+
+_collection_ids = itertools.count(1)
+
+PHRASES = ["明天下午三點開會", "幫我記住張三的電話", "Project Phoenix 的進度到 60%", "下週一提醒我預約牙醫",
+           "我對花生過敏", "把報告寄給王經理", "年度預算需要再確認", "今天天氣不錯"]
+
+
+class HashEmbeddingFunction:
+    """以字元雙字雜湊生成固定維度向量, 不需要下載模型."""
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def __call__(self, input):
+        vectors = []
+        for text in input:
+            vector = [0.0] * self.dimensions
+            for i in range(max(len(text) - 1, 1)):
+                digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=4).digest()
+                vector[int.from_bytes(digest, "little") % self.dimensions] += 1.0
+            norm = sum(value * value for value in vector) ** 0.5 or 1.0
+            vectors.append([value / norm for value in vector])
+        return vectors
+
+    def name(self) -> str:
+        return "bench-hash"
+
+
+def make_messages(count: int):
+    rng = random.Random(42)
+    return [
+        (i + 1, f"{rng.choice(PHRASES)} #{i}",
+         VectorMemoryStore.build_metadata(f"session-{i % 20}", rng.choice(["user", "ai"]), None))
+        for i in range(count)
+    ]
+
+
+def measure(name: str, directory: str, embedding_function, messages, write):
+    store = VectorMemoryStore(collection_name=f"bench_{next(_collection_ids)}",
+                              path=os.path.join(directory, "chroma"), mode="persistent",
+                              embedding_function=embedding_function)
+    start = time.perf_counter()
+    write(store, messages)
+    elapsed = time.perf_counter() - start
+    assert store.count() == len(messages), f"{name}: 寫入 {store.count()} 條, 預期 {len(messages)} 條"
+    print(f"  {name:<28} {len(messages) / elapsed:>10,.0f} 條/秒  ({elapsed:.2f} 秒)")
+    return len(messages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量寫入基準測試")
+    parser.add_argument("--messages", type=int, default=2000, help="寫入的訊息數量")
+    parser.add_argument("--chunks", default="32,128,512", help="store_messages 的分塊大小 (逗號分隔)")
+    parser.add_argument("--hash-embedding", action="store_true", help="使用本地雜湊嵌入, 只測量索引開銷")
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    embedding_function = HashEmbeddingFunction() if args.hash_embedding else None
+    print(f"寫入 {len(messages)} 條訊息 ({'雜湊嵌入' if args.hash_embedding else 'chromadb 預設嵌入'}):")
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = measure("逐條 store_message", directory, embedding_function, messages,
+                           lambda store, items: [store.store_message(*item) for item in items])
+
+        for chunk in (int(value) for value in args.chunks.split(",")):
+            def write_chunked(store, items, chunk=chunk):
+                store.add_chunk_size = chunk
+                store.store_messages(items)
+            rate = measure(f"store_messages (每塊 {chunk})", directory, embedding_function, messages, write_chunked)
+            print(f"  {'':<28} 相對逐條: {rate / baseline:.1f}x")
+
+        def write_buffered(store, items):
+            buffer = VectorWriteBuffer(store)
+            for item in items:
+                buffer.add(*item)
+            buffer.close()
+        rate = measure(f"VectorWriteBuffer (每批 {int(os.getenv('VECTOR_WRITE_BUFFER_SIZE', '64'))})",
+                       directory, embedding_function, messages, write_buffered)
+        print(f"  {'':<28} 相對逐條: {rate / baseline:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
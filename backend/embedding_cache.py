@@ -0,0 +1,188 @@
+"""
+嵌入向量快取模組
+以 (嵌入模型 id, 正規化文本) 的雜湊為鍵, 把向量以 float16/float32 二進位存放在 SQLite 中, 按最近使用時間淘汰;
+CachedEmbeddingFunction 包裝 chromadb 的嵌入函數, 寫入與查詢共用, 重複的訊息與查詢不再重新嵌入
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+
+class EmbeddingCache:
+    """持久化的嵌入向量快取"""
+
+    # struct 格式字元: e = IEEE 754 半精度, f = 單精度 (小端序)
+    DTYPES = {"float16": "e", "float32": "f"}
+
+    def __init__(self, db_path: str = "embedding_cache.db", max_entries: int = None,
+                 dtype: str = None, evict_every: int = 1000):
+        self.db_path = db_path
+        self.max_entries = max_entries or int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+        dtype = (dtype or os.getenv("EMBEDDING_CACHE_DTYPE", "float16")).lower()
+        if dtype not in self.DTYPES:
+            raise ValueError(f"unsupported embedding cache dtype: {dtype}")
+        self.dtype = dtype
+        self.evict_every = evict_every
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._writes_since_evict = 0
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._init_db()
+
+    def _init_db(self):
+        """初始化快取表."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key BLOB PRIMARY KEY,
+                    dtype TEXT,
+                    vector BLOB,
+                    last_access REAL
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access ON embedding_cache (last_access)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """正規化文本: 全半形統一、合併空白、去除首尾空白 (不改變大小寫, 以免影響嵌入語義)"""
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+    def make_key(self, model_id: str, text: str) -> bytes:
+        """計算快取鍵 (32 位元組雜湊)"""
+        return hashlib.sha256(f"{model_id}\0{self.normalize(text)}".encode("utf-8")).digest()
+
+    @classmethod
+    def encode(cls, vector: Sequence[float], dtype: str) -> bytes:
+        return struct.pack(f"<{len(vector)}{cls.DTYPES[dtype]}", *vector)
+
+    @classmethod
+    def decode(cls, blob: bytes, dtype: str) -> List[float]:
+        return list(struct.unpack(f"<{len(blob) // struct.calcsize(cls.DTYPES[dtype])}{cls.DTYPES[dtype]}", blob))
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, List[float]]:
+        """批量讀取快取, 返回命中的 鍵 -> 向量, 並更新命中項的最近使用時間"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embedding_cache WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = self.decode(blob, dtype)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_access = ? WHERE key = ?", ((now, key) for key in found)
+                )
+                self._conn.commit()
+            self.stats["hits"] += sum(1 for key in keys if key in found)
+            self.stats["misses"] += sum(1 for key in keys if key not in found)
+        return found
+
+    def set_many(self, items: Dict[bytes, Sequence[float]]):
+        """批量寫入快取"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("""
+                INSERT OR REPLACE INTO embedding_cache (key, dtype, vector, last_access)
+                VALUES (?, ?, ?, ?)
+            """, [(key, self.dtype, self.encode(vector, self.dtype), now) for key, vector in items.items()])
+            self._conn.commit()
+            self.stats["writes"] += len(items)
+            self._writes_since_evict += len(items)
+            if self._writes_since_evict >= self.evict_every:
+                self._writes_since_evict = 0
+                self._evict_locked()
+
+    def _evict_locked(self):
+        """按最近使用時間淘汰超出上限的項目 (調用方需持有鎖)"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        if count > self.max_entries:
+            evicted = self._conn.execute("""
+                DELETE FROM embedding_cache WHERE key IN (
+                    SELECT key FROM embedding_cache ORDER BY last_access LIMIT ?
+                )
+            """, (count - self.max_entries,)).rowcount
+            self._conn.commit()
+            self.stats["evictions"] += evicted
+
+    def evict(self):
+        """立即執行淘汰"""
+        with self._lock:
+            self._evict_locked()
+
+    def get_stats(self) -> Dict[str, float]:
+        """獲取命中統計"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] / lookups) if lookups else 0.0
+        return stats
+
+    def close(self):
+        """關閉數據庫連接"""
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddingFunction:
+    """帶快取的 chromadb 嵌入函數: 命中的文本直接返回快取向量, 只為未命中的文本 (批次內去重後) 調用底層函數"""
+
+    DEFAULT_MODEL_ID = "chroma-default/all-MiniLM-L6-v2"
+
+    def __init__(self, cache: EmbeddingCache, embedding_function=None, model_id: str = None):
+        if embedding_function is None:
+            from chromadb.utils import embedding_functions
+            embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        self.cache = cache
+        self.embedding_function = embedding_function
+        # 更換嵌入模型時需同時更新 model_id, 使舊的向量失效
+        self.model_id = model_id or os.getenv("EMBEDDING_MODEL_ID", self.DEFAULT_MODEL_ID)
+
+    @classmethod
+    def from_env(cls, cache_dir: str) -> Optional["CachedEmbeddingFunction"]:
+        """按環境變量建立 (EMBEDDING_CACHE_ENABLED=false 時返回 None, 使用 chromadb 預設嵌入函數)"""
+        if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        return cls(EmbeddingCache(os.path.join(cache_dir, "embedding_cache.db")))
+
+    def __call__(self, input: Sequence[str]) -> List[List[float]]:
+        keys = [self.cache.make_key(self.model_id, text) for text in input]
+        vectors = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            embedded = self.embedding_function(list(missing.values()))
+            computed = {key: [float(value) for value in vector] for key, vector in zip(missing, embedded)}
+            self.cache.set_many(computed)
+            vectors.update(computed)
+        return [vectors[key] for key in keys]
+
+    @staticmethod
+    def name() -> str:
+        return "cached"
+
+    def close(self):
+        self.cache.close()
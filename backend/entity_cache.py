@@ -0,0 +1,130 @@
+"""
+實體解析快取模組
+進程內有界 LRU: 正規化的實體名稱或別名 -> (標籤, 節點 element id, 正式名稱),
+寫入與搜索時填充, 讓關係/事件寫入以節點 id 直接定位, 並把別名 ("老張"、"Zhang San") 歸一到同一實體
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+
+class EntityRef(NamedTuple):
+    label: str
+    element_id: str
+    name: str
+
+
+class EntityResolutionCache:
+    """實體解析 LRU 快取 (線程安全)
+
+    - 同一個名稱在不同標籤下可能是不同實體, 以 (標籤, 名稱) 與僅名稱兩種鍵存放;
+      僅名稱的鍵在出現歧義 (對應多個實體) 時不再使用
+    - 節點被合併或刪除時以 element id 失效, 反向索引會一併移除所有指向該節點的名稱與別名
+    """
+
+    _shared: Dict[str, "EntityResolutionCache"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", "10000"))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, EntityRef]" = OrderedDict()
+        self._ambiguous = set()
+        self._keys_by_element: Dict[str, set] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @classmethod
+    def shared(cls, scope: str) -> "EntityResolutionCache":
+        """同一個數據庫在進程內共用一個快取, 使實例池中各實例的失效互相可見."""
+        with cls._shared_lock:
+            if scope not in cls._shared:
+                cls._shared[scope] = cls()
+            return cls._shared[scope]
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """全半形統一、小寫、去除空白 ("Zhang San" 與 "zhangsan" 視為相同)."""
+        return re.sub(r"\s+", "", unicodedata.normalize("NFKC", str(name or "")).lower())
+
+    def _set_locked(self, key: tuple, ref: EntityRef):
+        previous = self._entries.get(key)
+        if previous is not None and previous.element_id != ref.element_id:
+            self._keys_by_element.get(previous.element_id, set()).discard(key)
+            if len(key) == 1:
+                # 同一個名稱指向兩個不同的實體: 只能按 (標籤, 名稱) 解析
+                self._ambiguous.add(key[0])
+                del self._entries[key]
+                return
+        self._entries[key] = ref
+        self._entries.move_to_end(key)
+        self._keys_by_element.setdefault(ref.element_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            old_key, old_ref = self._entries.popitem(last=False)
+            self._keys_by_element.get(old_ref.element_id, set()).discard(old_key)
+            self.stats["evictions"] += 1
+
+    def put(self, name: str, label: str, element_id: str, aliases: Iterable[str] = ()):
+        """記錄一個實體及其別名."""
+        ref = EntityRef(label, element_id, name)
+        with self._lock:
+            for alias in [name, *(aliases or ())]:
+                normalized = self.normalize(alias)
+                if not normalized:
+                    continue
+                self._set_locked((label, normalized), ref)
+                if normalized not in self._ambiguous:
+                    self._set_locked((normalized,), ref)
+
+    def get(self, name: str, label: Optional[str] = None) -> Optional[EntityRef]:
+        """按名稱或別名解析實體; 未命中或名稱有歧義時返回 None."""
+        normalized = self.normalize(name)
+        key = (label, normalized) if label else (normalized,)
+        with self._lock:
+            ref = self._entries.get(key)
+            if ref is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return ref
+
+    def canonical_name(self, name: str, label: Optional[str] = None) -> str:
+        """把別名轉換為實體的正式名稱 (未知時原樣返回)."""
+        ref = self.get(name, label)
+        return ref.name if ref is not None else name
+
+    def invalidate_element(self, element_id: str):
+        """節點被合併或刪除時, 移除所有指向它的名稱與別名."""
+        with self._lock:
+            for key in self._keys_by_element.pop(element_id, set()):
+                ref = self._entries.get(key)
+                if ref is not None and ref.element_id == element_id:
+                    del self._entries[key]
+            self.stats["invalidations"] += 1
+
+    def invalidate_names(self, names: Iterable[str]):
+        """移除指定名稱的快取 (例如寫入事務失敗時)."""
+        with self._lock:
+            for name in names:
+                normalized = self.normalize(name)
+                for key in [key for key in self._entries if key[-1] == normalized]:
+                    ref = self._entries.pop(key)
+                    self._keys_by_element.get(ref.element_id, set()).discard(key)
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._ambiguous.clear()
+            self._keys_by_element.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] / lookups) if lookups else 0.0
+        return stats
@@ -0,0 +1,242 @@
+"""
+實體重要性模組
+定期為圖譜實體計算中心度 (PageRank 與度數) 與提及次數, 合成為 0-1 的結構重要性 importance,
+連同最近提及時間 last_mentioned_at 寫回節點屬性; 近期分數在查詢時由 last_mentioned_at 計算 (current_importance),
+不會因任務跳過而過期.
+每次執行都是整個圖譜的全量重算 (載入所有實體與關係, 以上次結果熱啟動 PageRank, 寫回所有實體),
+只有兩處增量: 以 source_log_id 檢查點判斷沒有新知識時跳過整次執行, 只為新提及的實體查詢訊息時間
+"""
+
+import argparse
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def importance_weights() -> Dict[str, float]:
+    """重要性各組成部分的權重 (環境變量)."""
+    return {
+        "pagerank": float(os.getenv("IMPORTANCE_WEIGHT_PAGERANK", "0.5")),
+        "mentions": float(os.getenv("IMPORTANCE_WEIGHT_MENTIONS", "0.3")),
+        "recency": float(os.getenv("IMPORTANCE_WEIGHT_RECENCY", "0.2")),
+    }
+
+
+def current_importance(importance: Optional[float], last_mentioned_at: Optional[int],
+                       now_ms: Optional[int] = None) -> Optional[float]:
+    """把預先計算的結構重要性與查詢時的近期分數合成為 0-1 的重要性 (尚未計算時為 None)."""
+    if importance is None:
+        return None
+    weights = importance_weights()
+    recency = 0.0
+    if last_mentioned_at is not None:
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        half_life_days = float(os.getenv("IMPORTANCE_RECENCY_HALF_LIFE_DAYS", "30"))
+        age_days = max(now_ms - last_mentioned_at, 0) / 86_400_000
+        recency = 0.5 ** (age_days / half_life_days)
+    structural = weights["pagerank"] + weights["mentions"]
+    return (structural * importance + weights["recency"] * recency) / ((structural + weights["recency"]) or 1.0)
+
+
+def pagerank(nodes: List[Any], edges: List[Tuple[Any, Any]], damping: float = 0.85,
+             max_iterations: int = 50, tolerance: float = 1e-6,
+             initial: Optional[Dict[Any, float]] = None) -> Dict[Any, float]:
+    """以冪迭代計算 PageRank (關係視為無向, 孤立節點的分數均分給所有節點).
+
+    initial 為上一次的結果時 (熱啟動), 圖譜變化不大的情況下幾次迭代即可收斂
+    """
+    count = len(nodes)
+    if count == 0:
+        return {}
+    neighbors: Dict[Any, List[Any]] = defaultdict(list)
+    for source, target in edges:
+        if source != target:
+            neighbors[source].append(target)
+            neighbors[target].append(source)
+
+    ranks = {node: 1.0 / count for node in nodes}
+    if initial:
+        known = {node: initial[node] for node in nodes if initial.get(node)}
+        total = sum(known.values())
+        if total > 0:
+            # 新節點取平均值, 整體重新歸一化
+            default = total / len(known)
+            ranks = {node: known.get(node, default) for node in nodes}
+            norm = sum(ranks.values())
+            ranks = {node: rank / norm for node, rank in ranks.items()}
+
+    base = (1.0 - damping) / count
+    for _ in range(max_iterations):
+        dangling = sum(ranks[node] for node in nodes if not neighbors.get(node))
+        updated = {node: base + damping * dangling / count for node in nodes}
+        for node in nodes:
+            links = neighbors.get(node)
+            if links:
+                share = damping * ranks[node] / len(links)
+                for other in links:
+                    updated[other] += share
+        delta = sum(abs(updated[node] - ranks[node]) for node in nodes)
+        ranks = updated
+        if delta < tolerance:
+            break
+    return ranks
+
+
+class EntityImportanceJob:
+    """實體重要性計算任務
+
+    importance (寫回) = (PageRank 權重 * 歸一化 PageRank + 提及權重 * 歸一化 log(1 + 提及次數))
+                        / (PageRank 權重 + 提及權重)
+    查詢時再與 近期權重 * 0.5 ^ (距最近提及天數 / 半衰期) 按權重合成 (current_importance)
+    檢查點沿用回填任務的 backfill_checkpoints 表, last_id 記錄已計入的最大 source_log_id
+    """
+
+    _shared: Optional["EntityImportanceJob"] = None
+    _shared_lock = threading.Lock()
+    # 共用任務的使用者 (圖譜, 對話記錄), 每個 AI 秘書實例一項
+    _shared_users: List[Tuple[Any, Any]] = []
+
+    # 寫回的 importance 不再包含近期分數; 改名的檢查點使升級後第一次執行全量重算
+    def __init__(self, graph_store, conversation_logger, name: str = "entity_importance_v2"):
+        self.graph_store = graph_store
+        self.logger = conversation_logger
+        self.name = name
+        self.damping = float(os.getenv("IMPORTANCE_DAMPING", "0.85"))
+        self.weights = importance_weights()
+        self.checkpoint = self.logger.get_checkpoint(name)
+        # 執行與切換圖譜/對話記錄互斥, 切換後不會再使用已關閉的連接
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self, force: bool = False) -> Dict[str, Any]:
+        """全量重算並寫回所有實體的重要性; 沒有新的 source_log_id 且未指定 force 時跳過."""
+        with self._run_lock:
+            return self._run(force)
+
+    def _run(self, force: bool) -> Dict[str, Any]:
+        started = time.monotonic()
+        entities, edges = self.graph_store.load_entity_graph()
+        last_id = self.checkpoint["last_id"]
+        max_log_id = max((log_id for entity in entities.values() for log_id in entity["source_log_ids"]),
+                         default=0)
+        if not force and max_log_id <= last_id:
+            return {"skipped": True, "entities": len(entities), "last_id": last_id}
+
+        # 只為新提及 (或尚未有時間) 的實體查詢最近一次提及的訊息時間
+        latest_ids = {}
+        for node_id, entity in entities.items():
+            if entity["source_log_ids"] and (entity.get("last_mentioned_at") is None
+                                             or max(entity["source_log_ids"]) > last_id):
+                latest_ids[node_id] = max(entity["source_log_ids"])
+        timestamps = self.logger.get_message_timestamps(set(latest_ids.values()))
+
+        nodes = list(entities)
+        ranks = pagerank(nodes, edges, damping=self.damping,
+                         initial={node_id: entity.get("importance_pagerank") for node_id, entity in entities.items()})
+        max_rank = max(ranks.values(), default=0.0) or 1.0
+        max_mentions = max((len(entity["source_log_ids"]) for entity in entities.values()), default=0)
+
+        scores = {}
+        for node_id, entity in entities.items():
+            mentions = len(entity["source_log_ids"])
+            last_mentioned_at = timestamps.get(latest_ids.get(node_id), entity.get("last_mentioned_at"))
+            importance = (
+                self.weights["pagerank"] * ranks[node_id] / max_rank
+                + self.weights["mentions"] * (math.log1p(mentions) / math.log1p(max_mentions) if max_mentions else 0.0)
+            ) / ((self.weights["pagerank"] + self.weights["mentions"]) or 1.0)
+            scores[node_id] = {
+                "importance": round(importance, 6),
+                "importance_pagerank": ranks[node_id],
+                "importance_degree": entity["degree"],
+                "mention_count": mentions,
+                "last_mentioned_at": last_mentioned_at,
+            }
+        self.graph_store.write_entity_importance(scores)
+
+        self.checkpoint["last_id"] = max(max_log_id, last_id)
+        self.checkpoint["processed"] += len(scores)
+        self.logger.save_checkpoint(self.checkpoint)
+        elapsed = time.monotonic() - started
+        print(f"⭐ 實體重要性已更新: {len(scores)} 個實體, {len(edges)} 條關係, "
+              f"檢查點 id={self.checkpoint['last_id']}, 耗時 {elapsed:.2f} 秒")
+        return {"skipped": False, "entities": len(scores), "edges": len(edges),
+                "last_id": self.checkpoint["last_id"], "elapsed_seconds": round(elapsed, 2)}
+
+    @classmethod
+    def shared(cls, graph_store, conversation_logger, interval_seconds: float) -> "EntityImportanceJob":
+        """進程內只啟動一個定期任務, 多個 AI 秘書實例共用; 每次調用對應一次 release()"""
+        with cls._shared_lock:
+            cls._shared_users.append((graph_store, conversation_logger))
+            if cls._shared is None or cls._shared._stop.is_set():
+                cls._shared = cls(graph_store, conversation_logger)
+                cls._shared.start(interval_seconds)
+            return cls._shared
+
+    @classmethod
+    def release(cls, graph_store, conversation_logger):
+        """AI 秘書實例關閉前調用: 任務若正使用它的圖譜或對話記錄, 改用其他仍在使用的實例的; 沒有使用者時停止"""
+        with cls._shared_lock:
+            for index, (user_graph, user_logger) in enumerate(cls._shared_users):
+                if user_graph is graph_store and user_logger is conversation_logger:
+                    del cls._shared_users[index]
+                    break
+            job = cls._shared
+            if job is None:
+                return
+            if not cls._shared_users:
+                job.stop()
+                cls._shared = None
+            elif job.graph_store is graph_store or job.logger is conversation_logger:
+                with job._run_lock:
+                    job.graph_store, job.logger = cls._shared_users[-1]
+
+    def start(self, interval_seconds: float):
+        """在背景線程中定期執行."""
+        def loop():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.run()
+                except Exception as e:
+                    print(f"⚠️ 實體重要性計算失敗: {e}")
+
+        self._thread = threading.Thread(target=loop, name="entity-importance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def main():
+    """命令行入口: python entity_importance.py [--force]"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    os.environ["MEMORY_INGEST_ASYNC"] = "false"
+    # 單次執行, 不啟動背景定期任務
+    os.environ["ENTITY_IMPORTANCE_INTERVAL_SECONDS"] = "0"
+    from memory_manager import MemoryManager
+
+    parser = argparse.ArgumentParser(description="計算圖譜實體的重要性分數")
+    parser.add_argument("--force", action="store_true", help="即使沒有新知識也重新計算")
+    args = parser.parse_args()
+
+    memory_manager = MemoryManager(
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        neo4j_uri=os.getenv("NEO4J_URI", "neo4j://localhost:7687"),
+        neo4j_user=os.getenv("NEO4J_USER", "neo4j"),
+        neo4j_password=os.getenv("NEO4J_PASSWORD", "password")
+    )
+    try:
+        job = EntityImportanceJob(memory_manager.graph_store, memory_manager.conversation_logger)
+        print(f"✅ {job.run(force=args.force)}")
+    finally:
+        memory_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+記憶圖譜後端模組
+定義圖譜存儲的統一接口 (寫入知識、關鍵詞搜索實體、展開相鄰節點),
+並提供進程內的鄰接表實現: 單用戶部署不需要網絡往返, 整條記憶流程也可以離線壓測
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from graph_schema import GraphSchemaManager
+
+
+class GraphMemoryBackend(ABC):
+    """圖譜記憶後端接口
+
+    搜索結果格式:
+        {"entity": {...屬性}, "labels": [...], "text_score": float, "importance": 預先計算的結構重要性 (0-1, 尚未計算時為 None),
+         "last_mentioned_at": 最近提及時間 (epoch 毫秒, 查詢時計算近期分數),
+         "neighbors": [{"type": 關係類型, "properties": {...}, "entity": {...相鄰節點屬性}}]}
+    """
+
+    @abstractmethod
+    def store_knowledge_batch(self, items: List[Tuple[Dict[str, Any], int]]):
+        """把多條訊息的知識 (knowledge, source_log_id) 一次寫入."""
+
+    def store_knowledge(self, knowledge: Dict[str, Any], source_log_id: int):
+        """寫入一條訊息的知識."""
+        self.store_knowledge_batch([(knowledge, source_log_id)])
+
+    @abstractmethod
+    def search_entities(self, query: str, limit: int = 5, neighbor_limit: int = None) -> List[Dict[str, Any]]:
+        """按關鍵詞搜索實體 (limit 作用於實體), 並帶回有限數量的相鄰節點."""
+
+    @abstractmethod
+    def expand_neighbors(self, name: str, label: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """展開指定實體的相鄰節點."""
+
+    @abstractmethod
+    def load_entity_graph(self) -> Tuple[Dict[Any, Dict[str, Any]], List[Tuple[Any, Any]]]:
+        """讀取重要性計算所需的實體與關係.
+
+        返回 (entities, edges): entities 以節點 id 為鍵, 值包含 source_log_ids、degree 與已存的重要性屬性,
+        edges 為實體之間的 (來源 id, 目標 id)
+        """
+
+    @abstractmethod
+    def write_entity_importance(self, scores: Dict[Any, Dict[str, Any]]):
+        """把重要性分數寫回實體節點屬性 (節點 id -> 屬性)."""
+
+    @abstractmethod
+    def close(self):
+        """釋放資源."""
+
+    def canonical_name(self, name: str, label: Optional[str] = None) -> str:
+        """把別名解析為實體的正式名稱 (未知時原樣返回)."""
+        return name
+
+    async def astore_knowledge(self, knowledge: Dict[str, Any], source_log_id: int):
+        await self.astore_knowledge_batch([(knowledge, source_log_id)])
+
+    async def astore_knowledge_batch(self, items: List[Tuple[Dict[str, Any], int]]):
+        await asyncio.to_thread(self.store_knowledge_batch, items)
+
+    async def asearch_entities(self, query: str, limit: int = 5, neighbor_limit: int = None) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.search_entities, query, limit, neighbor_limit)
+
+    @staticmethod
+    def default_neighbor_limit() -> int:
+        return int(os.getenv("GRAPH_SEARCH_NEIGHBOR_LIMIT", "10"))
+
+
+class InMemoryGraphBackend(GraphMemoryBackend):
+    """進程內鄰接表圖譜
+
+    - 節點以整數 id 存放, (標籤, 名稱) 與正規化名稱各有一個雜湊索引, 寫入語義與 Neo4j 後端一致
+    - 別名與名稱一樣進入正規化名稱索引, 以別名提及的實體合併到同一節點
+    - 名稱與屬性文本建立倒排索引 (英數詞按詞, 中日韓文字按雙字), 以 IDF 加權計分
+    - snapshot_path 不為空時, 啟動時載入快照, 關閉時 (以及每 snapshot_every 次寫入) 原子寫回
+    - shared() 讓同一快照路徑在進程內只有一個圖譜, 多個 AI 秘書實例共用, 最後一個使用者關閉時才寫回快照
+    """
+
+    ENTITY_LABELS_EXCLUDED = ("Event", "Summary")
+
+    _shared: Dict[str, "InMemoryGraphBackend"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, snapshot_path: str = None, snapshot_every: int = None):
+        self.snapshot_path = snapshot_path if snapshot_path is not None else os.getenv("GRAPH_SNAPSHOT_PATH", "")
+        self.snapshot_every = snapshot_every if snapshot_every is not None else \
+            int(os.getenv("GRAPH_SNAPSHOT_EVERY", "0"))
+        self._lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+        self._reset()
+        self._writes_since_snapshot = 0
+        # shared() 建立的實例: 共用表中的鍵與使用者數量
+        self._shared_key: Optional[str] = None
+        self._users = 0
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            self.load(self.snapshot_path)
+
+    @classmethod
+    def shared(cls, snapshot_path: str = None) -> "InMemoryGraphBackend":
+        """進程內按快照路徑共用的圖譜 (沒有快照路徑時全進程共用一個); 每次調用對應一次 close()."""
+        path = snapshot_path if snapshot_path is not None else os.getenv("GRAPH_SNAPSHOT_PATH", "")
+        key = os.path.abspath(path) if path else ""
+        with cls._shared_lock:
+            backend = cls._shared.get(key)
+            if backend is None:
+                backend = cls(snapshot_path=path)
+                backend._shared_key = key
+                cls._shared[key] = backend
+            backend._users += 1
+            return backend
+
+    def _reset(self):
+        self._next_id = 1
+        self._nodes: Dict[int, Dict[str, Any]] = {}
+        # (label, name) -> node_id
+        self._key_index: Dict[Tuple[str, str], int] = {}
+        # 正規化名稱 -> {node_id}
+        self._name_index: Dict[str, set] = defaultdict(set)
+        # 詞項 -> {node_id}
+        self._term_index: Dict[str, set] = defaultdict(set)
+        # node_id -> {edge_key}, edge_key = (source_id, target_id, rel_type)
+        self._adjacency: Dict[int, set] = defaultdict(set)
+        self._edges: Dict[Tuple[int, int, str], Dict[str, Any]] = {}
+
+    # ---------- 索引 ----------
+
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        return re.sub(r"\s+", " ", str(name)).strip().lower()
+
+    @staticmethod
+    def terms(text: str) -> List[str]:
+        """英數詞取整詞, 中日韓文字串取雙字 (單字串取單字)."""
+        terms = []
+        for token in re.findall(r"[a-z0-9@._+\-]+|[^\sa-z0-9\W_]+", str(text).lower()):
+            if token.isascii() or len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        return terms
+
+    def _index_terms(self, node_id: int, text: str):
+        for term in self.terms(text):
+            self._term_index[term].add(node_id)
+
+    def _create_node(self, labels: List[str], props: Dict[str, Any]) -> int:
+        node_id = self._next_id
+        self._next_id += 1
+        self._nodes[node_id] = {"labels": list(labels), "props": dict(props), "search_parts": []}
+        self._index_names(node_id)
+        return node_id
+
+    def _index_names(self, node_id: int):
+        node = self._nodes[node_id]
+        props = node["props"]
+        if props.get("name") and node["labels"][0] not in self.ENTITY_LABELS_EXCLUDED:
+            self._key_index[(node["labels"][0], props["name"])] = node_id
+            for name in [props["name"], *(props.get(GraphSchemaManager.ALIASES_PROPERTY) or [])]:
+                self._name_index[self.normalize_name(name)].add(node_id)
+
+    def _resolve(self, name: str, label: Optional[str] = None) -> Optional[int]:
+        """按 (標籤, 名稱) 或別名找到唯一的實體節點."""
+        if label is not None and (label, name) in self._key_index:
+            return self._key_index[(label, name)]
+        candidates = [node_id for node_id in self._name_index.get(self.normalize_name(name), ())
+                      if label is None or self._nodes[node_id]["labels"][0] == label]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def canonical_name(self, name: str, label: Optional[str] = None) -> str:
+        with self._lock:
+            node_id = self._resolve(name, label)
+            return self._nodes[node_id]["props"]["name"] if node_id is not None else name
+
+    def _add_search_parts(self, node_id: int, parts: List[str]):
+        node = self._nodes[node_id]
+        for part in parts:
+            if part not in node["search_parts"]:
+                node["search_parts"].append(part)
+                self._index_terms(node_id, part)
+
+    def _merge_edge(self, source_id: int, target_id: int, rel_type: str) -> Dict[str, Any]:
+        key = (source_id, target_id, rel_type)
+        if key not in self._edges:
+            self._edges[key] = {}
+            self._adjacency[source_id].add(key)
+            self._adjacency[target_id].add(key)
+        return self._edges[key]
+
+    @staticmethod
+    def _merge_ids(existing: List[int], new_ids: List[int]) -> List[int]:
+        return existing + [log_id for log_id in new_ids if log_id not in existing]
+
+    # ---------- 寫入 ----------
+
+    def store_knowledge_batch(self, items: List[Tuple[Dict[str, Any], int]]):
+        """與 Neo4j 後端相同的合併語義: 實體按 (標籤, 名稱) 合併, 關係按名稱匹配實體."""
+        with self._lock:
+            for data, source_log_id in items:
+                for entity in data.get("entities", []):
+                    if not entity.get("name"):
+                        continue
+                    node_id = self._resolve(entity["name"], entity["type"])
+                    if node_id is None:
+                        node_id = self._create_node([entity["type"]], {"name": entity["name"]})
+                    node = self._nodes[node_id]
+                    name = node["props"]["name"]
+                    node["props"].update(entity.get("attributes") or {})
+                    node["props"]["name"] = name
+                    aliases = node["props"].get(GraphSchemaManager.ALIASES_PROPERTY, [])
+                    new_aliases = [
+                        alias for alias in dict.fromkeys([entity["name"], *(entity.get("aliases") or [])])
+                        if alias and alias != name and alias not in aliases
+                    ]
+                    if new_aliases:
+                        node["props"][GraphSchemaManager.ALIASES_PROPERTY] = aliases + new_aliases
+                    node["props"]["source_log_ids"] = self._merge_ids(
+                        node["props"].get("source_log_ids", []), [source_log_id]
+                    )
+                    self._index_names(node_id)
+                    self._add_search_parts(node_id, GraphSchemaManager.search_parts(node["props"]))
+
+                for relation in data.get("relations", []):
+                    sources = self._name_index.get(self.normalize_name(relation["source"]), ())
+                    targets = self._name_index.get(self.normalize_name(relation["target"]), ())
+                    for source_id in list(sources):
+                        for target_id in list(targets):
+                            props = self._merge_edge(source_id, target_id, "RELATED_TO")
+                            props["type"] = relation["type"]
+                            props["source_log_ids"] = self._merge_ids(props.get("source_log_ids", []), [source_log_id])
+
+                for event in data.get("events", []):
+                    event_id = self._create_node(["Event"], {
+                        "id": str(uuid.uuid4()), "description": event["description"],
+                        "date": event.get("date"), "source_log_id": source_log_id
+                    })
+                    if event.get("actor"):
+                        person_id = self._resolve(event["actor"], "Person")
+                        if person_id is not None:
+                            self._merge_edge(person_id, event_id, "PERFORMED")
+
+                if data.get("summary"):
+                    self._create_node(["Summary"], {
+                        "id": str(uuid.uuid4()), "text": data["summary"], "source_log_id": source_log_id
+                    })
+
+            self._writes_since_snapshot += 1
+            due = bool(self.snapshot_path and self.snapshot_every
+                       and self._writes_since_snapshot >= self.snapshot_every)
+        # 在圖譜鎖外觸發: snapshot() 先取快照鎖再取圖譜鎖; 已有快照在寫入時不排隊 (計數保留到下次)
+        if due and not self._snapshot_lock.locked():
+            self.snapshot(self.snapshot_path)
+
+    # ---------- 讀取 ----------
+
+    def _neighbors(self, node_id: int, limit: int) -> List[Dict[str, Any]]:
+        neighbors = []
+        for key in list(self._adjacency.get(node_id, ()))[:limit]:
+            source_id, target_id, rel_type = key
+            other_id = target_id if source_id == node_id else source_id
+            props = self._edges[key]
+            neighbors.append({
+                "type": props.get("type", rel_type),
+                "properties": dict(props),
+                "entity": GraphSchemaManager.public_properties(self._nodes[other_id]["props"]),
+            })
+        return neighbors
+
+    def search_entities(self, query: str, limit: int = 5, neighbor_limit: int = None) -> List[Dict[str, Any]]:
+        if neighbor_limit is None:
+            neighbor_limit = self.default_neighbor_limit()
+        query_terms = set(self.terms(query))
+        with self._lock:
+            total = max(len(self._nodes), 1)
+            scores: Dict[int, float] = defaultdict(float)
+            for term in query_terms:
+                matches = self._term_index.get(term)
+                if not matches:
+                    continue
+                idf = math.log(1 + total / len(matches))
+                for node_id in matches:
+                    scores[node_id] += idf
+            # 名稱完全命中優先
+            for node_id in self._name_index.get(self.normalize_name(query), ()):
+                scores[node_id] += 10.0
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            return [
+                {
+                    "entity": GraphSchemaManager.public_properties(self._nodes[node_id]["props"]),
+                    "labels": list(self._nodes[node_id]["labels"]),
+                    "text_score": score,
+                    "importance": self._nodes[node_id]["props"].get("importance"),
+                    "last_mentioned_at": self._nodes[node_id]["props"].get("last_mentioned_at"),
+                    "neighbors": self._neighbors(node_id, neighbor_limit),
+                }
+                for node_id, score in ranked
+            ]
+
+    def expand_neighbors(self, name: str, label: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        with self._lock:
+            if label is not None:
+                node_id = self._key_index.get((label, name))
+                node_ids = [node_id] if node_id is not None else []
+            else:
+                node_ids = list(self._name_index.get(self.normalize_name(name), ()))
+            neighbors = []
+            for node_id in node_ids:
+                neighbors.extend(self._neighbors(node_id, limit - len(neighbors)))
+                if len(neighbors) >= limit:
+                    break
+            return neighbors
+
+    def load_entity_graph(self) -> Tuple[Dict[Any, Dict[str, Any]], List[Tuple[Any, Any]]]:
+        with self._lock:
+            entities = {
+                node_id: {
+                    "source_log_ids": list(node["props"].get("source_log_ids", [])),
+                    "degree": len(self._adjacency.get(node_id, ())),
+                    **{key: node["props"].get(key) for key in GraphSchemaManager.IMPORTANCE_PROPERTIES},
+                }
+                for node_id, node in self._nodes.items()
+                if node["labels"][0] not in self.ENTITY_LABELS_EXCLUDED
+            }
+            edges = [(source_id, target_id) for source_id, target_id, rel_type in self._edges
+                     if rel_type == "RELATED_TO" and source_id in entities and target_id in entities]
+            return entities, edges
+
+    def write_entity_importance(self, scores: Dict[Any, Dict[str, Any]]):
+        with self._lock:
+            for node_id, props in scores.items():
+                if node_id in self._nodes:
+                    self._nodes[node_id]["props"].update(props)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"nodes": len(self._nodes), "edges": len(self._edges), "terms": len(self._term_index)}
+
+    # ---------- 快照 ----------
+
+    def snapshot(self, path: str = None):
+        """把圖譜原子寫入 JSON 快照文件.
+
+        快照鎖覆蓋序列化與寫入 (先於圖譜鎖取得), 並發的快照按序列化順序落盤, 舊內容不會覆蓋新內容
+        """
+        path = path or self.snapshot_path
+        with self._snapshot_lock:
+            with self._lock:
+                # 在鎖內序列化: data 引用的是實時的屬性字典, 鎖外序列化會與並發寫入衝突
+                payload = json.dumps({
+                    "version": 1,
+                    "next_id": self._next_id,
+                    "nodes": [[node_id, node["labels"], node["props"], node["search_parts"]]
+                              for node_id, node in self._nodes.items()],
+                    "edges": [[source_id, target_id, rel_type, props]
+                              for (source_id, target_id, rel_type), props in self._edges.items()],
+                }, ensure_ascii=False)
+                writes = self._writes_since_snapshot
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            with self._lock:
+                # 只扣除已寫入快照的部分, 序列化之後的寫入仍計入下次快照
+                self._writes_since_snapshot -= writes
+
+    def load(self, path: str):
+        """從快照載入圖譜並重建索引."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self._reset()
+            for node_id, labels, props, search_parts in data["nodes"]:
+                self._nodes[node_id] = {"labels": labels, "props": props, "search_parts": []}
+                self._index_names(node_id)
+                self._add_search_parts(node_id, search_parts)
+            for source_id, target_id, rel_type, props in data["edges"]:
+                self._merge_edge(source_id, target_id, rel_type).update(props)
+            self._next_id = data["next_id"]
+        print(f"📂 已載入圖譜快照: {len(self._nodes)} 個節點, {len(self._edges)} 條關係")
+
+    def close(self):
+        """寫回快照; shared() 建立的實例只在最後一個使用者關閉時寫回."""
+        if self._shared_key is not None:
+            with self._shared_lock:
+                self._users -= 1
+                if self._users > 0:
+                    return
+                if self._shared.get(self._shared_key) is self:
+                    del self._shared[self._shared_key]
+        if self.snapshot_path:
+            self.snapshot(self.snapshot_path)
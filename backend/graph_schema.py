@@ -0,0 +1,201 @@
+"""
+記憶圖譜結構模組
+啟動時為實體標籤建立名稱唯一約束, 為所有實體加上共用的 :Entity 標籤與名稱索引,
+並為 Event / Summary 節點建立 id 約束; 寫入時只按有索引的鍵匹配節點
+"""
+
+import os
+import threading
+from typing import Any, Dict, Iterable, List
+
+# 每個進程對每個數據庫只做一次結構初始化, 避免實例池中多個實例重複執行
+_bootstrapped_uris = set()
+_bootstrap_lock = threading.Lock()
+
+
+class GraphSchemaManager:
+    """記憶圖譜結構管理器"""
+
+    # 修改結構或遷移步驟時需遞增版本
+    SCHEMA_VERSION = 2
+    ENTITY_LABEL = "Entity"
+    FULLTEXT_INDEX = "entity_fulltext"
+    # 內部維護的屬性, 不參與全文索引也不返回給搜索結果
+    # 重要性任務 (entity_importance.py) 預先計算的分數
+    IMPORTANCE_PROPERTIES = ("importance", "importance_pagerank", "importance_degree",
+                             "mention_count", "last_mentioned_at")
+    INTERNAL_PROPERTIES = ("search_text", "source_log_ids") + IMPORTANCE_PROPERTIES
+    # 實體別名 (列表), 與名稱一樣以原文進入全文索引
+    ALIASES_PROPERTY = "aliases"
+    # Lucene 查詢語法中的特殊字元
+    LUCENE_SPECIAL = set('+-&|!(){}[]^"~*?:\\/')
+    # 以生成的 id 為鍵的節點類型
+    ID_LABELS = ("Event", "Summary")
+
+    def __init__(self, driver, uri: str = "", labels: Iterable[str] = None):
+        self.driver = driver
+        self.uri = uri
+        if labels is None:
+            labels = os.getenv("GRAPH_ENTITY_LABELS", "Person,Project,Organization,Role,Date,Task,Decision").split(",")
+        self.labels = [label.strip() for label in labels if label.strip()]
+        self.fulltext_analyzer = os.getenv("GRAPH_FULLTEXT_ANALYZER", "cjk")
+        self._ensured_labels = set()
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def escape(name: str) -> str:
+        """轉義 Cypher 標籤或名稱 (無法參數化)."""
+        return "`" + str(name).replace("`", "``") + "`"
+
+    @staticmethod
+    def _schema_name(prefix: str, label: str) -> str:
+        """約束/索引名稱只保留字母數字, 其他字元以十六進位表示."""
+        safe = "".join(ch if ch.isascii() and ch.isalnum() else f"_{ord(ch):x}" for ch in label)
+        return f"{prefix}_{safe}"
+
+    @staticmethod
+    def search_parts(props: Dict[str, Any]) -> List[str]:
+        """把實體名稱與屬性轉換為全文索引的文本片段 (名稱與別名為原文, 其他屬性為 "鍵: 值")."""
+        parts = [str(props["name"])] if props.get("name") else []
+        parts.extend(str(alias) for alias in props.get(GraphSchemaManager.ALIASES_PROPERTY) or [] if alias)
+        for key, value in props.items():
+            if key in ("name", GraphSchemaManager.ALIASES_PROPERTY) or key in GraphSchemaManager.INTERNAL_PROPERTIES \
+                    or value is None or value == "":
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ", ".join(str(item) for item in value)
+            parts.append(f"{key}: {value}")
+        return parts
+
+    @classmethod
+    def public_properties(cls, props: Dict[str, Any]) -> Dict[str, Any]:
+        """去掉內部維護的屬性."""
+        return {key: value for key, value in (props or {}).items() if key not in cls.INTERNAL_PROPERTIES}
+
+    @classmethod
+    def escape_lucene(cls, query: str) -> str:
+        """轉義全文查詢, 每個詞作為普通詞項 (以 OR 組合)."""
+        terms = []
+        for term in query.split():
+            escaped = "".join("\\" + ch if ch in cls.LUCENE_SPECIAL else ch for ch in term)
+            if escaped.upper() in ("AND", "OR", "NOT"):
+                escaped = escaped.lower()
+            terms.append(escaped)
+        return " ".join(terms)
+
+    def bootstrap_once(self):
+        """每個進程每個數據庫只初始化一次."""
+        if self._ready:
+            return
+        with _bootstrap_lock:
+            if self.uri in _bootstrapped_uris:
+                self._ensured_labels.update(self.labels)
+                self._ready = True
+                return
+            _bootstrapped_uris.add(self.uri)
+        try:
+            self.ensure_schema()
+            self._ready = True
+        except Exception as e:
+            with _bootstrap_lock:
+                _bootstrapped_uris.discard(self.uri)
+            print(f"⚠️ 圖譜結構初始化失敗 (將在下次寫入時重試): {e}")
+
+    def ensure_schema(self):
+        """建立約束與索引, 並按版本遷移舊數據."""
+        with self.driver.session() as session:
+            session.run(
+                f"CREATE INDEX entity_name IF NOT EXISTS FOR (n:{self.ENTITY_LABEL}) ON (n.name)"
+            ).consume()
+            for label in self.ID_LABELS:
+                session.run(
+                    f"CREATE CONSTRAINT {self._schema_name('id_unique', label)} IF NOT EXISTS "
+                    f"FOR (n:{self.escape(label)}) REQUIRE n.id IS UNIQUE"
+                ).consume()
+            # 實體名稱與屬性文本的全文索引 (cjk 分析器按雙字切分中日韓文字)
+            analyzer = self.fulltext_analyzer.replace("'", "")
+            session.run(
+                f"CREATE FULLTEXT INDEX {self.FULLTEXT_INDEX} IF NOT EXISTS "
+                f"FOR (n:{self.ENTITY_LABEL}) ON EACH [n.name, n.search_text] "
+                f"OPTIONS {{indexConfig: {{`fulltext.analyzer`: '{analyzer}'}}}}"
+            ).consume()
+            self._migrate(session)
+        self.ensure_labels(self.labels)
+        print(f"✅ 圖譜結構已初始化 (實體標籤: {', '.join(self.labels)})")
+
+    def _migrate(self, session):
+        """按版本遷移舊數據 (分批提交)."""
+        version = session.run(
+            "MERGE (m:GraphSchema {name: 'memory'}) RETURN coalesce(m.version, 0) AS version"
+        ).single()["version"]
+        if version >= self.SCHEMA_VERSION:
+            return
+        if version < 1:
+            self._migrate_v1(session)
+        if version < 2:
+            self._migrate_v2(session)
+        session.run(
+            "MATCH (m:GraphSchema {name: 'memory'}) SET m.version = $version", version=self.SCHEMA_VERSION
+        ).consume()
+
+    def _migrate_v1(self, session):
+        """v1: 為舊數據補上 :Entity 標籤與 Event/Summary 的 id."""
+        id_labels = " OR ".join(f"n:{self.escape(label)}" for label in self.ID_LABELS)
+        session.run(f"""
+            MATCH (n)
+            WHERE n.name IS NOT NULL AND NOT n:{self.ENTITY_LABEL} AND NOT n:GraphSchema
+              AND NOT ({id_labels})
+            CALL {{ WITH n SET n:{self.ENTITY_LABEL} }} IN TRANSACTIONS OF 1000 ROWS
+        """).consume()
+        for label in self.ID_LABELS:
+            session.run(f"""
+                MATCH (n:{self.escape(label)})
+                WHERE n.id IS NULL
+                CALL {{ WITH n SET n.id = randomUUID() }} IN TRANSACTIONS OF 1000 ROWS
+            """).consume()
+
+    def _migrate_v2(self, session, batch_size: int = 500):
+        """v2: 為已有實體生成全文索引文本 search_text."""
+        while True:
+            records = list(session.run(f"""
+                MATCH (n:{self.ENTITY_LABEL})
+                WHERE n.search_text IS NULL
+                RETURN id(n) AS node_id, properties(n) AS props
+                LIMIT $limit
+            """, limit=batch_size))
+            if not records:
+                return
+            rows = [
+                {"node_id": record["node_id"], "text": "\n".join(self.search_parts(record["props"]))}
+                for record in records
+            ]
+            session.run(f"""
+                UNWIND $rows AS row
+                MATCH (n:{self.ENTITY_LABEL}) WHERE id(n) = row.node_id
+                SET n.search_text = row.text
+            """, rows=rows).consume()
+
+    def ensure_labels(self, labels: Iterable[str]):
+        """為新出現的實體標籤建立名稱唯一約束 (結構操作不能與寫入放在同一事務中)."""
+        with self._lock:
+            missing = [label for label in dict.fromkeys(labels)
+                       if label and label != self.ENTITY_LABEL and label not in self._ensured_labels]
+        if not missing:
+            return
+        with self.driver.session() as session:
+            for label in missing:
+                try:
+                    session.run(
+                        f"CREATE CONSTRAINT {self._schema_name('name_unique', label)} IF NOT EXISTS "
+                        f"FOR (n:{self.escape(label)}) REQUIRE n.name IS UNIQUE"
+                    ).consume()
+                except Exception as e:
+                    # 已有重複名稱的舊數據無法建立唯一約束, 退回普通索引
+                    print(f"⚠️ 無法為 {label} 建立唯一約束, 改用索引: {e}")
+                    session.run(
+                        f"CREATE INDEX {self._schema_name('name_index', label)} IF NOT EXISTS "
+                        f"FOR (n:{self.escape(label)}) ON (n.name)"
+                    ).consume()
+                with self._lock:
+                    self._ensured_labels.add(label)
@@ -0,0 +1,128 @@
+"""
+圖譜寫入緩衝模組
+把多條訊息提取出的知識合併後在同一個圖譜事務中提交 (按數量或時間觸發),
+實體按 (標籤, 名稱) 去重, 每條知識保留 source_log_id 來源; 提交成功後才回調標記訊息已處理
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+
+class GraphWriteBuffer:
+    """圖譜知識寫入緩衝
+
+    - max_batch: 緩衝的知識數量達到即提交
+    - max_wait_ms: 最早一條知識的最長等待時間, 超過即提交
+    - 批次提交失敗時逐條重試, 單條錯誤的知識不影響其他訊息
+    """
+
+    def __init__(self, graph_store, max_batch: int = None, max_wait_ms: float = None):
+        self.graph_store = graph_store
+        self.max_batch = max_batch or int(os.getenv("GRAPH_WRITE_BUFFER_SIZE", "32"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else
+                         float(os.getenv("GRAPH_WRITE_BUFFER_WAIT_MS", "500"))) / 1000.0
+
+        self._cond = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._closed = False
+        self.stats = {"payloads": 0, "transactions": 0, "transactions_saved": 0, "failed": 0}
+        self._flusher = threading.Thread(target=self._flush_loop, name="graph-write-buffer", daemon=True)
+        self._flusher.start()
+
+    def add(self, knowledge: Dict[str, Any], source_log_id: int,
+            on_commit: Optional[Callable[[], None]] = None) -> Future:
+        """加入一條知識, 返回提交結果的 Future; on_commit 在事務提交成功後調用."""
+        future: Future = Future()
+        item = {
+            "knowledge": knowledge,
+            "source_log_id": source_log_id,
+            "on_commit": on_commit,
+            "future": future,
+            "added_at": time.monotonic(),
+        }
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("GraphWriteBuffer is closed")
+            self._pending.append(item)
+            self.stats["payloads"] += 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        return future
+
+    def pending_count(self) -> int:
+        """尚未提交的知識數量"""
+        with self._cond:
+            return len(self._pending)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        """取出一批待提交的知識 (調用方需持有鎖)"""
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        return batch
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending:
+                        wait = self._pending[0]["added_at"] + self.max_wait - time.monotonic()
+                        if len(self._pending) >= self.max_batch or wait <= 0 or self._closed:
+                            break
+                        self._cond.wait(wait)
+                    elif self._closed:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = self._take_batch()
+            self._commit(batch)
+
+    def flush(self):
+        """立即提交所有緩衝中的知識"""
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._commit(batch)
+
+    def _commit(self, batch: List[Dict[str, Any]]):
+        with self._commit_lock:
+            try:
+                self.graph_store.store_knowledge_batch(
+                    [(item["knowledge"], item["source_log_id"]) for item in batch]
+                )
+                self.stats["transactions"] += 1
+                self.stats["transactions_saved"] += len(batch) - 1
+                committed = batch
+            except Exception as e:
+                print(f"⚠️ 圖譜批次寫入失敗, 改為逐條寫入 ({len(batch)} 條): {e}")
+                committed = []
+                for item in batch:
+                    try:
+                        self.graph_store.store_knowledge(item["knowledge"], item["source_log_id"])
+                        self.stats["transactions"] += 1
+                        committed.append(item)
+                    except Exception as item_error:
+                        # 訊息保持未處理狀態, 由寫入隊列恢復或回填重新處理
+                        self.stats["failed"] += 1
+                        print(f"圖譜寫入錯誤 (訊息 {item['source_log_id']}): {item_error}")
+                        item["future"].set_exception(item_error)
+
+        for item in committed:
+            try:
+                if item["on_commit"] is not None:
+                    item["on_commit"]()
+                item["future"].set_result(True)
+            except Exception as e:
+                item["future"].set_exception(e)
+
+    def close(self):
+        """提交剩餘的知識並停止緩衝"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join(timeout=5)
+        self.flush()
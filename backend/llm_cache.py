@@ -0,0 +1,163 @@
+"""
+LLM 回應快取模組
+以 (提示模板版本, 模型, 發言者, 正規化訊息, 上下文) 的雜湊為鍵,
+把記憶篩選與知識提取的模型回應持久化在 SQLite 中, 支援 LRU/TTL 淘汰與命中統計
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict
+
+_MISS = object()
+
+
+class LLMResponseCache:
+    """持久化的 LLM 回應快取"""
+
+    MISS = _MISS
+    # 鍵的正規化規則版本: 規則改變時舊項目不再命中, 由 LRU/TTL 淘汰
+    KEY_VERSION = 2
+
+    def __init__(self, db_path: str = "llm_cache.db", max_entries: int = None,
+                 ttl_seconds: float = None, evict_every: int = 100):
+        self.db_path = db_path
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else \
+            float(os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+        self.evict_every = evict_every
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._writes_since_evict = 0
+        # 命中時只在內存記錄訪問時間與次數, 累積 evict_every 條或寫入/淘汰/關閉時才合併寫回
+        self._pending_access: Dict[str, list] = {}
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._init_db()
+
+    def _init_db(self):
+        """初始化快取表."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT,
+                    value TEXT,
+                    created_at REAL,
+                    last_access REAL,
+                    hit_count INTEGER DEFAULT 0
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            self._conn.commit()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """正規化文本: 全半形統一、小寫、合併空白與重複標點、去除句末句號
+
+        問號與驚嘆號保留在鍵中: 問句與陳述句是否值得記憶不同, 不能共用快取
+        """
+        text = unicodedata.normalize("NFKC", text or "").lower()
+        text = re.sub(r"\s+", " ", text).strip()
+        text = re.sub(r"([!?~])\1+", r"\1", text)
+        return text.rstrip("。. ")
+
+    def make_key(self, template_version: str, model: str, speaker: str, message: str,
+                 context: str = "", extra: Any = None) -> str:
+        """計算快取鍵"""
+        payload = json.dumps(
+            [self.KEY_VERSION, template_version, model, speaker, self.normalize(message), self.normalize(context), extra],
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, default: Any = _MISS) -> Any:
+        """讀取快取; 未命中或已過期時返回 default (預設為 LLMResponseCache.MISS)"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl_seconds > 0 and row[1] < now - self.ttl_seconds):
+                self.stats["misses"] += 1
+                return default
+            access = self._pending_access.setdefault(key, [now, 0])
+            access[0] = now
+            access[1] += 1
+            if len(self._pending_access) >= self.evict_every:
+                self._flush_access_locked()
+                self._conn.commit()
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def _flush_access_locked(self):
+        """把累積的命中寫回 last_access / hit_count (調用方需持有鎖並負責提交)"""
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            "UPDATE llm_cache SET last_access = MAX(last_access, ?), hit_count = hit_count + ? WHERE key = ?",
+            [(last_access, hits, key) for key, (last_access, hits) in self._pending_access.items()]
+        )
+        self._pending_access.clear()
+
+    def set(self, key: str, value: Any, namespace: str = ""):
+        """寫入快取 (value 需可序列化為 JSON)"""
+        now = time.time()
+        with self._lock:
+            self._pending_access.pop(key, None)
+            self._flush_access_locked()
+            self._conn.execute("""
+                INSERT OR REPLACE INTO llm_cache (key, namespace, value, created_at, last_access, hit_count)
+                VALUES (?, ?, ?, ?, ?, 0)
+            """, (key, namespace, json.dumps(value, ensure_ascii=False), now, now))
+            self._conn.commit()
+            self.stats["writes"] += 1
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.evict_every:
+                self._writes_since_evict = 0
+                self._evict_locked(now)
+
+    def _evict_locked(self, now: float):
+        """淘汰過期項目, 並按最近訪問時間淘汰超出上限的項目 (調用方需持有鎖)"""
+        evicted = 0
+        self._flush_access_locked()
+        if self.ttl_seconds > 0:
+            evicted += self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > self.max_entries:
+            evicted += self._conn.execute("""
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_access LIMIT ?
+                )
+            """, (count - self.max_entries,)).rowcount
+        self._conn.commit()
+        self.stats["evictions"] += evicted
+
+    def evict(self):
+        """立即執行淘汰"""
+        with self._lock:
+            self._evict_locked(time.time())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取命中統計"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] / lookups) if lookups else 0.0
+        return stats
+
+    def close(self):
+        """關閉數據庫連接"""
+        with self._lock:
+            self._flush_access_locked()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,355 @@
+"""
+對話日誌冷存儲模組
+把超過保留期且已處理的 conversation_logs 按月份移入壓縮分段文件 (gzip, 可選 zstd),
+每個分段附帶 JSON 側車索引, 記錄每個會話所在的壓縮成員位置, 可按需讀回單個會話
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd 為可選依賴
+    zstandard = None
+
+
+class ConversationArchiver:
+    """對話日誌歸檔器
+
+    - 分段文件: <archive_dir>/conversation_logs-YYYY-MM.jsonl.gz (或 .zst), 每行一條 JSON 訊息
+    - 每批每個會話寫入一個獨立的壓縮成員, 多個成員串接後仍是合法的 gzip/zstd 流, 可整段流式讀取
+    - 側車索引: <分段>.idx.json, 記錄已提交的文件長度與每個會話的 [offset, length, count]
+    - 寫入順序: journal 記錄 id 與各分段追加前的索引狀態 -> 分段 fsync -> 索引原子替換
+      -> journal 改為刪除階段 -> 刪除熱表訊息; 重啟時追加階段的 journal 把分段與索引回滾到追加前
+      (訊息仍在熱表, 下次重新歸檔), 刪除階段的 journal 重做刪除, 任一步驟崩潰後重跑都不會遺失或重複訊息
+    """
+
+    SEGMENT_PREFIX = "conversation_logs-"
+    EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+    JOURNAL_NAME = "pending_delete.json"
+
+    def __init__(self, conversation_logger, archive_dir: str = None, max_age_days: float = None,
+                 compression: str = None, batch_size: int = None):
+        self.logger = conversation_logger
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(conversation_logger.db_path)), "log_archive")
+        self.archive_dir = archive_dir or os.getenv("CONVERSATION_ARCHIVE_DIR", default_dir)
+        self.max_age_days = max_age_days if max_age_days is not None else \
+            float(os.getenv("CONVERSATION_ARCHIVE_MAX_AGE_DAYS", "90"))
+        self.batch_size = batch_size or int(os.getenv("CONVERSATION_ARCHIVE_BATCH_SIZE", "5000"))
+
+        compression = (compression or os.getenv("CONVERSATION_ARCHIVE_COMPRESSION", "gzip")).lower()
+        if compression == "zstd" and zstandard is None:
+            print("⚠️ 未安裝 zstandard, 對話日誌歸檔改用 gzip")
+            compression = "gzip"
+        if compression not in self.EXTENSIONS:
+            raise ValueError(f"不支援的壓縮格式: {compression}")
+        self.compression = compression
+
+        self._lock = threading.Lock()
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self._replay_journal()
+
+    # ---------- 壓縮格式 ----------
+
+    def _compress(self, data: bytes, compression: str) -> bytes:
+        if compression == "zstd":
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def _decompress(self, data: bytes, compression: str) -> bytes:
+        if compression == "zstd":
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    # ---------- 分段與索引 ----------
+
+    def _segment_path(self, month: str, compression: str = None) -> str:
+        extension = self.EXTENSIONS[compression or self.compression]
+        return os.path.join(self.archive_dir, f"{self.SEGMENT_PREFIX}{month}{extension}")
+
+    def _find_segment(self, month: str) -> Optional[str]:
+        """查找某月份已存在的分段 (可能以其他壓縮格式寫入)."""
+        for compression in self.EXTENSIONS:
+            path = self._segment_path(month, compression)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _index_path(segment_path: str) -> str:
+        return segment_path + ".idx.json"
+
+    def _load_index(self, segment_path: str, compression: str) -> Dict[str, Any]:
+        try:
+            with open(self._index_path(segment_path), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 1, "compression": compression, "size": 0, "count": 0,
+                    "min_timestamp": None, "max_timestamp": None, "sessions": {}}
+
+    @staticmethod
+    def _write_json_atomic(path: str, data: Any):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def list_segments(self) -> List[Dict[str, Any]]:
+        """列出所有分段及其索引摘要 (按月份排序)."""
+        segments = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            for compression, extension in self.EXTENSIONS.items():
+                if name.startswith(self.SEGMENT_PREFIX) and name.endswith(extension):
+                    path = os.path.join(self.archive_dir, name)
+                    index = self._load_index(path, compression)
+                    segments.append({
+                        "month": name[len(self.SEGMENT_PREFIX):-len(extension)],
+                        "path": path,
+                        "compression": index["compression"],
+                        "count": index["count"],
+                        "sessions": len(index["sessions"]),
+                        "bytes": index["size"],
+                    })
+        return segments
+
+    # ---------- 歸檔 ----------
+
+    @staticmethod
+    def _month_of(timestamp_ms: int) -> str:
+        return datetime.fromtimestamp(timestamp_ms / 1000).strftime("%Y-%m")
+
+    def _open_segment(self, month: str):
+        """返回某月份要追加的分段路徑、壓縮格式與當前索引."""
+        segment_path = self._find_segment(month) or self._segment_path(month)
+        compression = "zstd" if segment_path.endswith(self.EXTENSIONS["zstd"]) else "gzip"
+        return segment_path, compression, self._load_index(segment_path, compression)
+
+    def _append_month(self, month: str, rows: List[Dict[str, Any]]):
+        """把一個月份的訊息按會話寫成壓縮成員追加到分段, 再更新索引."""
+        segment_path, compression, index = self._open_segment(month)
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError(f"分段 {segment_path} 需要 zstandard 才能追加")
+
+        by_session = defaultdict(list)
+        for row in rows:
+            by_session[row["session_id"]].append(row)
+
+        with open(segment_path, "ab") as f:
+            # 丟棄上次崩潰時寫入但未記入索引的尾部
+            f.truncate(index["size"])
+            f.seek(index["size"])
+            offset = index["size"]
+            for session_id, session_rows in by_session.items():
+                payload = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in session_rows)
+                member = self._compress(payload.encode("utf-8"), compression)
+                f.write(member)
+                index["sessions"].setdefault(session_id or "", []).append([offset, len(member), len(session_rows)])
+                offset += len(member)
+            f.flush()
+            os.fsync(f.fileno())
+
+        timestamps = [row["timestamp"] for row in rows]
+        index["size"] = offset
+        index["count"] += len(rows)
+        index["min_timestamp"] = min(filter(None, [index["min_timestamp"], min(timestamps)]))
+        index["max_timestamp"] = max(filter(None, [index["max_timestamp"], max(timestamps)]))
+        self._write_json_atomic(self._index_path(segment_path), index)
+
+    def _rollback_segment(self, state: Dict[str, Any]):
+        """把分段與索引恢復到 journal 記錄的追加前狀態 (丟棄該批寫入的成員)."""
+        segment_path = state["path"]
+        index = self._load_index(segment_path, state["compression"])
+        if index["size"] > state["size"]:
+            sessions = {}
+            for session_id, members in index["sessions"].items():
+                kept = [member for member in members if member[0] < state["size"]]
+                if kept:
+                    sessions[session_id] = kept
+            index.update(sessions=sessions, size=state["size"], count=state["count"],
+                         min_timestamp=state["min_timestamp"], max_timestamp=state["max_timestamp"])
+            self._write_json_atomic(self._index_path(segment_path), index)
+        if os.path.exists(segment_path) and os.path.getsize(segment_path) > state["size"]:
+            with open(segment_path, "r+b") as f:
+                f.truncate(state["size"])
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _replay_journal(self) -> int:
+        """處理上次未完成的批次: 追加階段回滾分段, 刪除階段重做熱表刪除 (id 不會重用, 重複刪除無副作用)."""
+        journal_path = os.path.join(self.archive_dir, self.JOURNAL_NAME)
+        if not os.path.exists(journal_path):
+            return 0
+        with open(journal_path, "r", encoding="utf-8") as f:
+            journal = json.load(f)
+        if isinstance(journal, list):  # 舊版 journal 只記錄待刪除的 id
+            journal = {"phase": "delete", "ids": journal}
+        if journal["phase"] == "append":
+            for state in journal["segments"]:
+                self._rollback_segment(state)
+            os.remove(journal_path)
+            print(f"♻️ 已回滾上次中斷的歸檔批次: {len(journal['ids'])} 條訊息留在熱表")
+            return 0
+        deleted = self.logger.delete_messages(journal["ids"])
+        os.remove(journal_path)
+        if deleted:
+            print(f"♻️ 已完成上次中斷的歸檔刪除: {deleted} 條訊息")
+        return deleted
+
+    def archive_batch(self, before_ms: int, limit: int = None) -> int:
+        """歸檔一批早於 before_ms 的已處理訊息, 返回歸檔數量."""
+        # 同一進程內上一批中途失敗時, 先回滾或完成它, 再記錄新的 journal
+        self._replay_journal()
+        rows = self.logger.get_archivable_messages(before_ms, min(limit or self.batch_size, self.batch_size))
+        if not rows:
+            return 0
+        by_month = defaultdict(list)
+        for row in rows:
+            by_month[self._month_of(row["timestamp"])].append(row)
+        message_ids = [row["id"] for row in rows]
+
+        # 追加前先記錄每個分段的索引狀態, 崩潰後據此回滾, 避免重跑時重複歸檔
+        segments = []
+        for month in by_month:
+            segment_path, compression, index = self._open_segment(month)
+            segments.append({"path": segment_path, "compression": compression, "size": index["size"],
+                             "count": index["count"], "min_timestamp": index["min_timestamp"],
+                             "max_timestamp": index["max_timestamp"]})
+        journal_path = os.path.join(self.archive_dir, self.JOURNAL_NAME)
+        self._write_json_atomic(journal_path, {"phase": "append", "ids": message_ids, "segments": segments})
+        for month, month_rows in by_month.items():
+            self._append_month(month, month_rows)
+
+        # 分段與索引已落盤, journal 轉為刪除階段, 再從熱表刪除
+        self._write_json_atomic(journal_path, {"phase": "delete", "ids": message_ids})
+        self.logger.delete_messages(message_ids)
+        os.remove(journal_path)
+        return len(rows)
+
+    def run(self, max_age_days: float = None, max_messages: Optional[int] = None,
+            vacuum: bool = False) -> Dict[str, Any]:
+        """歸檔所有超過保留期的已處理訊息."""
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        before_ms = self.logger.now_ms() - int(max_age_days * 24 * 3600 * 1000)
+        started_at = time.monotonic()
+        archived = 0
+        with self._lock:
+            while max_messages is None or archived < max_messages:
+                count = self.archive_batch(before_ms, None if max_messages is None else max_messages - archived)
+                if not count:
+                    break
+                archived += count
+                print(f"🗄️ 已歸檔 {archived} 條對話日誌")
+            if vacuum and archived:
+                self.logger.vacuum()
+        return {
+            "archived": archived,
+            "before": self.logger.format_timestamp(before_ms),
+            "elapsed_seconds": round(time.monotonic() - started_at, 2),
+        }
+
+    # ---------- 讀取 ----------
+
+    def iter_segment(self, month: str) -> Iterator[Dict[str, Any]]:
+        """流式讀取一個月份分段中的所有訊息 (不一次性解壓到內存)."""
+        segment_path = self._find_segment(month)
+        if segment_path is None:
+            return
+        index = self._load_index(segment_path, "zstd" if segment_path.endswith(".zst") else "gzip")
+        if not index["size"]:
+            return
+        with open(segment_path, "rb") as raw:
+            # 只讀取索引記錄的長度, 忽略崩潰遺留的尾部
+            limited = io.BufferedReader(_LimitedReader(raw, index["size"]))
+            if index["compression"] == "zstd":
+                stream = zstandard.ZstdDecompressor().stream_reader(limited, read_across_frames=True)
+            else:
+                stream = gzip.GzipFile(fileobj=limited, mode="rb")
+            with io.TextIOWrapper(stream, encoding="utf-8") as lines:
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def get_session_messages(self, session_id: str, months: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """按索引只解壓指定會話的壓縮成員, 返回按時間排序的已歸檔訊息."""
+        messages = []
+        for segment in self.list_segments():
+            if months is not None and segment["month"] not in months:
+                continue
+            index = self._load_index(segment["path"], segment["compression"])
+            members = index["sessions"].get(session_id or "", [])
+            if not members:
+                continue
+            with open(segment["path"], "rb") as f:
+                for offset, length, _ in members:
+                    f.seek(offset)
+                    data = self._decompress(f.read(length), index["compression"])
+                    messages.extend(json.loads(line) for line in data.decode("utf-8").splitlines() if line)
+        messages.sort(key=lambda row: (row["timestamp"], row["id"]))
+        return messages
+
+
+class _LimitedReader(io.RawIOBase):
+    """只允許讀取文件前 size 字節的包裝器."""
+
+    def __init__(self, raw, size: int):
+        self._raw = raw
+        self._remaining = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._remaining <= 0:
+            return 0
+        data = self._raw.read(min(len(buffer), self._remaining))
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+
+def main():
+    """命令行入口: python log_archive.py [--max-age-days N] [--vacuum] [--session ID]"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    from memory_manager import ConversationLogger
+
+    parser = argparse.ArgumentParser(description="把舊的已處理對話日誌歸檔為按月壓縮的分段文件")
+    parser.add_argument("--db", default="conversation_logs.db", help="對話日誌數據庫路徑")
+    parser.add_argument("--archive-dir", default=None, help="分段文件目錄")
+    parser.add_argument("--max-age-days", type=float, default=None, help="保留在熱表中的天數")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None, help="壓縮格式")
+    parser.add_argument("--limit", type=int, default=None, help="本次最多歸檔的訊息數量")
+    parser.add_argument("--vacuum", action="store_true", help="歸檔後回收數據庫空間")
+    parser.add_argument("--list", action="store_true", help="列出已有的分段")
+    parser.add_argument("--session", default=None, help="從歸檔中讀取指定會話並輸出 JSON Lines")
+    args = parser.parse_args()
+
+    logger = ConversationLogger(args.db)
+    try:
+        archiver = ConversationArchiver(logger, archive_dir=args.archive_dir, max_age_days=args.max_age_days,
+                                        compression=args.compression)
+        if args.list:
+            for segment in archiver.list_segments():
+                print(json.dumps(segment, ensure_ascii=False))
+        elif args.session is not None:
+            for row in archiver.get_session_messages(args.session):
+                print(json.dumps(row, ensure_ascii=False))
+        else:
+            result = archiver.run(max_messages=args.limit, vacuum=args.vacuum)
+            print(f"✅ 歸檔完成: {result}")
+    finally:
+        logger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from agent_core import create_agent, get_agent_prompt
+from agent_core import create_agent, get_agent_prompt, stream_agent_events
 from memory_manager import MemoryManager
 from tools import get_all_tools
 from mcp_integration import MCPManager
@@ -124,6 +124,27 @@ class AISecretary:
             print(error_msg)
             return error_msg
     
+    def stream_chat(self, user_input: str):
+        """與 AI 秘書對話（串流版本），逐步產生思考、工具調用與最終答案事件。"""
+        try:
+            # 記錄用戶輸入
+            self.memory_manager.process_message(self.session_id, "user", user_input)
+            
+            ai_response = ""
+            for event in stream_agent_events(self.agent, {"input": user_input}):
+                if event["type"] == "final":
+                    ai_response = event["content"]
+                yield event
+            
+            # 記錄 AI 回覆
+            if ai_response:
+                self.memory_manager.process_message(self.session_id, "assistant", ai_response)
+        
+        except Exception as e:
+            error_msg = f"處理請求時發生錯誤：{str(e)}"
+            print(error_msg)
+            yield {"type": "error", "content": error_msg}
+    
     def get_mcp_status(self) -> dict:
         """獲取 MCP 服務器狀態"""
         if not self.mcp_manager:
@@ -136,6 +157,8 @@ class AISecretary:
     
     def close(self):
         """關閉 AI 秘書。"""
+        # 先排空背景記憶寫入隊列，確保已記錄的訊息完成處理
+        self.memory_manager.drain_ingestion()
         self.memory_manager.close()
         if self.mcp_manager:
             self.mcp_manager.disconnect_all()
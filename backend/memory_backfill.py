@@ -0,0 +1,170 @@
+"""
+記憶回填模組
+按 id 鍵集分頁掃描 conversation_logs 中的未處理訊息, 以有限並發送往記憶寫入流程,
+每頁完成後持久化檢查點, 崩潰後重啟不會重做已完成的工作
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+
+class BackfillWorker:
+    """可恢復的記憶回填工作器"""
+
+    def __init__(self, memory_manager, name: str = "default", page_size: int = None,
+                 concurrency: int = None, context_size: int = 3):
+        self.memory_manager = memory_manager
+        self.logger = memory_manager.conversation_logger
+        self.name = name
+        self.page_size = page_size or int(os.getenv("BACKFILL_PAGE_SIZE", "100"))
+        # 同時進行中的 Gemini 請求上限
+        self.concurrency = concurrency or int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+        self.context_size = context_size
+
+        self.checkpoint = self.logger.get_checkpoint(name)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._started_at: Optional[float] = None
+        self._run_processed = 0
+
+    def reset(self):
+        """清除檢查點, 下次從頭掃描 (已處理的訊息仍會被跳過)"""
+        self.checkpoint = {"name": self.name, "last_id": 0, "processed": 0,
+                           "stored": 0, "skipped": 0, "failed": 0, "updated_at": None}
+        self.logger.save_checkpoint(self.checkpoint)
+
+    def stop(self):
+        """請求在當前頁完成後停止"""
+        self._stop.set()
+
+    def _process_row(self, row: Dict[str, Any]):
+        job = {
+            "id": row["id"],
+            "session_id": row["session_id"],
+            "speaker": row["speaker"],
+            "message": row["message"],
+            "timestamp": row["timestamp"],
+            "context": self.logger.get_recent_context(row["session_id"], row["id"], self.context_size),
+            "current_entities": [],
+        }
+        try:
+            status = self.memory_manager.ingest_message(job)
+        except Exception as e:
+            # 失敗的訊息保持 pending 狀態, 可在 reset 後重試
+            print(f"回填錯誤 (訊息 {row['id']}): {e}")
+            status = "failed"
+        commit = job.get("graph_commit")
+        if commit is not None:
+            # 知識還在圖譜寫入緩衝中, 提交後才計數
+            return commit
+        self._count(status)
+        return None
+
+    def _count(self, status: str):
+        with self._lock:
+            self.checkpoint["processed"] += 1
+            self.checkpoint[status if status in ("stored", "skipped") else "failed"] += 1
+            self._run_processed += 1
+
+    def _wait_commit(self, commit) -> str:
+        """等待緩衝中的圖譜寫入提交, 返回最終狀態."""
+        error = commit.exception()
+        if error is not None:
+            print(f"回填錯誤 (圖譜寫入): {error}")
+            return "failed"
+        return "stored"
+
+    def run(self, max_messages: Optional[int] = None) -> Dict[str, Any]:
+        """執行回填直到沒有未處理訊息、達到 max_messages 或收到停止請求"""
+        self._started_at = time.monotonic()
+        self._run_processed = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="memory-backfill") as executor:
+            while not self._stop.is_set():
+                limit = self.page_size
+                if max_messages is not None:
+                    limit = min(limit, max_messages - self._run_processed)
+                    if limit <= 0:
+                        break
+                rows = self.logger.get_unprocessed_messages(limit=limit, after_id=self.checkpoint["last_id"])
+                if not rows:
+                    break
+
+                # 整頁完成後才推進檢查點, 頁內已完成的訊息因狀態已更新而不會被重做
+                commits = [commit for commit in executor.map(self._process_row, rows) if commit is not None]
+                # 向量寫入不影響訊息的處理狀態, 推進檢查點前先寫入本頁緩衝的向量
+                if self.memory_manager.vector_write_buffer is not None:
+                    self.memory_manager.vector_write_buffer.flush()
+                # 本頁緩衝的知識全部提交 (包括背景線程正在提交的批次) 後才推進檢查點
+                if self.memory_manager.graph_write_buffer is not None:
+                    self.memory_manager.graph_write_buffer.flush()
+                for commit in commits:
+                    self._count(self._wait_commit(commit))
+                self.checkpoint["last_id"] = rows[-1]["id"]
+                self.logger.save_checkpoint(self.checkpoint)
+                self._print_progress()
+        return self.get_progress()
+
+    def get_progress(self) -> Dict[str, Any]:
+        """獲取進度與吞吐量"""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        remaining = self.logger.count_unprocessed_messages(after_id=self.checkpoint["last_id"])
+        throughput = (self._run_processed / elapsed) if elapsed > 0 else 0.0
+        return {
+            **{key: self.checkpoint[key] for key in ("name", "last_id", "processed", "stored", "skipped", "failed")},
+            "remaining": remaining,
+            "elapsed_seconds": round(elapsed, 2),
+            "messages_per_second": round(throughput, 2),
+            "eta_seconds": round(remaining / throughput, 1) if throughput > 0 else None,
+        }
+
+    def _print_progress(self):
+        progress = self.get_progress()
+        print(f"📦 回填進度: 已處理 {progress['processed']} (存入 {progress['stored']}, "
+              f"跳過 {progress['skipped']}, 失敗 {progress['failed']}), 剩餘 {progress['remaining']}, "
+              f"{progress['messages_per_second']} 條/秒, 檢查點 id={progress['last_id']}")
+
+
+def main():
+    """命令行入口: python memory_backfill.py [--reset] [--limit N]"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    # 回填時直接同步處理, 不啟動背景寫入隊列
+    os.environ["MEMORY_INGEST_ASYNC"] = "false"
+    # 回填時預設合併向量與圖譜寫入 (可用 VECTOR_WRITE_BUFFER=false / GRAPH_WRITE_BUFFER=false 關閉)
+    os.environ.setdefault("VECTOR_WRITE_BUFFER", "true")
+    os.environ.setdefault("GRAPH_WRITE_BUFFER", "true")
+    from memory_manager import MemoryManager
+
+    parser = argparse.ArgumentParser(description="回填 conversation_logs 中未處理的訊息到長期記憶")
+    parser.add_argument("--name", default="default", help="檢查點名稱")
+    parser.add_argument("--page-size", type=int, default=None, help="每頁訊息數量")
+    parser.add_argument("--concurrency", type=int, default=None, help="並發的 Gemini 請求數量")
+    parser.add_argument("--limit", type=int, default=None, help="本次最多處理的訊息數量")
+    parser.add_argument("--reset", action="store_true", help="清除檢查點後從頭掃描")
+    args = parser.parse_args()
+
+    memory_manager = MemoryManager(
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        neo4j_uri=os.getenv("NEO4J_URI", "neo4j://localhost:7687"),
+        neo4j_user=os.getenv("NEO4J_USER", "neo4j"),
+        neo4j_password=os.getenv("NEO4J_PASSWORD", "password")
+    )
+    worker = BackfillWorker(memory_manager, name=args.name, page_size=args.page_size,
+                            concurrency=args.concurrency)
+    if args.reset:
+        worker.reset()
+    try:
+        progress = worker.run(max_messages=args.limit)
+        print(f"✅ 回填完成: {progress}")
+    except KeyboardInterrupt:
+        print("\n⏹️ 回填已中斷, 已完成的訊息下次不會重做")
+    finally:
+        memory_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+記憶篩選微批次模組
+把多個會話的待篩選訊息在短時間窗口內合併為一次 LLM 調用,
+並把逐條的 YES/NO 結果分發回等待中的調用方
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+class MemoryFilterBatcher:
+    """記憶篩選批次器
+
+    - batch_size: 每批最多訊息數量, 達到即送出
+    - max_wait_ms: 最早一條訊息的最長等待時間, 超過即送出
+    - max_concurrent_batches: 同時進行中的批次數量
+    - preserve_session_order: 同一會話的訊息按提交順序逐批處理 (前一條完成前不會送出下一條)
+    """
+
+    _shared: Optional["MemoryFilterBatcher"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, memory_filter, batch_size: int = None, max_wait_ms: float = None,
+                 max_concurrent_batches: int = None, preserve_session_order: bool = None):
+        self.memory_filter = memory_filter
+        self.batch_size = batch_size or int(os.getenv("MEMORY_FILTER_BATCH_SIZE", "8"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else
+                         float(os.getenv("MEMORY_FILTER_BATCH_WAIT_MS", "300"))) / 1000.0
+        self.max_concurrent_batches = max_concurrent_batches or \
+            int(os.getenv("MEMORY_FILTER_MAX_CONCURRENT_BATCHES", "1"))
+        self.preserve_session_order = preserve_session_order if preserve_session_order is not None else \
+            os.getenv("MEMORY_FILTER_PRESERVE_SESSION_ORDER", "true").lower() == "true"
+
+        self._cond = threading.Condition()
+        self._pending: List[Dict[str, Any]] = []
+        self._busy_sessions: Dict[str, int] = {}
+        self._inflight_batches = 0
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_batches,
+                                            thread_name_prefix="memory-filter-batch")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="memory-filter-batcher", daemon=True)
+        self._dispatcher.start()
+        self.stats = {"messages": 0, "batches": 0, "llm_calls_saved": 0}
+        self._owns_filter = False
+
+    @classmethod
+    def shared(cls, create_filter: Callable[[], Any]) -> "MemoryFilterBatcher":
+        """進程內共用的批次器, 讓不同 AI 秘書實例的訊息也能合併成同一批.
+
+        create_filter 只在建立批次器時調用; 批次器擁有這個篩選器 (及其快取), 任何一個 AI 秘書實例關閉都不影響它
+        """
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared._closed:
+                cls._shared = cls(create_filter())
+                cls._shared._owns_filter = True
+            return cls._shared
+
+    def classify(self, message: str, speaker: str, context: str = "", session_id: str = "",
+                 timeout: float = None) -> bool:
+        """提交一條訊息並等待批次判斷結果"""
+        future = self.submit(message, speaker, context, session_id)
+        return future.result(timeout=timeout)
+
+    def submit(self, message: str, speaker: str, context: str = "", session_id: str = "") -> Future:
+        """提交一條訊息, 返回結果的 Future"""
+        future: Future = Future()
+        item = {
+            "message": message,
+            "speaker": speaker,
+            "context": context,
+            "session_id": session_id,
+            "future": future,
+            "submitted_at": time.monotonic(),
+        }
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MemoryFilterBatcher is closed")
+            self._pending.append(item)
+            self.stats["messages"] += 1
+            self._cond.notify_all()
+        return future
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        """按 FIFO 取出一批可送出的訊息 (調用方需持有鎖)"""
+        batch, remaining, seen_sessions = [], [], set()
+        for item in self._pending:
+            session_id = item["session_id"]
+            blocked = self.preserve_session_order and (
+                session_id in self._busy_sessions or session_id in seen_sessions
+            )
+            if len(batch) < self.batch_size and not blocked:
+                batch.append(item)
+                if self.preserve_session_order:
+                    seen_sessions.add(session_id)
+            else:
+                remaining.append(item)
+                # 被擋下的會話, 後續訊息也要等待, 以保持順序
+                if self.preserve_session_order:
+                    seen_sessions.add(session_id)
+        self._pending = remaining
+        return batch
+
+    def _ready_count(self) -> int:
+        """可立即送出的訊息數量 (調用方需持有鎖)"""
+        if not self.preserve_session_order:
+            return len(self._pending)
+        sessions = set()
+        count = 0
+        for item in self._pending:
+            if item["session_id"] not in self._busy_sessions and item["session_id"] not in sessions:
+                count += 1
+            sessions.add(item["session_id"])
+        return count
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    ready = self._ready_count()
+                    can_send = self._inflight_batches < self.max_concurrent_batches
+                    if ready and can_send:
+                        oldest = min(item["submitted_at"] for item in self._pending)
+                        wait = oldest + self.max_wait - time.monotonic()
+                        if ready >= self.batch_size or wait <= 0 or self._closed:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait(self.max_wait if self._pending else None)
+
+                batch = self._take_batch()
+                self._inflight_batches += 1
+                if self.preserve_session_order:
+                    for item in batch:
+                        self._busy_sessions[item["session_id"]] = self._busy_sessions.get(item["session_id"], 0) + 1
+                self.stats["batches"] += 1
+                self.stats["llm_calls_saved"] += max(len(batch) - 1, 0)
+
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Dict[str, Any]]):
+        try:
+            results = self.memory_filter.classify_batch(batch)
+            for item, result in zip(batch, results):
+                item["future"].set_result(bool(result))
+        except Exception as e:
+            for item in batch:
+                if not item["future"].done():
+                    item["future"].set_exception(e)
+        finally:
+            with self._cond:
+                self._inflight_batches -= 1
+                if self.preserve_session_order:
+                    for item in batch:
+                        session_id = item["session_id"]
+                        self._busy_sessions[session_id] -= 1
+                        if self._busy_sessions[session_id] <= 0:
+                            del self._busy_sessions[session_id]
+                self._cond.notify_all()
+
+    def close(self):
+        """送出剩餘訊息並停止批次器"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._dispatcher.join(timeout=5)
+        self._executor.shutdown(wait=True)
+        cache = getattr(self.memory_filter, "cache", None)
+        if self._owns_filter and cache is not None:
+            cache.close()
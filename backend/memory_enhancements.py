@@ -3,7 +3,9 @@
 提供更智能的記憶分類、搜索和管理功能
 """
 
+import os
 import re
+import threading
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
 import json
@@ -99,6 +101,107 @@ class MemoryClassifier:
         
         return classification
 
+class MemoryGate:
+    """記憶閘門，在調用 LLM 之前用規則分類器處理明顯的情況
+
+    decide() 返回:
+    - True: 明顯值得記憶（明確要求記住、高信心的個人資訊/健康資訊）
+    - False: 明顯不值得記憶（寒暄、簡短回應、純提問）
+    - None: 不確定，交給 LLM 判斷
+    """
+    
+    EXPLICIT_KEYWORDS = ["記住", "記低", "記錄"]
+    
+    SMALL_TALK = {
+        "你好", "您好", "早晨", "早安", "晚安", "拜拜", "再見", "hi", "hello", "hey", "bye",
+        "謝謝", "多謝", "唔該", "thanks", "thank you", "ok", "okay", "好", "好的", "好啊",
+        "收到", "明白", "知道了", "嗯", "哦", "係", "是", "對", "冇問題", "沒問題", "yes", "no"
+    }
+    # 只由這些字組成的簡短訊息視為附和 (例如 "嗯嗯"、"哈哈哈"、"好好")
+    ACKNOWLEDGEMENT_CHARS = set("嗯哦喔噢哈呵啊好")
+    
+    QUESTION_PATTERNS = [
+        r"[?？]\s*$",
+        # "呢" 也常用於陳述句結尾 (例如 "我下週五生日呢"), 只在帶問號時由上一條規則判斷
+        r"(嗎|咩|未|吖嘛|麼)\s*[?？]?\s*$",
+        r"^(什麼|甚麼|點樣|點解|邊個|邊度|幾時|幾多|如何|為什麼|怎麼|誰|哪|what|who|when|where|why|how)",
+        r"(記唔記得|記不記得|有冇|有沒有|係咪|是不是)",
+    ]
+    
+    HIGH_CONFIDENCE_TYPES = ["personal_info", "health"]
+    
+    def __init__(self, classifier: "MemoryClassifier" = None, yes_confidence: float = None,
+                 min_length: int = None, question_max_confidence: float = None):
+        self.classifier = classifier or MemoryClassifier()
+        # 個人資訊/健康類型達到此信心即直接判定值得記憶
+        self.yes_confidence = yes_confidence if yes_confidence is not None else \
+            float(os.getenv("MEMORY_GATE_YES_CONFIDENCE", "0.6"))
+        # 去除標點後短於此長度、且只由寒暄/附和組成的訊息直接判定不值得記憶
+        # (中文的簡短陳述如 "我有貓" 仍交給 LLM 判斷)
+        self.min_length = min_length if min_length is not None else \
+            int(os.getenv("MEMORY_GATE_MIN_LENGTH", "4"))
+        # 提問中若分類信心不超過此值，視為純提問
+        self.question_max_confidence = question_max_confidence if question_max_confidence is not None else \
+            float(os.getenv("MEMORY_GATE_QUESTION_MAX_CONFIDENCE", "0.2"))
+        self._lock = threading.Lock()
+        self.stats = {"yes": 0, "no": 0, "uncertain": 0}
+    
+    def decide(self, text: str, speaker: str) -> Optional[bool]:
+        """規則判斷是否值得記憶，無法確定時返回 None"""
+        decision = self._decide(text, speaker)
+        key = "uncertain" if decision is None else ("yes" if decision else "no")
+        with self._lock:
+            self.stats[key] += 1
+        return decision
+    
+    def _decide(self, text: str, speaker: str) -> Optional[bool]:
+        stripped = text.strip()
+        
+        # 明確要求記住
+        if speaker == "user" and any(keyword in stripped for keyword in self.EXPLICIT_KEYWORDS):
+            return True
+        
+        # 寒暄與簡短回應
+        normalized = re.sub(r"[\s\W_]+", " ", stripped.lower()).strip()
+        if normalized in self.SMALL_TALK:
+            return False
+        if len(normalized.replace(" ", "")) < self.min_length and self._is_acknowledgement(normalized):
+            return False
+        
+        classification = self.classifier.classify_memory(stripped, speaker)
+        confidence = classification["confidence"]
+        
+        # 高信心的個人資訊/健康資訊
+        if speaker == "user" and classification["primary_type"] in self.HIGH_CONFIDENCE_TYPES \
+                and confidence >= self.yes_confidence:
+            return True
+        
+        # 純提問（沒有陳述任何值得記憶的內容）
+        if speaker == "user" and confidence <= self.question_max_confidence \
+                and any(re.search(pattern, stripped, re.IGNORECASE) for pattern in self.QUESTION_PATTERNS):
+            return False
+        
+        return None
+    
+    def _is_acknowledgement(self, normalized: str) -> bool:
+        """訊息是否只由寒暄詞或附和字組成"""
+        if not normalized:
+            return True
+        return all(token in self.SMALL_TALK for token in normalized.split()) \
+            or set(normalized.replace(" ", "")) <= self.ACKNOWLEDGEMENT_CHARS
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取閘門統計，包括避免的 LLM 調用次數"""
+        with self._lock:
+            stats = dict(self.stats)
+        total = sum(stats.values())
+        stats["total"] = total
+        # 判定 NO 的訊息完全不需要調用 LLM；判定 YES 的訊息省去篩選判斷
+        stats["llm_calls_avoided"] = stats["no"]
+        stats["filter_calls_avoided"] = stats["no"] + stats["yes"]
+        stats["llm_bypass_rate"] = (stats["no"] / total) if total else 0.0
+        return stats
+
 class MemoryContextAnalyzer:
     """記憶上下文分析器，分析記憶之間的關聯性"""
     
@@ -208,10 +311,14 @@ class MemoryPriorityManager:
             priority -= len(contradictions) * 0.1
         
         # 時間衰減（較舊的記憶優先級略微降低）
-        timestamp = memory.get("timestamp")
+        timestamp = memory.get("timestamp") or (memory.get("metadata") or {}).get("timestamp")
         if timestamp:
             try:
-                memory_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+                if isinstance(timestamp, (int, float)):
+                    # 對話記錄與向量元數據中的時間為 epoch 毫秒
+                    memory_time = datetime.fromtimestamp(timestamp / 1000)
+                else:
+                    memory_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
                 days_old = (datetime.now() - memory_time.replace(tzinfo=None)).days
                 time_decay = max(0, 1 - (days_old / 365))  # 一年後完全衰減
                 priority *= (0.8 + 0.2 * time_decay)
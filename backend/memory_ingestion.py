@@ -0,0 +1,152 @@
+"""
+記憶寫入隊列模組
+把向量存儲、記憶篩選、知識提取與圖譜寫入移出對話的關鍵路徑,
+由背景工作線程處理; conversation_logs.processed 標記作為持久化交接點
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# 每個進程對每個數據庫只做一次未處理訊息的恢復, 避免實例池中多個實例重複處理
+_recovered_db_paths = set()
+_recovery_lock = threading.Lock()
+
+_STOP = object()
+
+
+class MemoryIngestionQueue:
+    """有界的背景記憶寫入隊列"""
+
+    def __init__(self, memory_manager, num_workers: int = None, max_size: int = None,
+                 submit_timeout: float = None):
+        self.memory_manager = memory_manager
+        self.num_workers = num_workers or int(os.getenv("MEMORY_INGEST_WORKERS", "2"))
+        self.max_size = max_size or int(os.getenv("MEMORY_INGEST_QUEUE_SIZE", "256"))
+        self.submit_timeout = submit_timeout if submit_timeout is not None else \
+            float(os.getenv("MEMORY_INGEST_SUBMIT_TIMEOUT", "0.5"))
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_size)
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+        self._workers = []
+        self._overflowed = False
+        self._closed = False
+        self.stats = {"submitted": 0, "processed": 0, "failed": 0, "overflowed": 0}
+
+    def start(self):
+        """啟動工作線程"""
+        for i in range(self.num_workers):
+            worker = threading.Thread(
+                target=self._worker_loop, name=f"memory-ingest-{i}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def submit(self, job: Dict[str, Any]) -> bool:
+        """提交一條已寫入 SQLite 的訊息; 隊列已滿時返回 False, 訊息保持未處理狀態等待恢復"""
+        if self._closed:
+            return False
+        with self._inflight_lock:
+            if job["id"] in self._inflight:
+                return True
+            self._inflight.add(job["id"])
+        try:
+            self._queue.put(job, timeout=self.submit_timeout)
+        except queue.Full:
+            with self._inflight_lock:
+                self._inflight.discard(job["id"])
+            self._overflowed = True
+            self.stats["overflowed"] += 1
+            print(f"⚠️ 記憶寫入隊列已滿, 訊息 {job['id']} 將稍後恢復處理")
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def recover_pending(self, limit: Optional[int] = None) -> int:
+        """把 processed = FALSE 的訊息重新放入隊列, 返回放入數量"""
+        limit = limit or int(os.getenv("MEMORY_INGEST_RECOVER_LIMIT", "200"))
+        recovered = 0
+        for row in self.memory_manager.conversation_logger.get_unprocessed_messages(limit=limit):
+            job = {
+                "id": row["id"],
+                "session_id": row["session_id"],
+                "speaker": row["speaker"],
+                "message": row["message"],
+                "timestamp": row["timestamp"],
+                "context": "",
+                "current_entities": [],
+            }
+            if not self.submit(job):
+                break
+            recovered += 1
+        return recovered
+
+    def recover_once(self) -> int:
+        """每個進程每個數據庫只恢復一次"""
+        db_path = os.path.abspath(self.memory_manager.conversation_logger.db_path)
+        with _recovery_lock:
+            if db_path in _recovered_db_paths:
+                return 0
+            _recovered_db_paths.add(db_path)
+        recovered = self.recover_pending()
+        if recovered:
+            print(f"♻️ 已恢復 {recovered} 條未處理的訊息到記憶寫入隊列")
+        return recovered
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                self._queue.task_done()
+                return
+            try:
+                self.memory_manager.ingest_message(job)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"記憶寫入錯誤 (訊息 {job['id']}): {e}")
+            finally:
+                with self._inflight_lock:
+                    self._inflight.discard(job["id"])
+                self._queue.task_done()
+
+            # 隊列曾經溢出: 空閒時把遺留的未處理訊息補回隊列
+            if self._overflowed and self._queue.empty() and not self._closed:
+                self._overflowed = False
+                self.recover_pending()
+
+    def pending_count(self) -> int:
+        """尚未完成的訊息數量"""
+        with self._inflight_lock:
+            return len(self._inflight)
+
+    def drain(self, timeout: float = None) -> bool:
+        """等待隊列中的訊息全部處理完畢, 返回是否在超時前完成"""
+        timeout = timeout if timeout is not None else float(os.getenv("MEMORY_INGEST_DRAIN_TIMEOUT", "30"))
+        deadline = time.monotonic() + timeout
+        while self.pending_count() > 0:
+            if time.monotonic() >= deadline:
+                print(f"⚠️ 記憶寫入隊列排空超時, 仍有 {self.pending_count()} 條訊息未處理")
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout: float = None) -> bool:
+        """排空隊列並停止工作線程; 未完成的訊息保持未處理狀態, 下次啟動時恢復"""
+        if self._closed:
+            return True
+        drained = self.drain(timeout)
+        self._closed = True
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                break
+        for worker in self._workers:
+            worker.join(timeout=1)
+        self._workers.clear()
+        return drained
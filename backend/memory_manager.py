@@ -1,59 +1,382 @@
+import asyncio
+import os
+import re
 import sqlite3
 import json
+import threading
+import time
+import uuid
+import weakref
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from neo4j import GraphDatabase
+from typing import List, Dict, Any, Optional, Tuple
+from neo4j import AsyncGraphDatabase, GraphDatabase
 import chromadb
 import google.generativeai as genai
-from memory_enhancements import SmartMemoryRetrieval, create_memory_summary
+from memory_enhancements import SmartMemoryRetrieval, MemoryGate, create_memory_summary
+from memory_ingestion import MemoryIngestionQueue
+from memory_batching import MemoryFilterBatcher
+from graph_schema import GraphSchemaManager
+from graph_backends import GraphMemoryBackend, InMemoryGraphBackend
+from graph_write_buffer import GraphWriteBuffer
+from vector_write_buffer import VectorWriteBuffer
+from entity_cache import EntityResolutionCache
+from entity_importance import EntityImportanceJob, current_importance
+from llm_cache import LLMResponseCache
+from embedding_cache import CachedEmbeddingFunction
+from vector_engine import QuantizedVectorStore
 
 class ConversationLogger:
-    """管理原始對話日誌的類別."""
+    """管理原始對話日誌的類別.
     
-    def __init__(self, db_path: str = "conversation_logs.db"):
+    - timestamp 以整數 epoch 毫秒存儲, 配合 (session_id, timestamp) 索引做鍵集分頁
+    - 寫入共用一個長期連接 (WAL 模式), 讀取使用每個線程各自的連接
+    - SQL 語句固定為類常量, 由 sqlite3 的語句快取重用已編譯的語句
+    - group_commit_size > 1 時啟用批次提交: 多條寫入在同一事務中, 達到數量或時間閾值才提交
+      (進程崩潰時最多遺失 group_commit_interval 內未提交的寫入)
+    """
+    
+    # 訊息處理狀態: 待處理 / 不值得記憶 / 已存入長期記憶
+    STATUS_PENDING = "pending"
+    STATUS_SKIPPED = "skipped"
+    STATUS_STORED = "stored"
+    
+    INSERT_MESSAGE_SQL = """
+        INSERT INTO conversation_logs (session_id, timestamp, speaker, message)
+        VALUES (?, ?, ?, ?)
+    """
+    MARK_PROCESSED_SQL = """
+        UPDATE conversation_logs
+        SET processed = TRUE, status = ?
+        WHERE id = ?
+    """
+    SELECT_UNPROCESSED_SQL = """
+        SELECT id, session_id, timestamp, speaker, message
+        FROM conversation_logs
+        WHERE processed = FALSE AND id > ?
+        ORDER BY id
+        LIMIT ?
+    """
+    COUNT_UNPROCESSED_SQL = """
+        SELECT COUNT(*) FROM conversation_logs
+        WHERE processed = FALSE AND id > ?
+    """
+    SELECT_AFTER_ID_SQL = """
+        SELECT id, session_id, timestamp, speaker, message
+        FROM conversation_logs
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    """
+    SELECT_CONTEXT_SQL = """
+        SELECT speaker, message FROM conversation_logs
+        WHERE session_id = ? AND id < ?
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """
+    SELECT_HISTORY_SQL = """
+        SELECT id, session_id, timestamp, speaker, message, status
+        FROM conversation_logs
+        WHERE session_id = ? AND (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """
+    SELECT_HISTORY_ASC_SQL = """
+        SELECT id, session_id, timestamp, speaker, message, status
+        FROM conversation_logs
+        WHERE session_id = ? AND (timestamp, id) > (?, ?)
+        ORDER BY timestamp, id
+        LIMIT ?
+    """
+    
+    # 可選的會話 / 說話者 / 時間範圍過濾 (參數為 NULL 時不限制)
+    FILTER_SQL = """
+          AND (:session_id IS NULL OR l.session_id = :session_id)
+          AND (:speaker IS NULL OR l.speaker = :speaker)
+          AND (:since IS NULL OR l.timestamp >= :since)
+          AND (:until IS NULL OR l.timestamp <= :until)
+    """
+    SELECT_FULLTEXT_SQL = """
+        SELECT l.id, l.session_id, l.timestamp, l.speaker, l.message, bm25(conversation_logs_fts) AS rank
+        FROM conversation_logs_fts
+        JOIN conversation_logs l ON l.id = conversation_logs_fts.rowid
+        WHERE conversation_logs_fts MATCH :term""" + FILTER_SQL + """
+        ORDER BY rank
+        LIMIT :limit
+    """
+    SELECT_SUBSTRING_SQL = """
+        SELECT l.id, l.session_id, l.timestamp, l.speaker, l.message
+        FROM conversation_logs l
+        WHERE instr(l.message, :term) > 0""" + FILTER_SQL + """
+        ORDER BY l.id DESC
+        LIMIT :limit
+    """
+    SELECT_ARCHIVABLE_SQL = """
+        SELECT id, session_id, timestamp, speaker, message, status
+        FROM conversation_logs
+        WHERE processed = TRUE AND timestamp < ?
+        ORDER BY timestamp, id
+        LIMIT ?
+    """
+    
+    # FTS5 全文索引 (trigram 分詞, 適用於中日韓文字與電話/郵箱等精確詞), 由觸發器與主表同步
+    CREATE_FTS_SQL = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversation_logs_fts USING fts5(
+            message, content='conversation_logs', content_rowid='id', tokenize='trigram'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS conversation_logs_fts_insert AFTER INSERT ON conversation_logs BEGIN
+            INSERT INTO conversation_logs_fts (rowid, message) VALUES (new.id, new.message);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS conversation_logs_fts_delete AFTER DELETE ON conversation_logs BEGIN
+            INSERT INTO conversation_logs_fts (conversation_logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS conversation_logs_fts_update AFTER UPDATE OF message ON conversation_logs BEGIN
+            INSERT INTO conversation_logs_fts (conversation_logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO conversation_logs_fts (rowid, message) VALUES (new.id, new.message);
+        END
+        """,
+    ]
+    
+    SCHEMA_VERSION = 2
+    CREATE_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS conversation_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            timestamp INTEGER NOT NULL,
+            speaker TEXT,
+            message TEXT,
+            processed BOOLEAN DEFAULT FALSE,
+            status TEXT DEFAULT 'pending'
+        )
+    """
+    CREATE_INDEXES_SQL = [
+        # 部分索引: 只索引未處理的訊息, 回填與恢復掃描不隨歷史數據增長
+        "CREATE INDEX IF NOT EXISTS idx_logs_unprocessed ON conversation_logs (id) WHERE processed = FALSE",
+        "CREATE INDEX IF NOT EXISTS idx_logs_session_time ON conversation_logs (session_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_time ON conversation_logs (timestamp)",
+    ]
+    
+    def __init__(self, db_path: str = "conversation_logs.db", group_commit_size: int = None,
+                 group_commit_interval: float = None):
         self.db_path = db_path
+        self.group_commit_size = group_commit_size or int(os.getenv("CONVERSATION_LOG_GROUP_COMMIT_SIZE", "1"))
+        self.group_commit_interval = group_commit_interval if group_commit_interval is not None else \
+            float(os.getenv("CONVERSATION_LOG_GROUP_COMMIT_MS", "50")) / 1000.0
+        
+        self._write_lock = threading.RLock()
+        self._writer = self._connect()
+        self._pending_writes = 0
+        self._first_pending_at = 0.0
+        self._local = threading.local()
+        self._readers = []
+        self._closed = threading.Event()
         self._init_db()
+        
+        self._flusher = None
+        if self.group_commit_size > 1:
+            self._flusher = threading.Thread(target=self._flush_loop, name="conversation-log-flusher", daemon=True)
+            self._flusher.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """建立連接並設定 WAL 模式."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5.0, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _reader(self) -> sqlite3.Connection:
+        """獲取當前線程的讀取連接 (線程結束後自動關閉, 每個請求一個線程時也不會累積連接)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._write_lock:
+                self._readers.append(conn)
+            weakref.finalize(threading.current_thread(), self._release_reader,
+                             self._readers, self._write_lock, conn)
+        return conn
+    
+    @staticmethod
+    def _release_reader(readers: list, lock: threading.RLock, conn: sqlite3.Connection):
+        """線程對象被回收時關閉它的讀取連接 (不持有 logger 本身, 不延長其生命週期)."""
+        with lock:
+            if conn in readers:
+                readers.remove(conn)
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+    
+    def _write(self, sql: str, params: tuple) -> sqlite3.Cursor:
+        """執行寫入; 按批次提交設定決定是否立即提交."""
+        with self._write_lock:
+            cursor = self._writer.execute(sql, params)
+            if self._pending_writes == 0:
+                self._first_pending_at = time.monotonic()
+            self._pending_writes += 1
+            if self._pending_writes >= self.group_commit_size or \
+                    time.monotonic() - self._first_pending_at >= self.group_commit_interval:
+                self._commit_locked()
+            return cursor
+    
+    def _commit_locked(self):
+        self._writer.commit()
+        self._pending_writes = 0
+    
+    def flush(self):
+        """立即提交所有未提交的寫入."""
+        with self._write_lock:
+            if self._pending_writes:
+                self._commit_locked()
+    
+    def _flush_loop(self):
+        while not self._closed.wait(self.group_commit_interval):
+            with self._write_lock:
+                if self._pending_writes and \
+                        time.monotonic() - self._first_pending_at >= self.group_commit_interval:
+                    self._commit_locked()
+    
+    def _read(self, sql: str, params: tuple) -> list:
+        """執行讀取; 先提交本實例未提交的寫入, 保證讀到自己的寫入."""
+        self.flush()
+        return self._reader().execute(sql, params).fetchall()
     
     def _init_db(self):
         """初始化 SQLite 數據庫."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversation_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                timestamp DATETIME,
-                speaker TEXT,
-                message TEXT,
-                processed BOOLEAN DEFAULT FALSE
-            )
-        """)
-        conn.commit()
-        conn.close()
-    
-    def log_message(self, session_id: str, speaker: str, message: str) -> int:
-        """記錄一條對話訊息."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO conversation_logs (session_id, timestamp, speaker, message)
-            VALUES (?, ?, ?, ?)
-        """, (session_id, datetime.now(), speaker, message))
-        message_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return message_id
+        with self._write_lock:
+            cursor = self._writer.cursor()
+            exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_logs'"
+            ).fetchone()
+            if exists:
+                self._migrate(cursor)
+            else:
+                cursor.execute(self.CREATE_TABLE_SQL)
+                cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            for sql in self.CREATE_INDEXES_SQL:
+                cursor.execute(sql)
+            self.fts_enabled = self._ensure_fts(cursor)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+                    name TEXT PRIMARY KEY,
+                    last_id INTEGER DEFAULT 0,
+                    processed INTEGER DEFAULT 0,
+                    stored INTEGER DEFAULT 0,
+                    skipped INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    updated_at DATETIME
+                )
+            """)
+            self._writer.commit()
     
-    def get_unprocessed_messages(self) -> List[Dict[str, Any]]:
-        """獲取未處理的訊息."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, session_id, timestamp, speaker, message
-            FROM conversation_logs
-            WHERE processed = FALSE
-        """)
-        messages = [
+    def _migrate(self, cursor):
+        """按 PRAGMA user_version 逐步升級表結構."""
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # v1: 三態處理狀態; 舊數據中 processed = TRUE 的訊息均已存入圖譜
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(conversation_logs)")]
+            if "status" not in columns:
+                cursor.execute("ALTER TABLE conversation_logs ADD COLUMN status TEXT DEFAULT 'pending'")
+            cursor.execute("""
+                UPDATE conversation_logs
+                SET status = CASE WHEN processed THEN 'stored' ELSE 'pending' END
+            """)
+            cursor.execute("PRAGMA user_version = 1")
+        if version < 2:
+            # v2: timestamp 改為整數 epoch 毫秒 (重建表, 保留 id 與 AUTOINCREMENT 序列)
+            cursor.execute("ALTER TABLE conversation_logs RENAME TO conversation_logs_v1")
+            cursor.execute(self.CREATE_TABLE_SQL)
+            rows = cursor.execute("""
+                SELECT id, session_id, timestamp, speaker, message, processed, status
+                FROM conversation_logs_v1
+            """)
+            self._writer.executemany("""
+                INSERT INTO conversation_logs (id, session_id, timestamp, speaker, message, processed, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, ((row[0], row[1], self.to_epoch_ms(row[2]), *row[3:]) for row in rows.fetchall()))
+            cursor.execute("DROP TABLE conversation_logs_v1")
+            cursor.execute("PRAGMA user_version = 2")
+    
+    def _ensure_fts(self, cursor) -> bool:
+        """建立全文索引與同步觸發器; SQLite 不支援 FTS5 trigram 時返回 False (退回子串掃描)."""
+        if sqlite3.sqlite_version_info < (3, 34, 0):
+            print(f"⚠️ SQLite {sqlite3.sqlite_version} 不支援 FTS5 trigram 分詞, 全文搜索退回子串掃描")
+            return False
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_logs_fts'"
+        ).fetchone()
+        try:
+            for sql in self.CREATE_FTS_SQL:
+                cursor.execute(sql)
+            if not exists:
+                # 為已有的歷史訊息建立索引
+                cursor.execute("INSERT INTO conversation_logs_fts (conversation_logs_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ 無法建立全文索引, 全文搜索退回子串掃描: {e}")
+            return False
+        return True
+    
+    @staticmethod
+    def now_ms() -> int:
+        """當前時間的 epoch 毫秒."""
+        return int(time.time() * 1000)
+    
+    @staticmethod
+    def to_epoch_ms(value) -> int:
+        """把舊格式的時間 (datetime / ISO 字串 / 數字) 轉換為 epoch 毫秒."""
+        if value is None:
+            return 0
+        if isinstance(value, (int, float)):
+            return int(value)
+        if isinstance(value, datetime):
+            return int(value.timestamp() * 1000)
+        try:
+            return int(datetime.fromisoformat(str(value)).timestamp() * 1000)
+        except ValueError:
+            return 0
+    
+    @staticmethod
+    def format_timestamp(value) -> str:
+        """把 epoch 毫秒轉換為 ISO 字串 (已是字串時原樣返回)."""
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value / 1000).isoformat()
+        return value or datetime.now().isoformat()
+    
+    def log_message(self, session_id: str, speaker: str, message: str, timestamp: Optional[int] = None) -> int:
+        """記錄一條對話訊息 (timestamp 為 epoch 毫秒, 預設為當前時間)."""
+        if timestamp is None:
+            timestamp = self.now_ms()
+        cursor = self._write(self.INSERT_MESSAGE_SQL, (session_id, timestamp, speaker, message))
+        return cursor.lastrowid
+    
+    def get_unprocessed_messages(self, limit: Optional[int] = None, after_id: int = 0) -> List[Dict[str, Any]]:
+        """獲取未處理的訊息 (按 id 鍵集分頁: 只返回 id > after_id 的前 limit 條)."""
+        rows = self._read(self.SELECT_UNPROCESSED_SQL, (after_id, limit if limit is not None else -1))
+        return [
+            {
+                "id": row[0],
+                "session_id": row[1],
+                "timestamp": row[2],
+                "speaker": row[3],
+                "message": row[4]
+            }
+            for row in rows
+        ]
+    
+    def count_unprocessed_messages(self, after_id: int = 0) -> int:
+        """統計 id > after_id 的未處理訊息數量."""
+        return self._read(self.COUNT_UNPROCESSED_SQL, (after_id,))[0][0]
+    
+    def get_messages(self, after_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """按 id 鍵集分頁獲取所有訊息 (不論是否已處理), 供重建索引使用."""
+        rows = self._read(self.SELECT_AFTER_ID_SQL, (after_id, limit))
+        return [
             {
                 "id": row[0],
                 "session_id": row[1],
@@ -61,40 +384,200 @@ class ConversationLogger:
                 "speaker": row[3],
                 "message": row[4]
             }
-            for row in cursor.fetchall()
+            for row in rows
+        ]
+    
+    def count_messages(self, after_id: int = 0) -> int:
+        """統計 id > after_id 的訊息數量."""
+        return self._read("SELECT COUNT(*) FROM conversation_logs WHERE id > ?", (after_id,))[0][0]
+    
+    def get_recent_context(self, session_id: str, before_id: int, limit: int = 3) -> str:
+        """重建某條訊息之前的會話上下文 (最近 limit 條)."""
+        rows = self._read(self.SELECT_CONTEXT_SQL, (session_id, before_id, limit))
+        return "\n".join(f"{speaker}: {message}" for speaker, message in reversed(rows))
+    
+    def get_session_history(self, session_id: str, limit: int = 50, cursor: Optional[Dict[str, int]] = None,
+                            newest_first: bool = True) -> Dict[str, Any]:
+        """按 (timestamp, id) 鍵集分頁獲取會話歷史.
+        
+        cursor 為上一頁返回的 next_cursor ({"timestamp": ..., "id": ...}); 每頁成本只與 limit 有關.
+        """
+        if limit <= 0:
+            # SQLite 的負數 LIMIT 表示不限制, 不能直接傳入
+            return {"messages": [], "next_cursor": None}
+        if newest_first:
+            sql = self.SELECT_HISTORY_SQL
+            position = (cursor["timestamp"], cursor["id"]) if cursor else (2 ** 63 - 1, 2 ** 63 - 1)
+        else:
+            sql = self.SELECT_HISTORY_ASC_SQL
+            position = (cursor["timestamp"], cursor["id"]) if cursor else (-1, -1)
+        rows = self._read(sql, (session_id, *position, limit))
+        messages = [
+            {
+                "id": row[0],
+                "session_id": row[1],
+                "timestamp": row[2],
+                "speaker": row[3],
+                "message": row[4],
+                "status": row[5]
+            }
+            for row in rows
+        ]
+        next_cursor = None
+        if len(messages) == limit:
+            next_cursor = {"timestamp": messages[-1]["timestamp"], "id": messages[-1]["id"]}
+        return {"messages": messages, "next_cursor": next_cursor}
+    
+    @staticmethod
+    def _build_fts_query(query: str):
+        """把查詢拆成 FTS5 表達式與過短 (少於 3 字) 無法用 trigram 匹配的詞.
+        
+        - 英數詞 (電話、郵箱、項目代號等) 作為精確短語
+        - 中日韓文字串拆成 trigram 短語, 以 OR 組合, 由 BM25 按命中數量排序
+        """
+        phrases, short_terms = [], []
+        for term in re.findall(r"[A-Za-z0-9@._+\-]+|[^\sA-Za-z0-9@._+\-\W]+", query):
+            if len(term) < 3:
+                short_terms.append(term)
+            elif term.isascii():
+                phrases.append(term)
+            else:
+                phrases.extend(term[i:i + 3] for i in range(len(term) - 2))
+        expression = " OR ".join('"{}"'.format(p.replace('"', '""')) for p in dict.fromkeys(phrases))
+        return expression, short_terms
+    
+    def search_fulltext(self, query: str, limit: int = 5, session_id: str = None, speaker: str = None,
+                        since=None, until=None) -> List[Dict[str, Any]]:
+        """全文搜索對話日誌 (BM25 排序), 不需要計算嵌入向量.
+        
+        返回結果的 score 越大越相關; session_id / speaker / since / until 的含義與向量搜索的過濾條件相同.
+        """
+        expression, short_terms = self._build_fts_query(query)
+        params = {
+            "session_id": session_id or None, "speaker": speaker or None, "limit": limit,
+            "since": self.to_epoch_ms(since) if since is not None else None,
+            "until": self.to_epoch_ms(until) if until is not None else None,
+        }
+        results = []
+        if expression and self.fts_enabled:
+            for row in self._read(self.SELECT_FULLTEXT_SQL, dict(params, term=expression)):
+                results.append({
+                    "id": row[0], "session_id": row[1], "timestamp": row[2],
+                    "speaker": row[3], "message": row[4], "score": -row[5]
+                })
+        elif short_terms or expression:
+            # 查詢過短 (例如兩字人名) 或不支援 FTS5 時, 以最近訊息的子串匹配代替
+            term = max(short_terms + ([query.strip()] if not self.fts_enabled else []), key=len)
+            for row in self._read(self.SELECT_SUBSTRING_SQL, dict(params, term=term)):
+                results.append({
+                    "id": row[0], "session_id": row[1], "timestamp": row[2],
+                    "speaker": row[3], "message": row[4], "score": 1.0
+                })
+        return results
+    
+    def mark_as_processed(self, message_id: int, status: str = STATUS_STORED):
+        """標記訊息為已處理, 並記錄處理結果 (stored / skipped)."""
+        self._write(self.MARK_PROCESSED_SQL, (status, message_id))
+    
+    def get_archivable_messages(self, before_ms: int, limit: int = 1000) -> List[Dict[str, Any]]:
+        """獲取早於 before_ms 且已處理的訊息 (按時間排序), 供冷存儲歸檔."""
+        rows = self._read(self.SELECT_ARCHIVABLE_SQL, (before_ms, limit))
+        return [
+            {
+                "id": row[0],
+                "session_id": row[1],
+                "timestamp": row[2],
+                "speaker": row[3],
+                "message": row[4],
+                "status": row[5]
+            }
+            for row in rows
         ]
-        conn.close()
-        return messages
-    
-    def mark_as_processed(self, message_id: int):
-        """標記訊息為已處理."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE conversation_logs
-            SET processed = TRUE
-            WHERE id = ?
-        """, (message_id,))
-        conn.commit()
-        conn.close()
+    
+    def get_message_timestamps(self, message_ids: List[int]) -> Dict[int, int]:
+        """按 id 批量查詢訊息時間戳 (epoch 毫秒); 已歸檔或不存在的 id 不在結果中."""
+        timestamps = {}
+        message_ids = list(message_ids)
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            rows = self._read(
+                f"SELECT id, timestamp FROM conversation_logs WHERE id IN ({', '.join('?' * len(chunk))})",
+                tuple(chunk)
+            )
+            timestamps.update({row[0]: row[1] for row in rows})
+        return timestamps
+    
+    def delete_messages(self, message_ids: List[int]) -> int:
+        """在同一事務中刪除訊息 (全文索引由觸發器同步), 返回刪除數量."""
+        with self._write_lock:
+            self.flush()
+            deleted = self._writer.executemany(
+                "DELETE FROM conversation_logs WHERE id = ?", ((message_id,) for message_id in message_ids)
+            ).rowcount
+            self._writer.commit()
+        return deleted
+    
+    def vacuum(self):
+        """回收已刪除訊息佔用的空間並截斷 WAL 文件."""
+        with self._write_lock:
+            self.flush()
+            self._writer.execute("VACUUM")
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    def get_checkpoint(self, name: str) -> Dict[str, Any]:
+        """讀取回填任務的檢查點."""
+        rows = self._read("""
+            SELECT last_id, processed, stored, skipped, failed, updated_at
+            FROM backfill_checkpoints WHERE name = ?
+        """, (name,))
+        if not rows:
+            return {"name": name, "last_id": 0, "processed": 0, "stored": 0, "skipped": 0, "failed": 0, "updated_at": None}
+        row = rows[0]
+        return {
+            "name": name,
+            "last_id": row[0],
+            "processed": row[1],
+            "stored": row[2],
+            "skipped": row[3],
+            "failed": row[4],
+            "updated_at": row[5]
+        }
+    
+    def save_checkpoint(self, checkpoint: Dict[str, Any]):
+        """保存回填任務的檢查點 (立即提交)."""
+        self._write("""
+            INSERT OR REPLACE INTO backfill_checkpoints
+                (name, last_id, processed, stored, skipped, failed, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (checkpoint["name"], checkpoint["last_id"], checkpoint["processed"], checkpoint["stored"],
+              checkpoint["skipped"], checkpoint["failed"], datetime.now()))
+        self.flush()
+    
+    def close(self):
+        """提交未提交的寫入並關閉所有連接."""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=1)
+        with self._write_lock:
+            self.flush()
+            self._writer.close()
+            for conn in self._readers:
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    pass
+            self._readers.clear()
 
 class MemoryFilter:
     """記憶篩選器, 判斷對話內容是否值得深度記憶."""
     
-    def __init__(self, google_api_key: str):
-        genai.configure(api_key=google_api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash")
+    EXPLICIT_KEYWORDS = ["記住", "記低", "記錄"]
+    MODEL_NAME = "gemini-2.5-flash"
+    # 修改篩選提示或判斷標準時需更新版本, 使舊的快取失效
+    PROMPT_VERSION = "filter-v1"
     
-    def is_worth_remembering(self, message: str, speaker: str, context: str = "") -> bool:
-        """判斷訊息是否值得深度記憶."""
-        # 規則 1: 用戶明確要求記住
-        if speaker == "user" and any(keyword in message for keyword in ["記住", "記低", "記錄"]):
-            return True
-        
-        # 規則 2: 使用 LLM 做語義判斷
-        prompt = f"""
-        # 任務
-        請嚴格判斷以下對話片段是否需要存入使用者的**長期記憶圖譜**。長期記憶用於記錄:
+    # 判斷標準, 由單條與批次篩選共用
+    CRITERIA = """長期記憶用於記錄:
         - 使用者的**個人事實** (e.g., 我對貓過敏、我下週五生日)
         - **重要決定/承諾** (e.g., 我決定買 X 產品、答應明天回覆張三)
         - **任務/行動項** (有明確執行者和時間)
@@ -106,7 +589,38 @@ class MemoryFilter:
         - **閒聊/寒暄**
         - **臨時性查詢結果** (e.g., "今日天氣晴，25度")
         - **冗長的解釋性內容** (除非包含核心結論)
-
+    """
+    
+    def __init__(self, google_api_key: str, cache: Optional[LLMResponseCache] = None):
+        genai.configure(api_key=google_api_key)
+        self.model = genai.GenerativeModel(self.MODEL_NAME)
+        self.cache = cache
+    
+    def _cache_key(self, message: str, speaker: str, context: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return self.cache.make_key(self.PROMPT_VERSION, self.MODEL_NAME, speaker, message, context)
+    
+    def is_explicit_request(self, message: str, speaker: str) -> bool:
+        """規則判斷: 用戶是否明確要求記住 (不需要調用 LLM)."""
+        return speaker == "user" and any(keyword in message for keyword in self.EXPLICIT_KEYWORDS)
+    
+    def is_worth_remembering(self, message: str, speaker: str, context: str = "") -> bool:
+        """判斷訊息是否值得深度記憶."""
+        # 規則 1: 用戶明確要求記住
+        if self.is_explicit_request(message, speaker):
+            return True
+        
+        cache_key = self._cache_key(message, speaker, context)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not LLMResponseCache.MISS:
+                return cached
+        
+        # 規則 2: 使用 LLM 做語義判斷
+        prompt = f"""
+        # 任務
+        請嚴格判斷以下對話片段是否需要存入使用者的**長期記憶圖譜**。{self.CRITERIA}
         # 對話片段
         [發言者: {speaker}]
         {message}
@@ -120,24 +634,91 @@ class MemoryFilter:
         
         try:
             response = self.model.generate_content(prompt)
-            return "YES" in response.text.strip()
+            result = "YES" in response.text.strip()
         except Exception as e:
             print(f"記憶篩選錯誤: {e}")
             return False
+        
+        if cache_key:
+            self.cache.set(cache_key, result, namespace="filter")
+        return result
+    
+    def classify_batch(self, items: List[Dict[str, Any]]) -> List[bool]:
+        """在一次 LLM 調用中判斷多條訊息, 返回與輸入順序一致的結果.
+        
+        items 中每項包含 message, speaker, context.
+        """
+        results = [self.is_explicit_request(item["message"], item["speaker"]) for item in items]
+        pending = []
+        keys = {}
+        for i, explicit in enumerate(results):
+            if explicit:
+                continue
+            item = items[i]
+            keys[i] = self._cache_key(item["message"], item["speaker"], item.get("context", ""))
+            cached = self.cache.get(keys[i]) if keys[i] else LLMResponseCache.MISS
+            if cached is LLMResponseCache.MISS:
+                pending.append(i)
+            else:
+                results[i] = cached
+        if not pending:
+            return results
+        if len(pending) == 1:
+            item = items[pending[0]]
+            results[pending[0]] = self.is_worth_remembering(item["message"], item["speaker"], item.get("context", ""))
+            return results
+        
+        segments = []
+        for number, index in enumerate(pending, 1):
+            item = items[index]
+            segments.append(f"""
+        ## [{number}]
+        [發言者: {item["speaker"]}]
+        {item["message"]}
+        [上下文 (最近幾條對話)]
+        {item.get("context", "") or "無"}
+        """)
+        
+        prompt = f"""
+        # 任務
+        以下有 {len(pending)} 個互相獨立的對話片段, 請逐一嚴格判斷是否需要存入使用者的**長期記憶圖譜**。{self.CRITERIA}
+        # 對話片段
+        {"".join(segments)}
+        # 輸出要求
+        每行輸出一個結果, 格式為 "編號: YES" 或 "編號: NO", 例如:
+        1: YES
+        2: NO
+        不要任何解釋.
+        """
+        
+        try:
+            response = self.model.generate_content(prompt)
+            answers = {}
+            for match in re.finditer(r"\[?(\d+)\]?\s*[:：.\-]\s*(YES|NO)", response.text.upper()):
+                answers[int(match.group(1))] = match.group(2) == "YES"
+            for number, index in enumerate(pending, 1):
+                results[index] = answers.get(number, False)
+                if keys.get(index) and number in answers:
+                    self.cache.set(keys[index], results[index], namespace="filter")
+        except Exception as e:
+            print(f"批次記憶篩選錯誤: {e}")
+        return results
 
 class KnowledgeExtractor:
     """知識提取器, 從高價值對話中提取結構化知識."""
     
-    def __init__(self, google_api_key: str):
+    MODEL_NAME = "gemini-2.5-flash"
+    # 修改提取提示或輸出格式時需更新版本, 使舊的快取失效
+    PROMPT_VERSION = "extract-v2"
+    FUSED_PROMPT_VERSION = "filter-extract-v3"
+    
+    def __init__(self, google_api_key: str, cache: Optional[LLMResponseCache] = None):
         genai.configure(api_key=google_api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash")
+        self.model = genai.GenerativeModel(self.MODEL_NAME)
+        self.cache = cache
     
-    def extract_knowledge(self, message: str, speaker: str, context: str = "", current_entities: list = []) -> Optional[Dict[str, Any]]:
-        """從對話中提取結構化知識."""
-        prompt = f"""
-        # 任務
-        從以下**使用者標記為重要**的對話中, 提取需要存入長期記憶圖譜的結構化知識:
-
+    # 提取重點與輸出格式, 由 extract_knowledge 與 filter_and_extract 共用
+    EXTRACTION_GUIDE = """
         # 提取重點 (針對 AI 秘書場景)
         1. **使用者的事實/偏好**:
            - 屬性: 健康狀況 (過敏、疾病)、個人喜好 (食物、興趣)、人生事件 (生日、紀念日)、生活方式習慣
@@ -157,37 +738,47 @@ class KnowledgeExtractor:
         # 不需要提取
         - AI 提供的其他未被採納的建議選項
         - 背景解釋資訊
-
-        # 輸出格式 (嚴格遵守 JSON Schema)
-        {{
+    """
+    
+    KNOWLEDGE_SCHEMA = """
           "entities": [
-            {{
+            {
               "name": "實體名稱 (e.g., 張三)",
               "type": "實體類型 (e.g., Person, Project, Organization, Role, Date)",
-              "attributes": {{
+              "aliases": ["同一實體在文本中的其他稱呼 (e.g., Zhang San, 老張), 沒有則為空列表"],
+              "attributes": {
                 "職位": "資深工程師",
                 "郵箱": "zs@abc.com",
                 "部門": "工程部"
-              }}
-            }}
+              }
+            }
           ],
           "relations": [
-            {{
+            {
               "source": "來源實體名稱",
               "target": "目標實體名稱",
               "type": "關係類型 (e.g., 屬於, 負責, 提出, 參與, 跟進, 需要)"
-            }}
+            }
           ],
           "events": [
-            {{
+            {
               "description": "事件描述 (e.g., 將於下週五前提交報告)",
               "actor": "主要執行者 (e.g., 張三)",
               "object": "涉及對象 (e.g., Project X 進度報告)",
               "date": "日期 (e.g., 2025-07-25)"
-            }}
+            }
           ],
           "summary": "文本的核心摘要"
-        }}
+    """
+    
+    def extract_knowledge(self, message: str, speaker: str, context: str = "", current_entities: list = []) -> Optional[Dict[str, Any]]:
+        """從對話中提取結構化知識."""
+        prompt = f"""
+        # 任務
+        從以下**使用者標記為重要**的對話中, 提取需要存入長期記憶圖譜的結構化知識:
+        {self.EXTRACTION_GUIDE}
+        # 輸出格式 (嚴格遵守 JSON Schema)
+        {{{self.KNOWLEDGE_SCHEMA}}}
 
         # 文本
         [發言者: {speaker}]
@@ -200,6 +791,64 @@ class KnowledgeExtractor:
         {current_entities if current_entities else "無"}
         """
         
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(
+                self.PROMPT_VERSION, self.MODEL_NAME, speaker, message, context, sorted(current_entities or [])
+            )
+        return self._generate_json(prompt, cache_key)
+    
+    def filter_and_extract(self, message: str, speaker: str, context: str = "",
+                           current_entities: list = [], explicit: bool = False) -> Optional[Dict[str, Any]]:
+        """單次 LLM 調用完成記憶篩選與知識提取; 不值得記憶時返回 None."""
+        if explicit:
+            decision = "使用者已**明確要求記住**這段對話, 必須輸出 \"memorable\": true 並提取知識."
+        else:
+            # 與 MemoryFilter 共用判斷標準
+            decision = f"""先嚴格判斷對話片段是否需要存入使用者的**長期記憶圖譜**。{MemoryFilter.CRITERIA}
+        不需要記憶時只輸出 {{"memorable": false}}."""
+        
+        prompt = f"""
+        # 任務
+        {decision}
+        需要記憶時, 提取結構化知識:
+        {self.EXTRACTION_GUIDE}
+        # 輸出格式 (嚴格遵守 JSON Schema, 只輸出 JSON)
+        {{
+          "memorable": true,{self.KNOWLEDGE_SCHEMA}}}
+
+        # 對話片段
+        [發言者: {speaker}]
+        {message}
+
+        # 上下文 (最近幾條對話)
+        {context}
+        
+        # 當前關注的實體
+        {current_entities if current_entities else "無"}
+        """
+        
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(
+                self.FUSED_PROMPT_VERSION, self.MODEL_NAME, speaker, message, context,
+                [explicit, sorted(current_entities or [])]
+            )
+        knowledge = self._generate_json(prompt, cache_key)
+        if not knowledge or (not explicit and not knowledge.get("memorable", False)):
+            return None
+        knowledge = dict(knowledge)
+        knowledge.pop("memorable", None)
+        return knowledge
+    
+    def _generate_json(self, prompt: str, cache_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """調用模型並解析 JSON 回應 (提供 cache_key 時先查詢快取, 只快取解析成功的結果)."""
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not LLMResponseCache.MISS:
+                return cached
+        
+        response = None
         try:
             response = self.model.generate_content(prompt)
             response_text = response.text.strip()
@@ -221,7 +870,10 @@ class KnowledgeExtractor:
                 json_end = response_text.rfind("}") + 1
                 response_text = response_text[json_start:json_end]
             
-            return json.loads(response_text)
+            result = json.loads(response_text)
+            if cache_key:
+                self.cache.set(cache_key, result, namespace="extract")
+            return result
         except json.JSONDecodeError as e:
             print(f"知識提取錯誤 (JSON 解析失敗): {e}")
             print(f"原始回應: {response.text[:200]}...")
@@ -230,107 +882,597 @@ class KnowledgeExtractor:
             print(f"知識提取錯誤: {e}")
             return None
 
-class Neo4jMemoryStore:
-    """Neo4j 長期記憶存儲."""
+class Neo4jMemoryStore(GraphMemoryBackend):
+    """Neo4j 長期記憶存儲.
+    
+    - 同步與 asyncio 兩套 API, 讀取走 execute_read, 寫入走 execute_write (集群時分別路由到讀/寫成員)
+    - 連接池大小、獲取連接超時與連接最長存活時間由環境變量設定
+    - 異步驅動綁定事件循環, 每個事件循環各自建立一個
+    - 實體解析快取: 寫入與搜索時記錄 名稱/別名 -> 節點 element id, 關係寫入按 id 定位, 別名歸一到正式名稱
+    """
     
     def __init__(self, uri: str, user: str, password: str):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+        self.uri = uri
+        self.auth = (user, password)
+        self.pool_config = {
+            "max_connection_pool_size": int(os.getenv("NEO4J_MAX_POOL_SIZE", "50")),
+            "connection_acquisition_timeout": float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30")),
+            "max_connection_lifetime": float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600")),
+        }
+        self.driver = GraphDatabase.driver(uri, auth=self.auth, **self.pool_config)
+        self._async_drivers = weakref.WeakKeyDictionary()
+        self.schema = GraphSchemaManager(self.driver, uri)
+        self.schema.bootstrap_once()
+        self.entity_cache = None
+        if os.getenv("ENTITY_CACHE_ENABLED", "true").lower() == "true":
+            self.entity_cache = EntityResolutionCache.shared(uri)
     
     def close(self):
-        """關閉數據庫連接."""
+        """關閉數據庫連接 (仍在運行的事件循環中的異步驅動在其循環中關閉)."""
+        for loop, driver in list(self._async_drivers.items()):
+            if loop.is_running():
+                try:
+                    asyncio.run_coroutine_threadsafe(driver.close(), loop).result(timeout=5)
+                except Exception as e:
+                    print(f"⚠️ 關閉異步 Neo4j 驅動失敗: {e}")
+        self._async_drivers.clear()
         self.driver.close()
     
+    def async_driver(self):
+        """獲取當前事件循環的異步驅動."""
+        loop = asyncio.get_running_loop()
+        driver = self._async_drivers.get(loop)
+        if driver is None:
+            driver = AsyncGraphDatabase.driver(self.uri, auth=self.auth, **self.pool_config)
+            self._async_drivers[loop] = driver
+        return driver
+    
+    async def aclose(self):
+        """關閉當前事件循環的異步驅動."""
+        driver = self._async_drivers.pop(asyncio.get_running_loop(), None)
+        if driver is not None:
+            await driver.close()
+    
     def store_knowledge(self, knowledge: Dict[str, Any], source_log_id: int):
         """將提取的知識存入 Neo4j."""
+        self.store_knowledge_batch([(knowledge, source_log_id)])
+    
+    def store_knowledge_batch(self, items: List[Tuple[Dict[str, Any], int]]):
+        """把多條訊息的知識合併後在同一個事務中寫入 Neo4j."""
+        self.schema.bootstrap_once()
+        self.schema.ensure_labels(
+            entity.get("type") for knowledge, _ in items for entity in knowledge.get("entities", [])
+        )
         with self.driver.session() as session:
-            session.execute_write(self._create_knowledge_graph, knowledge, source_log_id)
+            try:
+                entities, stale = session.execute_write(self._create_knowledge_graph_batch, items)
+            except Exception:
+                self._forget_entities(items)
+                raise
+        self._remember_entities(entities, stale)
     
-    def _create_knowledge_graph(self, tx, data: Dict[str, Any], source_log_id: int):
-        """在事務中創建知識圖譜."""
-        # 1. 處理 Entities (節點)
-        for entity in data.get("entities", []):
-            label = entity["type"]
-            name = entity["name"]  # 提取名稱作為變量
-            props = {"name": name}
-            if "attributes" in entity and entity["attributes"]:
-                props.update(entity["attributes"])
-            
-            # 修正這裡: 使用參數化查詢，正確引用變量
-            query = f"""
-                MERGE (n:{label} {{name: $name}})
-                SET n += $props
-            """
-            tx.run(query, name=name, props=props)
-        
-        # 2. 處理 Relations (關係)
-        for relation in data.get("relations", []):
-            tx.run("""
-                MATCH (source {name: $source_name})
-                MATCH (target {name: $target_name})
-                MERGE (source)-[r:RELATED_TO]->(target) 
-                SET r.type = $rel_type
-            """, 
-                source_name=relation["source"],
-                target_name=relation["target"],
-                rel_type=relation["type"],
-                props={"type": relation["type"], "source": "conversation"})
-        # 新增：處理屬性更新
-        for entity in data.get("entities", []):
-            if "attributes" in entity:
-                for key, value in entity["attributes"].items():
-                    tx.run("""
-                        MATCH (e {name: $name})
-                        SET e.`{key}` = $value
-                    """.format(key=key), 
-                    name=entity["name"], value=value)
-                    
-        # 3. 處理 Events (可作為節點)
-        for event in data.get("events", []):
-            tx.run("""
-                CREATE (e:Event {
-                    description: $desc,
-                    date: $date,
-                    source_log_id: $source_log_id
+    async def astore_knowledge(self, knowledge: Dict[str, Any], source_log_id: int):
+        """異步將提取的知識存入 Neo4j."""
+        await self.astore_knowledge_batch([(knowledge, source_log_id)])
+    
+    async def astore_knowledge_batch(self, items: List[Tuple[Dict[str, Any], int]]):
+        """異步把多條訊息的知識在同一個事務中寫入 Neo4j."""
+        # 結構初始化只在首次遇到新標籤時訪問數據庫, 放到線程中避免阻塞事件循環
+        labels = [entity.get("type") for knowledge, _ in items for entity in knowledge.get("entities", [])]
+        await asyncio.to_thread(self.schema.bootstrap_once)
+        await asyncio.to_thread(self.schema.ensure_labels, labels)
+        
+        async def write(tx):
+            entities, stale = [], []
+            for query, params in self.build_batch_statements(items, self.entity_cache):
+                result = await tx.run(query, params)
+                self._collect_write_records(await result.data(), entities, stale)
+            if stale:
+                result = await tx.run(self.RELATIONS_BY_NAME_CYPHER, {"rows": stale})
+                await result.consume()
+            return entities, stale
+        
+        async with self.async_driver().session() as session:
+            try:
+                entities, stale = await session.execute_write(write)
+            except Exception:
+                self._forget_entities(items)
+                raise
+        self._remember_entities(entities, stale)
+    
+    @classmethod
+    def build_write_statements(cls, data: Dict[str, Any], source_log_id: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """把一次提取的知識轉換為少量 UNWIND 批次語句."""
+        return cls.build_batch_statements([(data, source_log_id)])
+    
+    RELATIONS_BY_NAME_CYPHER = """
+        UNWIND $rows AS row
+        MATCH (source:Entity {name: row.source})
+        MATCH (target:Entity {name: row.target})
+        MERGE (source)-[r:RELATED_TO]->(target)
+        SET r.type = row.type,
+            r.source_log_ids = coalesce(r.source_log_ids, []) +
+                [log_id IN row.source_log_ids WHERE NOT log_id IN coalesce(r.source_log_ids, [])]
+    """
+    
+    # 兩端都已在快取中的關係按 element id 定位; id 失效 (節點已刪除或名稱不符) 的行返回給調用方按名稱重寫
+    RELATIONS_BY_ID_CYPHER = """
+        UNWIND $rows AS row
+        OPTIONAL MATCH (source) WHERE elementId(source) = row.source_id AND source.name = row.source
+        OPTIONAL MATCH (target) WHERE elementId(target) = row.target_id AND target.name = row.target
+        FOREACH (_ IN CASE WHEN source IS NULL OR target IS NULL THEN [] ELSE [1] END |
+            MERGE (source)-[r:RELATED_TO]->(target)
+            SET r.type = row.type,
+                r.source_log_ids = coalesce(r.source_log_ids, []) +
+                    [log_id IN row.source_log_ids WHERE NOT log_id IN coalesce(r.source_log_ids, [])]
+        )
+        WITH row, source, target
+        WHERE source IS NULL OR target IS NULL
+        RETURN row AS stale
+    """
+    
+    @classmethod
+    def build_batch_statements(cls, items: List[Tuple[Dict[str, Any], int]],
+                               resolver: Optional[EntityResolutionCache] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """把一條或多條訊息的知識轉換為少量 UNWIND 批次語句 (每個標籤一條, 關係、事件、摘要各一條).
+        
+        - 實體按 (標籤, 名稱) 去重, 屬性按訊息順序合併, 關係按 (來源, 目標) 去重
+        - 實體與關係記錄 source_log_ids, 事件與摘要記錄各自的 source_log_id
+        - 所有匹配都使用有索引的鍵: 實體按 (標籤, name) 或 (:Entity, name), 事件與摘要按生成的 id
+        - 提供 resolver 時, 別名先歸一到已知實體的正式名稱, 兩端都已知的關係按 element id 定位
+        """
+        def resolve(name, label=None):
+            return resolver.canonical_name(name, label) if resolver is not None and name else name
+        
+        # 本批次內聲明的別名優先 (指向其實體的正式名稱), 其次查詢快取
+        batch_aliases = {}
+        for data, _ in items:
+            for entity in data.get("entities", []):
+                if entity.get("name"):
+                    name = resolve(entity["name"], entity.get("type"))
+                    for alias in entity.get("aliases") or []:
+                        if alias:
+                            batch_aliases.setdefault(EntityResolutionCache.normalize(alias), name)
+        
+        def canonical(name, label=None):
+            if name and EntityResolutionCache.normalize(name) in batch_aliases:
+                return batch_aliases[EntityResolutionCache.normalize(name)]
+            return resolve(name, label)
+        
+        entities, relations, events, summaries = {}, {}, [], []
+        for data, source_log_id in items:
+            for entity in data.get("entities", []):
+                if not entity.get("name"):
+                    continue
+                name = canonical(entity["name"], entity["type"])
+                row = entities.setdefault((entity["type"], name), {
+                    "name": name, "props": {"name": name}, "aliases": [], "source_log_ids": []
                 })
-            """, desc=event["description"], date=event.get("date"), source_log_id=source_log_id)
-            
-            # 關聯 Actor (Person)
-            if event.get("actor"):
-                tx.run("""
-                    MATCH (e:Event {description: $desc})
-                    MATCH (p:Person {name: $actor_name})
-                    MERGE (p)-[:PERFORMED]->(e)
-                """, desc=event["description"], actor_name=event["actor"])
-        
-        # 4. 儲存 Summary
-        if data.get("summary"):
-            tx.run("""
-                CREATE (s:Summary {
-                    text: $text,
-                    source_log_id: $source_log_id
+                row["props"].update(entity.get("attributes") or {})
+                row["props"]["name"] = name
+                for alias in [entity["name"], *(entity.get("aliases") or [])]:
+                    if alias and alias != name and alias not in row["aliases"]:
+                        row["aliases"].append(alias)
+                if source_log_id not in row["source_log_ids"]:
+                    row["source_log_ids"].append(source_log_id)
+            for relation in data.get("relations", []):
+                source, target = canonical(relation["source"]), canonical(relation["target"])
+                row = relations.setdefault((source, target), {
+                    "source": source, "target": target, "source_log_ids": []
+                })
+                row["type"] = relation["type"]
+                if source_log_id not in row["source_log_ids"]:
+                    row["source_log_ids"].append(source_log_id)
+            for event in data.get("events", []):
+                events.append({
+                    "id": str(uuid.uuid4()), "description": event["description"], "date": event.get("date"),
+                    "actor": canonical(event.get("actor"), "Person"), "source_log_id": source_log_id
                 })
-            """, text=data["summary"], source_log_id=source_log_id)
+            if data.get("summary"):
+                summaries.append({"id": str(uuid.uuid4()), "text": data["summary"], "source_log_id": source_log_id})
+        
+        statements = []
+        
+        # 1. Entities: 按標籤分組, 屬性與名稱一次 SET, 並加上共用的 :Entity 標籤; 返回 element id 供快取使用
+        rows_by_label = {}
+        for (label, _), row in entities.items():
+            row["search_parts"] = GraphSchemaManager.search_parts(
+                dict(row["props"], **{GraphSchemaManager.ALIASES_PROPERTY: row["aliases"]})
+            )
+            rows_by_label.setdefault(label, []).append(row)
+        for label, rows in rows_by_label.items():
+            # search_text 供全文索引使用: 只追加尚未包含的片段
+            statements.append((f"""
+                UNWIND $rows AS row
+                MERGE (n:{GraphSchemaManager.escape(label)} {{name: row.name}})
+                SET n:Entity, n += row.props
+                SET n.search_text = reduce(text = coalesce(n.search_text, ''), part IN row.search_parts |
+                    CASE WHEN text CONTAINS part THEN text ELSE text + '\\n' + part END),
+                    n.source_log_ids = coalesce(n.source_log_ids, []) +
+                        [log_id IN row.source_log_ids WHERE NOT log_id IN coalesce(n.source_log_ids, [])],
+                    n.aliases = coalesce(n.aliases, []) +
+                        [alias IN row.aliases WHERE NOT alias IN coalesce(n.aliases, [])]
+                RETURN $label AS label, row.name AS name, elementId(n) AS element_id, n.aliases AS aliases
+            """, {"rows": rows, "label": label}))
+        
+        # 2. Relations: 兩端都已解析到 element id 的直接定位, 其餘按名稱匹配
+        by_id, by_name = [], []
+        for row in relations.values():
+            source_ref = resolver.get(row["source"]) if resolver is not None else None
+            target_ref = resolver.get(row["target"]) if source_ref is not None else None
+            if source_ref is not None and target_ref is not None:
+                by_id.append(dict(row, source=source_ref.name, source_id=source_ref.element_id,
+                                  target=target_ref.name, target_id=target_ref.element_id))
+            else:
+                by_name.append(row)
+        if by_name:
+            statements.append((cls.RELATIONS_BY_NAME_CYPHER, {"rows": by_name}))
+        if by_id:
+            statements.append((cls.RELATIONS_BY_ID_CYPHER, {"rows": by_id}))
+        
+        # 3. Events: 直接關聯剛創建的事件節點, 不再按描述回查
+        if events:
+            statements.append(("""
+                UNWIND $rows AS row
+                CREATE (e:Event {id: row.id, description: row.description, date: row.date,
+                                 source_log_id: row.source_log_id})
+                WITH e, row
+                WHERE row.actor IS NOT NULL
+                MATCH (p:Person {name: row.actor})
+                MERGE (p)-[:PERFORMED]->(e)
+            """, {"rows": events}))
+        
+        # 4. Summary
+        if summaries:
+            statements.append(("""
+                UNWIND $rows AS row
+                CREATE (s:Summary {id: row.id, text: row.text, source_log_id: row.source_log_id})
+            """, {"rows": summaries}))
+        return statements
+    
+    def _create_knowledge_graph(self, tx, data: Dict[str, Any], source_log_id: int):
+        """在事務中創建知識圖譜."""
+        return self._create_knowledge_graph_batch(tx, [(data, source_log_id)])
+    
+    def _create_knowledge_graph_batch(self, tx, items: List[Tuple[Dict[str, Any], int]]):
+        """在同一事務中寫入多條訊息的知識, 返回 (寫入的實體, id 失效的關係行)."""
+        entities, stale = [], []
+        for query, params in self.build_batch_statements(items, self.entity_cache):
+            self._collect_write_records(tx.run(query, params).data(), entities, stale)
+        if stale:
+            tx.run(self.RELATIONS_BY_NAME_CYPHER, {"rows": stale})
+        return entities, stale
+    
+    @staticmethod
+    def _collect_write_records(records: List[Dict[str, Any]], entities: list, stale: list):
+        for record in records:
+            if "stale" in record:
+                stale.append({key: value for key, value in record["stale"].items()
+                              if key not in ("source_id", "target_id")})
+            elif "element_id" in record:
+                entities.append(record)
+    
+    def _remember_entities(self, entities: List[Dict[str, Any]], stale: List[Dict[str, Any]]):
+        """事務提交後更新實體快取 (先移除失效的 id, 再記錄本次寫入的實體)."""
+        if self.entity_cache is None:
+            return
+        if stale:
+            self.entity_cache.invalidate_names(
+                name for row in stale for name in (row["source"], row["target"])
+            )
+        for record in entities:
+            self.entity_cache.put(record["name"], record["label"], record["element_id"], record.get("aliases") or [])
+    
+    def _forget_entities(self, items: List[Tuple[Dict[str, Any], int]]):
+        """寫入失敗時移除相關名稱的快取, 下次寫入重新按名稱匹配."""
+        if self.entity_cache is None:
+            return
+        self.entity_cache.invalidate_names(
+            name for knowledge, _ in items for entity in knowledge.get("entities", [])
+            for name in [entity.get("name"), *(entity.get("aliases") or [])] if name
+        )
+    
+    def canonical_name(self, name: str, label: Optional[str] = None) -> str:
+        if self.entity_cache is None:
+            return name
+        return self.entity_cache.canonical_name(name, label)
+    
+    SEARCH_ENTITIES_CYPHER = f"""
+        CALL db.index.fulltext.queryNodes('{GraphSchemaManager.FULLTEXT_INDEX}', $search) YIELD node, score
+        WITH node, score
+        ORDER BY score DESC
+        LIMIT $limit
+        CALL {{
+            WITH node
+            OPTIONAL MATCH (node)-[r]-(connected)
+            WITH r, connected
+            LIMIT $neighbor_limit
+            RETURN collect(CASE WHEN r IS NULL THEN NULL ELSE {{
+                type: coalesce(r.type, type(r)),
+                properties: properties(r),
+                entity: properties(connected)
+            }} END) AS neighbors
+        }}
+        RETURN properties(node) AS entity, labels(node) AS labels, elementId(node) AS element_id, score,
+               node.importance AS importance, node.last_mentioned_at AS last_mentioned_at, neighbors
+    """
+    
+    def _search_params(self, query: str, limit: int, neighbor_limit: Optional[int]) -> Optional[Dict[str, Any]]:
+        search = GraphSchemaManager.escape_lucene(query)
+        if not search:
+            return None
+        if neighbor_limit is None:
+            neighbor_limit = self.default_neighbor_limit()
+        return {"search": search, "limit": limit, "neighbor_limit": neighbor_limit}
+    
+    @staticmethod
+    def _format_entity_record(record) -> Dict[str, Any]:
+        """把搜索結果記錄轉換為字典 (去掉內部維護的屬性)."""
+        entity = GraphSchemaManager.public_properties(record["entity"])
+        neighbors = [
+            {
+                "type": neighbor["type"],
+                "properties": neighbor["properties"],
+                "entity": GraphSchemaManager.public_properties(neighbor["entity"]),
+            }
+            for neighbor in record["neighbors"]
+        ]
+        return {
+            "entity": entity,
+            "labels": [label for label in record["labels"] if label != GraphSchemaManager.ENTITY_LABEL],
+            "text_score": record["score"],
+            "importance": record.get("importance"),
+            "last_mentioned_at": record.get("last_mentioned_at"),
+            "neighbors": neighbors,
+        }
+    
+    EXPAND_NEIGHBORS_CYPHER = """
+        MATCH (n:Entity {name: $name})
+        WHERE $label IS NULL OR $label IN labels(n)
+        OPTIONAL MATCH (n)-[r]-(connected)
+        WITH r, connected
+        LIMIT $limit
+        RETURN collect(CASE WHEN r IS NULL THEN NULL ELSE {
+            type: coalesce(r.type, type(r)),
+            properties: properties(r),
+            entity: properties(connected)
+        } END) AS neighbors
+    """
+    
+    def expand_neighbors(self, name: str, label: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """展開指定實體的相鄰節點."""
+        def read(tx):
+            record = tx.run(self.EXPAND_NEIGHBORS_CYPHER, name=name, label=label, limit=limit).single()
+            return self._format_entity_record(
+                {"entity": {}, "labels": [], "score": 0.0, "neighbors": record["neighbors"] if record else []}
+            )["neighbors"]
+        
+        with self.driver.session() as session:
+            return session.execute_read(read)
+    
+    LOAD_ENTITIES_CYPHER = f"""
+        MATCH (n:{GraphSchemaManager.ENTITY_LABEL})
+        RETURN elementId(n) AS id, coalesce(n.source_log_ids, []) AS source_log_ids,
+               size([(n)--() | 1]) AS degree,
+               n {{{", ".join("." + key for key in GraphSchemaManager.IMPORTANCE_PROPERTIES)}}} AS scores
+    """
+    
+    LOAD_EDGES_CYPHER = f"""
+        MATCH (source:{GraphSchemaManager.ENTITY_LABEL})-[:RELATED_TO]->(target:{GraphSchemaManager.ENTITY_LABEL})
+        RETURN elementId(source) AS source, elementId(target) AS target
+    """
+    
+    def load_entity_graph(self) -> Tuple[Dict[Any, Dict[str, Any]], List[Tuple[Any, Any]]]:
+        def read(tx):
+            entities = {
+                record["id"]: {"source_log_ids": record["source_log_ids"], "degree": record["degree"],
+                               **record["scores"]}
+                for record in tx.run(self.LOAD_ENTITIES_CYPHER)
+            }
+            edges = [(record["source"], record["target"]) for record in tx.run(self.LOAD_EDGES_CYPHER)]
+            return entities, edges
+        
+        with self.driver.session() as session:
+            return session.execute_read(read)
+    
+    def write_entity_importance(self, scores: Dict[Any, Dict[str, Any]], batch_size: int = 1000):
+        """按批次把重要性分數寫回實體 (每批一個事務)."""
+        rows = [{"id": node_id, "scores": props} for node_id, props in scores.items()]
+        with self.driver.session() as session:
+            for start in range(0, len(rows), batch_size):
+                session.execute_write(lambda tx, chunk: tx.run("""
+                    UNWIND $rows AS row
+                    MATCH (n) WHERE elementId(n) = row.id
+                    SET n += row.scores
+                """, {"rows": chunk}).consume(), rows[start:start + batch_size])
+    
+    def search_entities(self, query: str, limit: int = 5, neighbor_limit: int = None) -> List[Dict[str, Any]]:
+        """以全文索引搜索實體 (LIMIT 作用於實體), 並帶回有限數量的相鄰節點."""
+        params = self._search_params(query, limit, neighbor_limit)
+        if params is None:
+            return []
+        
+        def read(tx):
+            return list(tx.run(self.SEARCH_ENTITIES_CYPHER, params))
+        
+        with self.driver.session() as session:
+            records = session.execute_read(read)
+        self._remember_search_records(records)
+        return [self._format_entity_record(record) for record in records]
+    
+    async def asearch_entities(self, query: str, limit: int = 5, neighbor_limit: int = None) -> List[Dict[str, Any]]:
+        """異步版本的 search_entities."""
+        params = self._search_params(query, limit, neighbor_limit)
+        if params is None:
+            return []
+        
+        async def read(tx):
+            result = await tx.run(self.SEARCH_ENTITIES_CYPHER, params)
+            return [record async for record in result]
+        
+        async with self.async_driver().session() as session:
+            records = await session.execute_read(read)
+        self._remember_search_records(records)
+        return [self._format_entity_record(record) for record in records]
+    
+    def _remember_search_records(self, records):
+        """搜索命中的實體同樣寫入快取, 後續提及這些實體的寫入可以直接按 id 定位."""
+        if self.entity_cache is None:
+            return
+        for record in records:
+            entity = record["entity"] or {}
+            labels = [label for label in record["labels"] if label != GraphSchemaManager.ENTITY_LABEL]
+            if entity.get("name") and labels:
+                self.entity_cache.put(entity["name"], labels[0], record["element_id"],
+                                      entity.get(GraphSchemaManager.ALIASES_PROPERTY) or [])
 
 class VectorMemoryStore:
-    """向量記憶存儲."""
+    """向量記憶存儲.
+    
+    - VECTOR_STORE_MODE=persistent (預設): 索引持久化在 VECTOR_STORE_PATH, 重啟後直接打開已有索引, 不重新嵌入
+    - VECTOR_STORE_MODE=memory: 進程內臨時索引 (進程結束即丟失)
+    - 同一路徑的客戶端在進程內共用; 索引無法打開時移到旁邊並建立空索引, 由 vector_rebuild.py 重建
+    """
+    
+    _clients: Dict[Tuple[str, str], Any] = {}
+    _clients_lock = threading.Lock()
+    
+    def __init__(self, collection_name: str = "ai_secretary_memory", path: str = None, mode: str = None,
+                 embedding_function=None, add_chunk_size: int = None):
+        self.collection_name = collection_name
+        self.mode = (mode or os.getenv("VECTOR_STORE_MODE", "persistent")).lower()
+        self.path = os.path.abspath(path or os.getenv("VECTOR_STORE_PATH", "chroma_db"))
+        self.embedding_function = embedding_function
+        # 每次 collection.add 的文檔上限 (一次嵌入調用與一次索引更新)
+        self.add_chunk_size = add_chunk_size or int(os.getenv("VECTOR_ADD_CHUNK_SIZE", "256"))
+        self.needs_rebuild = False
+        try:
+            self.client = self._get_client(self.mode, self.path)
+            self.collection = self._open_collection()
+        except Exception as e:
+            if self.mode != "persistent":
+                raise
+            self._quarantine(e)
+            self.client = self._get_client(self.mode, self.path)
+            self.collection = self._open_collection()
+    
+    @staticmethod
+    def engine() -> str:
+        """VECTOR_ENGINE 設定的向量引擎: chroma (預設) 或 quantized."""
+        return os.getenv("VECTOR_ENGINE", "chroma").lower()
+    
+    @classmethod
+    def from_env(cls, data_dir: str, embedding_function=None, path: str = None):
+        """按 VECTOR_ENGINE 建立向量存儲: chroma (預設) 或 quantized (進程內 int8 量化索引, 見 vector_engine.py).
+
+        目錄預設為 data_dir 下的 chroma_db 或 vector_index (VECTOR_STORE_PATH 可覆蓋);
+        quantized 引擎進程內共用, 使用自己擁有的嵌入函數 (data_dir 下的嵌入向量快取), 忽略 embedding_function
+        """
+        if cls.engine() == "quantized":
+            return QuantizedVectorStore.shared(
+                path or os.getenv("VECTOR_STORE_PATH") or os.path.join(data_dir, "vector_index"),
+                cache_dir=data_dir
+            )
+        return cls(path=path or os.getenv("VECTOR_STORE_PATH") or os.path.join(data_dir, "chroma_db"),
+                   embedding_function=embedding_function)
+    
+    def _open_collection(self):
+        if self.embedding_function is None:
+            return self.client.get_or_create_collection(name=self.collection_name)
+        return self.client.get_or_create_collection(name=self.collection_name,
+                                                    embedding_function=self.embedding_function)
+    
+    @classmethod
+    def _get_client(cls, mode: str, path: str):
+        key = (mode, path if mode == "persistent" else "")
+        with cls._clients_lock:
+            if key not in cls._clients:
+                if mode == "persistent":
+                    os.makedirs(path, exist_ok=True)
+                    cls._clients[key] = chromadb.PersistentClient(path=path)
+                else:
+                    cls._clients[key] = chromadb.Client()
+            return cls._clients[key]
+    
+    def _quarantine(self, error: Exception):
+        """把無法打開的索引目錄移到旁邊 (保留現場), 之後建立空索引並標記需要重建."""
+        with self._clients_lock:
+            self._clients.pop((self.mode, self.path), None)
+            if os.path.exists(self.path):
+                corrupt_path = f"{self.path}.corrupt-{int(time.time())}"
+                os.replace(self.path, corrupt_path)
+                print(f"⚠️ 向量索引無法打開 ({error}), 已移至 {corrupt_path}")
+        self.needs_rebuild = True
+        print("⚠️ 請執行 python vector_rebuild.py 從 conversation_logs 重建向量索引")
     
-    def __init__(self, collection_name: str = "ai_secretary_memory"):
-        self.client = chromadb.Client()
-        self.collection = self.client.get_or_create_collection(name=collection_name)
+    def count(self) -> int:
+        """索引中的文檔數量."""
+        return self.collection.count()
+    
+    def has_legacy_timestamps(self) -> bool:
+        """索引中最早的文檔是否還是 ISO 字串格式的時間 (時間範圍過濾匹配不到, 需要重建)."""
+        metadatas = self.collection.peek(limit=1).get("metadatas") or []
+        return any(isinstance((metadata or {}).get("timestamp"), str) for metadata in metadatas)
+    
+    def reset(self):
+        """刪除並重新建立集合 (重建索引前使用)."""
+        try:
+            self.client.delete_collection(name=self.collection_name)
+        except Exception:
+            pass
+        self.collection = self._open_collection()
+        self.needs_rebuild = False
+    
+    @staticmethod
+    def build_metadata(session_id: str, speaker: str, timestamp) -> Dict[str, Any]:
+        """訊息的向量元數據 (寫入與重建共用).
+        
+        timestamp 存為 epoch 毫秒, 時間範圍過濾才能下推到查詢; 舊索引中的 ISO 字串不會被範圍條件匹配,
+        執行 python vector_rebuild.py 時會自動從頭重建
+        """
+        return {"session_id": session_id, "speaker": speaker,
+                "timestamp": ConversationLogger.to_epoch_ms(timestamp) if timestamp is not None
+                else ConversationLogger.now_ms()}
+    
+    @staticmethod
+    def build_where(session_id: str = None, speaker: str = None, since=None, until=None) -> Optional[Dict[str, Any]]:
+        """把搜索過濾條件轉換為 chromadb 的 where 子句 (沒有條件時返回 None).
+        
+        since / until 為 epoch 毫秒、datetime 或 ISO 字串, 兩端都包含
+        """
+        conditions = []
+        if session_id:
+            conditions.append({"session_id": session_id})
+        if speaker:
+            conditions.append({"speaker": speaker})
+        if since is not None:
+            conditions.append({"timestamp": {"$gte": ConversationLogger.to_epoch_ms(since)}})
+        if until is not None:
+            conditions.append({"timestamp": {"$lte": ConversationLogger.to_epoch_ms(until)}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
     
     def store_message(self, message_id: str, message: str, metadata: Dict[str, Any] = None):
         """存儲訊息的向量嵌入."""
-        self.collection.add(
-            documents=[message],
-            metadatas=[metadata or {}],
-            ids=[str(message_id)]
-        )
+        self.store_messages([(message_id, message, metadata)])
     
-    def search_similar(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
-        """搜索語義相似的訊息."""
+    def store_messages(self, items: List[Tuple[Any, str, Optional[Dict[str, Any]]]]):
+        """批量存儲多條訊息 (message_id, message, metadata) 的向量嵌入, 每 add_chunk_size 條調用一次 add."""
+        for start in range(0, len(items), self.add_chunk_size):
+            chunk = items[start:start + self.add_chunk_size]
+            self.collection.add(
+                documents=[message for _, message, _ in chunk],
+                metadatas=[metadata or {} for _, _, metadata in chunk],
+                ids=[str(message_id) for message_id, _, _ in chunk]
+            )
+    
+    def search_similar(self, query: str, n_results: int = 5, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """搜索語義相似的訊息 (where 為 build_where 產生的過濾條件, 在索引內過濾後再取 top-k)."""
         results = self.collection.query(
             query_texts=[query],
-            n_results=n_results
+            n_results=n_results,
+            **({"where": where} if where else {})
         )
         return results
 
@@ -339,176 +1481,385 @@ class MemoryManager:
     
     def __init__(self, google_api_key: str, neo4j_uri: str, neo4j_user: str, neo4j_password: str):
         self.conversation_logger = ConversationLogger()
-        self.memory_filter = MemoryFilter(google_api_key)
-        self.knowledge_extractor = KnowledgeExtractor(google_api_key)
-        self.neo4j_store = Neo4jMemoryStore(neo4j_uri, neo4j_user, neo4j_password)
-        self.vector_store = VectorMemoryStore()
+        
+        # LLM 回應快取, 與 conversation_logs.db 放在同一目錄 (LLM_CACHE_ENABLED=false 時停用)
+        self.llm_cache = self._open_llm_cache()
+        
+        self.memory_filter = MemoryFilter(google_api_key, cache=self.llm_cache)
+        self.knowledge_extractor = KnowledgeExtractor(google_api_key, cache=self.llm_cache)
+        # 圖譜後端: neo4j (預設) 或 memory (進程內鄰接表, 可選快照到 GRAPH_SNAPSHOT_PATH;
+        # 所有 AI 秘書實例共用同一個圖譜)
+        self.graph_store: GraphMemoryBackend
+        if os.getenv("GRAPH_BACKEND", "neo4j").lower() == "memory":
+            self.graph_store = InMemoryGraphBackend.shared()
+        else:
+            self.graph_store = Neo4jMemoryStore(neo4j_uri, neo4j_user, neo4j_password)
+        # 向量索引預設持久化在 conversation_logs.db 旁, 寫入與查詢共用嵌入向量快取
+        # (EMBEDDING_CACHE_ENABLED=false 時使用 chromadb 預設嵌入函數;
+        # quantized 引擎在進程內共用, 自帶嵌入函數, 本實例不另外建立, 關閉時也不會關閉它)
+        data_dir = os.path.dirname(os.path.abspath(self.conversation_logger.db_path))
+        self.embedding_function = None
+        if VectorMemoryStore.engine() == "chroma":
+            self.embedding_function = CachedEmbeddingFunction.from_env(data_dir)
+        self.vector_store = VectorMemoryStore.from_env(data_dir, embedding_function=self.embedding_function)
+        if self.vector_store.mode == "persistent" and self.vector_store.count() == 0 \
+                and self.conversation_logger.get_messages(limit=1):
+            print("⚠️ 向量索引為空但已有對話記錄, 可執行 python vector_rebuild.py 重建")
+        elif self.vector_store.has_legacy_timestamps():
+            print("⚠️ 向量索引使用舊的時間格式, 時間範圍過濾不會匹配這些訊息, 可執行 python vector_rebuild.py 重建")
         self.smart_retrieval = SmartMemoryRetrieval()  # 添加智能檢索器
         self.state_manager = ConversationStateManager()
+        
+        # 規則閘門: 明顯的情況不調用 LLM (MEMORY_GATE_ENABLED=false 時停用)
+        self.memory_gate = None
+        if os.getenv("MEMORY_GATE_ENABLED", "true").lower() == "true":
+            self.memory_gate = MemoryGate()
+        
+        # 記憶篩選微批次 (MEMORY_FILTER_BATCHING=true 時啟用, 進程內共用)
+        self.filter_batcher = None
+        if os.getenv("MEMORY_FILTER_BATCHING", "false").lower() == "true":
+            # 批次器在進程內共用, 使用自己的篩選器與快取連接, 不受單個實例關閉影響
+            self.filter_batcher = MemoryFilterBatcher.shared(
+                lambda: MemoryFilter(google_api_key, cache=self._open_llm_cache())
+            )
+        
+        # 向量寫入緩衝: 多條訊息合併為一次嵌入與索引更新 (VECTOR_WRITE_BUFFER=true 時啟用)
+        self.vector_write_buffer = None
+        if os.getenv("VECTOR_WRITE_BUFFER", "false").lower() == "true":
+            self.vector_write_buffer = VectorWriteBuffer(self.vector_store)
+        
+        # 圖譜寫入緩衝: 多條訊息的知識合併為一個事務提交 (GRAPH_WRITE_BUFFER=true 時啟用)
+        self.graph_write_buffer = None
+        if os.getenv("GRAPH_WRITE_BUFFER", "false").lower() == "true":
+            self.graph_write_buffer = GraphWriteBuffer(self.graph_store)
+        
+        # 背景記憶寫入隊列 (MEMORY_INGEST_ASYNC=false 時同步處理)
+        self.ingestion_queue = None
+        if os.getenv("MEMORY_INGEST_ASYNC", "true").lower() == "true":
+            self.ingestion_queue = MemoryIngestionQueue(self).start()
+            self.ingestion_queue.recover_once()
+        
+        # 實體重要性定期計算 (ENTITY_IMPORTANCE_INTERVAL_SECONDS > 0 時啟用, 進程內共用)
+        self.importance_job = None
+        importance_interval = float(os.getenv("ENTITY_IMPORTANCE_INTERVAL_SECONDS", "0"))
+        if importance_interval > 0:
+            self.importance_job = EntityImportanceJob.shared(
+                self.graph_store, self.conversation_logger, importance_interval
+            )
+    
+    def _open_llm_cache(self) -> Optional[LLMResponseCache]:
+        """打開 conversation_logs.db 旁的 LLM 回應快取 (LLM_CACHE_ENABLED=false 時返回 None)."""
+        if os.getenv("LLM_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        cache_dir = os.path.dirname(os.path.abspath(self.conversation_logger.db_path))
+        return LLMResponseCache(os.path.join(cache_dir, "llm_cache.db"))
     
-    def process_message(self, session_id: str, speaker: str, message: str):
+    def process_message(self, session_id: str, speaker: str, message: str) -> int:
+        """處理一條訊息: 只在關鍵路徑上寫入 SQLite, 其餘工作交給背景寫入隊列."""
         # 更新對話狀態
         self.state_manager.update_state(session_id, speaker, message)
         
-        # 獲取上下文
-        context = self.state_manager.get_context(session_id)
-        current_entities = self.state_manager.get_current_entities(session_id)
+        # 1. 記錄原始對話 (processed = FALSE 作為持久化交接點)
+        timestamp = ConversationLogger.now_ms()
+        message_id = self.conversation_logger.log_message(session_id, speaker, message, timestamp)
+        
+        job = {
+            "id": message_id,
+            "session_id": session_id,
+            "speaker": speaker,
+            "message": message,
+            "timestamp": timestamp,
+            # 在入隊時擷取上下文, 避免背景處理時對話狀態已經改變
+            "context": self.state_manager.get_context(session_id),
+            "current_entities": list(self.state_manager.get_current_entities(session_id)),
+        }
+        
+        if self.ingestion_queue is None:
+            self.ingest_message(job)
+        else:
+            # 隊列已滿時訊息保持未處理狀態, 由隊列稍後恢復
+            self.ingestion_queue.submit(job)
+        return message_id
+    
+    def ingest_message(self, job: Dict[str, Any]) -> str:
+        """處理已記錄的訊息: 向量存儲、記憶篩選、知識提取與圖譜寫入, 返回處理狀態.
+
+        圖譜寫入緩衝模式下知識尚未提交, job["graph_commit"] 為提交結果的 Future
+        """
+        message_id = job["id"]
+        session_id = job["session_id"]
+        speaker = job["speaker"]
+        message = job["message"]
+        context = job.get("context", "")
+        current_entities = job.get("current_entities", [])
         
-        # ... 原有記錄和向量存儲代碼 ...
+        # 1. 存儲向量嵌入 (緩衝模式下與其他訊息合併為一次 add)
+        metadata = VectorMemoryStore.build_metadata(session_id, speaker, job.get("timestamp"))
+        if self.vector_write_buffer is not None:
+            self.vector_write_buffer.add(message_id, message, metadata)
+        else:
+            self.vector_store.store_message(message_id, message, metadata)
         
-        # 判斷是否值得記憶時加入上下文
-        if self.memory_filter.is_worth_remembering(message, speaker, context):
-            # 提取知識時加入上下文和當前實體
-            knowledge = self.knowledge_extractor.extract_knowledge(
-                message, speaker, context, current_entities
+        # 2. 判斷是否值得記憶並提取知識 (明確要求記住的訊息由規則預先判斷)
+        explicit = self.memory_filter.is_explicit_request(message, speaker)
+        decision = self.memory_gate.decide(message, speaker) if self.memory_gate else None
+        explicit = explicit or decision is True
+        if decision is False:
+            # 規則閘門判定明顯不值得記憶, 不調用 LLM
+            knowledge = None
+        elif self.filter_batcher is not None and not explicit:
+            # 批次模式: 篩選與其他會話的訊息合併成一次調用, 只對值得記憶的訊息提取
+            knowledge = None
+            if self.filter_batcher.classify(message, speaker, context, session_id):
+                knowledge = self.knowledge_extractor.extract_knowledge(
+                    message, speaker, context, current_entities
+                )
+        else:
+            # 單次 LLM 調用完成篩選與提取
+            knowledge = self.knowledge_extractor.filter_and_extract(
+                message, speaker, context, current_entities, explicit=explicit
             )
-            
-            if knowledge:
-                # 更新當前討論的實體
-                if knowledge.get("entities"):
-                    self.state_manager.get_session(session_id)["current_entities"] = [
-                        e["name"] for e in knowledge["entities"]
-                    ]
-                
-        """處理一條訊息."""
-        # 1. 記錄原始對話
-        message_id = self.conversation_logger.log_message(session_id, speaker, message)
-        
-        # 2. 存儲向量嵌入
-        self.vector_store.store_message(
-            message_id, 
-            message, 
-            {"session_id": session_id, "speaker": speaker, "timestamp": datetime.now().isoformat()}
-        )
         
-        # 3. 判斷是否值得深度記憶
-        if self.memory_filter.is_worth_remembering(message, speaker):
-            # 4. 提取結構化知識
-            knowledge = self.knowledge_extractor.extract_knowledge(message, speaker)
-            if knowledge:
-                # 5. 存入 Neo4j
-                self.neo4j_store.store_knowledge(knowledge, message_id)
-                # 6. 標記為已處理
-                self.conversation_logger.mark_as_processed(message_id)
-    
-    def search_memory(self, query: str, limit: int = 5) -> Dict[str, Any]:
-        """增強的記憶搜索功能, 結合向量搜索和圖搜索."""
-        results = {
+        status = ConversationLogger.STATUS_SKIPPED
+        if knowledge:
+            # 3. 更新當前討論的實體
+            if knowledge.get("entities"):
+                # 別名歸一為正式名稱, 下一輪提取時模型看到的是圖譜中已有的實體
+                self.state_manager.get_session(session_id)["current_entities"] = list(dict.fromkeys(
+                    self.graph_store.canonical_name(e["name"], e.get("type")) for e in knowledge["entities"]
+                ))
+            # 4. 存入圖譜
+            status = ConversationLogger.STATUS_STORED
+            if self.graph_write_buffer is not None:
+                # 緩衝模式: 事務提交成功後才標記為已處理, 失敗的訊息保持未處理狀態等待恢復
+                job["graph_commit"] = self.graph_write_buffer.add(
+                    knowledge, message_id,
+                    on_commit=lambda: self.conversation_logger.mark_as_processed(message_id, status)
+                )
+                return status
+            self.graph_store.store_knowledge(knowledge, message_id)
+        
+        # 5. 標記為已處理 (無論是否值得深度記憶, 避免重複處理)
+        self.conversation_logger.mark_as_processed(message_id, status)
+        return status
+    
+    def get_ingestion_stats(self) -> Dict[str, Any]:
+        """獲取記憶寫入流程的統計數據."""
+        stats = {}
+        if self.ingestion_queue is not None:
+            stats["queue"] = dict(self.ingestion_queue.stats, pending=self.ingestion_queue.pending_count())
+        if self.memory_gate is not None:
+            stats["gate"] = self.memory_gate.get_stats()
+        if self.filter_batcher is not None:
+            stats["batcher"] = dict(self.filter_batcher.stats)
+        if self.llm_cache is not None:
+            stats["llm_cache"] = self.llm_cache.get_stats()
+        if self.graph_write_buffer is not None:
+            stats["graph_write_buffer"] = dict(self.graph_write_buffer.stats,
+                                               pending=self.graph_write_buffer.pending_count())
+        embedding_function = self.embedding_function or getattr(self.vector_store, "embedding_function", None)
+        if isinstance(embedding_function, CachedEmbeddingFunction):
+            stats["embedding_cache"] = embedding_function.cache.get_stats()
+        if self.vector_write_buffer is not None:
+            stats["vector_write_buffer"] = dict(self.vector_write_buffer.stats,
+                                                pending=self.vector_write_buffer.pending_count())
+        if getattr(self.graph_store, "entity_cache", None) is not None:
+            stats["entity_cache"] = self.graph_store.entity_cache.get_stats()
+        if isinstance(self.vector_store, QuantizedVectorStore):
+            stats["vector_engine"] = self.vector_store.get_stats()
+        return stats
+    
+    def drain_ingestion(self, timeout: float = None) -> bool:
+        """等待背景寫入隊列處理完所有訊息, 並提交緩衝中的向量與圖譜寫入."""
+        drained = self.ingestion_queue.drain(timeout) if self.ingestion_queue is not None else True
+        if self.vector_write_buffer is not None:
+            self.vector_write_buffer.flush()
+        if self.graph_write_buffer is not None:
+            self.graph_write_buffer.flush()
+        return drained
+    
+    def _empty_search_results(self) -> Dict[str, Any]:
+        return {
+            "lexical_results": [],
             "vector_results": {"documents": [[]], "metadatas": [[]], "distances": [[]]},
             "graph_results": [],
             "combined_results": [],
             "smart_results": [],
             "summary": ""
         }
+    
+    def search_memory(self, query: str, limit: int = 5, session_id: str = None, speaker: str = None,
+                      since=None, until=None) -> Dict[str, Any]:
+        """增強的記憶搜索功能, 結合全文搜索、向量搜索和圖搜索.
+        
+        session_id / speaker / since / until 為可選的過濾條件 (時間為 epoch 毫秒、datetime 或 ISO 字串, 兩端都包含),
+        在全文查詢與向量索引內過濾後再取 top-limit; 圖譜知識不屬於單一會話, 不受過濾影響
+        """
+        results = self._empty_search_results()
+        filters = {"session_id": session_id, "speaker": speaker, "since": since, "until": until}
         
         try:
+            # 0. 全文搜索 - 基於精確詞 (電話、郵箱、名稱等), 不需要計算嵌入
+            results["lexical_results"] = self.conversation_logger.search_fulltext(query, limit, **filters)
+            
             # 1. 向量搜索 - 基於語義相似性
-            vector_results = self.vector_store.search_similar(query, n_results=limit)
-            results["vector_results"] = vector_results
+            results["vector_results"] = self.vector_store.search_similar(
+                query, n_results=limit, where=VectorMemoryStore.build_where(**filters)
+            )
             
-            # 2. Neo4j 圖搜索 - 基於實體和關係
-            graph_results = self._search_graph_memory(query, limit)
-            results["graph_results"] = graph_results
+            # 2. 圖搜索 - 基於實體和關係
+            results["graph_results"] = self._search_graph_memory(query, limit)
             
-            # 3. 結合和排序結果
-            combined_results = self._combine_and_rank_results(
-                vector_results, graph_results, query
+            self._rank_search_results(query, results)
+        except Exception as e:
+            print(f"記憶搜索錯誤: {e}")
+        
+        return results
+    
+    async def asearch_memory(self, query: str, limit: int = 5, session_id: str = None, speaker: str = None,
+                             since=None, until=None) -> Dict[str, Any]:
+        """異步記憶搜索: 三個通道並行, 圖搜索使用異步驅動, 其餘在線程中執行 (過濾條件同 search_memory)."""
+        results = self._empty_search_results()
+        filters = {"session_id": session_id, "speaker": speaker, "since": since, "until": until}
+        
+        try:
+            lexical_results, vector_results, graph_results = await asyncio.gather(
+                asyncio.to_thread(self.conversation_logger.search_fulltext, query, limit, **filters),
+                asyncio.to_thread(self.vector_store.search_similar, query, limit,
+                                  VectorMemoryStore.build_where(**filters)),
+                self._asearch_graph_memory(query, limit),
             )
-            results["combined_results"] = combined_results
-            
-            # 4. 使用智能檢索器進行增強分析
-            if combined_results:
-                smart_results = self.smart_retrieval.enhanced_search(
-                    query, combined_results
-                )
-                results["smart_results"] = smart_results
-                
-                # 5. 生成記憶摘要
-                results["summary"] = create_memory_summary(smart_results[:5])
+            results["lexical_results"] = lexical_results
+            results["vector_results"] = vector_results
+            results["graph_results"] = graph_results
             
+            self._rank_search_results(query, results)
         except Exception as e:
             print(f"記憶搜索錯誤: {e}")
         
         return results
     
+    def _rank_search_results(self, query: str, results: Dict[str, Any]):
+        """結合三個通道的結果, 進行智能排序並生成摘要."""
+        # 3. 結合和排序結果
+        combined_results = self._combine_and_rank_results(
+            results["vector_results"], results["graph_results"], query, results["lexical_results"]
+        )
+        results["combined_results"] = combined_results
+        
+        # 4. 使用智能檢索器進行增強分析
+        if combined_results:
+            smart_results = self.smart_retrieval.enhanced_search(
+                query, combined_results
+            )
+            results["smart_results"] = smart_results
+            
+            # 5. 生成記憶摘要
+            results["summary"] = create_memory_summary(smart_results[:5])
+    
     def _search_graph_memory(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """在 Neo4j 圖數據庫中搜索相關記憶."""
+        """在圖譜中搜索相關記憶."""
         try:
-            with self.neo4j_store.driver.session() as session:
-                # 搜索實體名稱包含查詢關鍵字的節點
-                cypher_query = """
-                MATCH (n)
-                WHERE toLower(n.name) CONTAINS toLower($query)
-                   OR ANY(prop IN keys(n) WHERE toLower(toString(n[prop])) CONTAINS toLower($query))
-                OPTIONAL MATCH (n)-[r]-(connected)
-                RETURN n, r, connected
-                LIMIT $limit
-                """
-                
-                result = session.run(cypher_query, {"query": query, "limit": limit})
-                graph_results = []
-                
-                for record in result:
-                    node = record["n"]
-                    relation = record["r"]
-                    connected = record["connected"]
-                    
-                    result_item = {
-                        "type": "graph_entity",
-                        "entity": dict(node) if node else None,
-                        "relation": {
-                            "type": relation.type if relation else None,
-                            "properties": dict(relation) if relation else None
-                        } if relation else None,
-                        "connected_entity": dict(connected) if connected else None,
-                        "relevance_score": self._calculate_graph_relevance(query, node, relation, connected)
-                    }
-                    graph_results.append(result_item)
-                
-                return sorted(graph_results, key=lambda x: x["relevance_score"], reverse=True)
-                
+            entities = self.graph_store.search_entities(query, limit)
         except Exception as e:
             print(f"圖搜索錯誤: {e}")
             return []
+        return self._score_graph_entities(query, entities)
     
-    def _calculate_graph_relevance(self, query: str, node, relation, connected) -> float:
-        """計算圖搜索結果的相關性分數."""
-        score = 0.0
+    async def _asearch_graph_memory(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """異步在圖譜中搜索相關記憶."""
+        try:
+            entities = await self.graph_store.asearch_entities(query, limit)
+        except Exception as e:
+            print(f"圖搜索錯誤: {e}")
+            return []
+        return self._score_graph_entities(query, entities)
+    
+    def _score_graph_entities(self, query: str, entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """計算圖搜索結果的相關性並排序."""
+        # 全文分數按本次結果的最高分歸一化到 0-1
+        max_score = max((item["text_score"] for item in entities), default=0.0) or 1.0
+        # 預先計算的結構重要性與查詢時的近期分數合成
+        now_ms = ConversationLogger.now_ms()
+        importances = [current_importance(item.get("importance"), item.get("last_mentioned_at"), now_ms)
+                       for item in entities]
+        # 尚未計算重要性的實體取本次結果的平均重要性, 與已計算的實體在同一尺度上比較
+        # (本次結果都沒有重要性時不加權)
+        known = [importance for importance in importances if importance is not None]
+        default_importance = sum(known) / len(known) if known else None
+        graph_results = []
+        for item, importance in zip(entities, importances):
+            graph_results.append({
+                "type": "graph_entity",
+                "entity": item["entity"],
+                "labels": item["labels"],
+                "neighbors": item["neighbors"],
+                "importance": importance,
+                "relevance_score": self._calculate_graph_relevance(
+                    query, item["entity"], item["neighbors"], item["text_score"] / max_score,
+                    importance if importance is not None else default_importance
+                )
+            })
+        return sorted(graph_results, key=lambda x: x["relevance_score"], reverse=True)
+    
+    def _calculate_graph_relevance(self, query: str, entity: Dict[str, Any], neighbors: List[Dict[str, Any]],
+                                   text_score: float, importance: Optional[float] = None) -> float:
+        """計算圖搜索結果的相關性分數 (全文分數為主, 名稱命中與相鄰節點命中加分, 再按預先計算的重要性加權)."""
+        score = text_score
         query_lower = query.lower()
         
-        # 檢查主節點的相關性
-        if node:
-            node_dict = dict(node)
-            if "name" in node_dict and query_lower in node_dict["name"].lower():
-                score += 1.0
-            
-            # 檢查節點屬性
-            for key, value in node_dict.items():
-                if isinstance(value, str) and query_lower in value.lower():
-                    score += 0.5
-        
-        # 檢查關係的相關性
-        if relation:
-            if query_lower in relation.type.lower():
+        # 名稱或別名直接命中
+        names = [entity.get("name", ""), *(entity.get(GraphSchemaManager.ALIASES_PROPERTY) or [])]
+        for name in (str(name).lower() for name in names):
+            if name and (query_lower in name or name in query_lower):
                 score += 0.3
+                break
         
-        # 檢查連接節點的相關性
-        if connected:
-            connected_dict = dict(connected)
-            if "name" in connected_dict and query_lower in connected_dict["name"].lower():
-                score += 0.7
+        # 相鄰節點名稱命中
+        for neighbor in neighbors:
+            connected_name = str(neighbor["entity"].get("name", "")).lower()
+            if connected_name and connected_name in query_lower:
+                score += 0.1
         
-        return score
+        score = min(score, 1.0)
+        if importance is None:
+            # 重要性任務尚未計算過本次結果中的任何實體
+            return score
+        
+        # 文本相關性相同時, 中心度高、常被提及、最近提及的實體排在前面
+        weight = float(os.getenv("GRAPH_IMPORTANCE_WEIGHT", "0.2"))
+        return score * (1 - weight) + weight * importance
     
-    def _combine_and_rank_results(self, vector_results, graph_results, query: str) -> List[Dict[str, Any]]:
-        """結合向量搜索和圖搜索結果, 並進行智能排序."""
+    def _combine_and_rank_results(self, vector_results, graph_results, query: str,
+                                  lexical_results: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """結合全文搜索、向量搜索和圖搜索結果, 並進行智能排序."""
         combined = []
         
+        # 處理全文搜索結果 (BM25 分數按本次結果的最高分歸一化到 0-1)
+        if lexical_results:
+            max_score = max(r["score"] for r in lexical_results) or 1.0
+            for row in lexical_results:
+                combined.append({
+                    "type": "lexical",
+                    "content": row["message"],
+                    "metadata": {
+                        "session_id": row["session_id"],
+                        "speaker": row["speaker"],
+                        "timestamp": ConversationLogger.format_timestamp(row["timestamp"]),
+                        "log_id": row["id"]
+                    },
+                    "score": row["score"] / max_score,
+                    "source": "fulltext_search"
+                })
+        
         # 處理向量搜索結果
         if vector_results and vector_results.get("documents") and vector_results["documents"][0]:
             for i, doc in enumerate(vector_results["documents"][0]):
                 metadata = vector_results["metadatas"][0][i] if i < len(vector_results["metadatas"][0]) else {}
                 distance = vector_results["distances"][0][i] if i < len(vector_results["distances"][0]) else 1.0
+                if metadata and "timestamp" in metadata:
+                    # 索引中存的是 epoch 毫秒 (舊索引為 ISO 字串), 與全文搜索結果一樣以 ISO 字串顯示
+                    metadata = dict(metadata, timestamp=ConversationLogger.format_timestamp(metadata["timestamp"]))
                 
                 combined.append({
                     "type": "vector",
@@ -528,8 +1879,8 @@ class MemoryManager:
                 "content": content,
                 "metadata": {
                     "entity": graph_result.get("entity", {}),
-                    "relation": graph_result.get("relation", {}),
-                    "connected_entity": graph_result.get("connected_entity", {})
+                    "labels": graph_result.get("labels", []),
+                    "neighbors": graph_result.get("neighbors", [])
                 },
                 "score": graph_result.get("relevance_score", 0.0),
                 "source": "graph_search"
@@ -554,8 +1905,7 @@ class MemoryManager:
     def _format_graph_result(self, graph_result: Dict[str, Any]) -> str:
         """格式化圖搜索結果為可讀文本."""
         entity = graph_result.get("entity", {})
-        relation = graph_result.get("relation", {})
-        connected = graph_result.get("connected_entity", {})
+        neighbors = graph_result.get("neighbors", [])
         
         if not entity:
             return "未知實體"
@@ -568,8 +1918,12 @@ class MemoryManager:
                 result_text += f", {key}: {value}"
         
         # 添加關係信息
-        if relation and relation.get("type") and connected:
-            result_text += f' | 關係: {relation["type"]} -> {connected.get("name", "未知")}'
+        relations = [
+            f'{neighbor["type"]} -> {neighbor["entity"].get("name") or neighbor["entity"].get("description", "未知")}'
+            for neighbor in neighbors if neighbor.get("type")
+        ]
+        if relations:
+            result_text += " | 關係: " + "; ".join(relations)
         return result_text
     
     def _is_similar_content(self, content1: str, content2: str, threshold: float = 0.8) -> bool:
@@ -592,7 +1946,20 @@ class MemoryManager:
     
     def close(self):
         """關閉所有連接."""
-        self.neo4j_store.close()
+        if self.ingestion_queue is not None:
+            self.ingestion_queue.close()
+        if self.vector_write_buffer is not None:
+            self.vector_write_buffer.close()
+        if self.graph_write_buffer is not None:
+            self.graph_write_buffer.close()
+        if self.importance_job is not None:
+            EntityImportanceJob.release(self.graph_store, self.conversation_logger)
+        if self.llm_cache is not None:
+            self.llm_cache.close()
+        if self.embedding_function is not None:
+            self.embedding_function.close()
+        self.conversation_logger.close()
+        self.graph_store.close()
 
 class ConversationStateManager:
     """管理對話狀態和上下文"""
@@ -1,5 +1,6 @@
 import os
 import sys
+import atexit
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
@@ -9,18 +10,23 @@ from src.routes.user import user_bp
 from src.routes.chat import chat_bp
 
 from src.services.api_key_manager import api_key_manager
+from src.services.secretary_pool import secretary_pool
 from main import AISecretary
 
 # Pre-load MCP servers and tools with a global AISecretary instance (using any valid key)
+# and hand it to the pool so the first /api/chat request reuses the warm instance
 PRELOAD_MODEL = 'gemini-2.5-pro'
 try:
     PRELOAD_API_KEY = api_key_manager.get_key(PRELOAD_MODEL)
     global_ai_secretary = AISecretary(PRELOAD_MODEL, PRELOAD_API_KEY)
+    secretary_pool.add(PRELOAD_MODEL, PRELOAD_API_KEY, global_ai_secretary)
     print('✅ MCP servers and tools pre-loaded on startup.')
 except Exception as e:
     global_ai_secretary = None
     print(f'⚠️ MCP preload failed: {e}')
 
+atexit.register(secretary_pool.close)
+
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -1,22 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_cors import cross_origin
 import sys
 import os
+import json
 
 from src.services.api_key_manager import api_key_manager
+from src.services.secretary_pool import secretary_pool
 
 # 添加主項目路徑以便導入 AI 秘書模組
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..'))
 
-from main import AISecretary
-
 
 chat_bp = Blueprint('chat', __name__)
 
+_conversation_logger = None
+
+def get_conversation_logger():
+    """獲取共用的對話日誌實例（只用於讀取歷史）"""
+    global _conversation_logger
+    if _conversation_logger is None:
+        from memory_manager import ConversationLogger
+        _conversation_logger = ConversationLogger()
+    return _conversation_logger
+
 def get_ai_secretary(model, api_key):
-    """獲取或創建 AI 秘書實例"""
-    # 每次都創建新實例以確保使用最新配置
-    return AISecretary(model, api_key)
+    """從實例池借出 AI 秘書實例（with 語法，結束後自動歸還）"""
+    return secretary_pool.lease(model, api_key)
 
 @chat_bp.route('/chat', methods=['POST'])
 @cross_origin()
@@ -36,10 +45,12 @@ def chat():
             return jsonify({'error': str(e)}), 400
          
           
-        secretary = get_ai_secretary(model, api_key)
-        
-        # 獲取 AI 回覆
-        ai_response = secretary.chat(user_message)
+        try:
+            with get_ai_secretary(model, api_key) as secretary:
+                # 獲取 AI 回覆
+                ai_response = secretary.chat(user_message)
+        except TimeoutError as e:
+            return jsonify({'success': False, 'error': f'服務繁忙，請稍後再試：{str(e)}'}), 503
         
         return jsonify({
             'success': True,
@@ -53,6 +64,60 @@ def chat():
             'error': f'處理請求時發生錯誤：{str(e)}'
         }), 500
 
+def format_sse(event: dict) -> str:
+    """將事件格式化為 Server-Sent Events 訊息"""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@chat_bp.route('/chat/stream', methods=['POST'])
+@cross_origin()
+def chat_stream():
+    """以 SSE 串流方式處理聊天請求"""
+    data = request.get_json()
+    if not data or 'message' not in data:
+        return jsonify({'error': '缺少消息內容'}), 400
+    
+    user_message = data['message']
+    model = data.get('model', 'gemini-2.5-pro')
+
+    try:
+        api_key = api_key_manager.get_key(model)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        secretary = secretary_pool.checkout(model, api_key)
+    except TimeoutError as e:
+        return jsonify({'success': False, 'error': f'服務繁忙，請稍後再試：{str(e)}'}), 503
+
+    def generate():
+        # 串流結束（或客戶端斷線）後才把實例歸還實例池
+        try:
+            for event in secretary.stream_chat(user_message):
+                yield format_sse(event)
+            yield format_sse({'type': 'done'})
+        finally:
+            secretary_pool.checkin(secretary)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@chat_bp.route('/sessions/<session_id>/history', methods=['GET'])
+@cross_origin()
+def session_history(session_id):
+    """按鍵集分頁獲取會話歷史（before_timestamp + before_id 為上一頁的 next_cursor）"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    before_timestamp = request.args.get('before_timestamp', type=int)
+    before_id = request.args.get('before_id', type=int)
+    cursor = None
+    if before_timestamp is not None and before_id is not None:
+        cursor = {'timestamp': before_timestamp, 'id': before_id}
+    
+    history = get_conversation_logger().get_session_history(session_id, limit, cursor)
+    return jsonify(history)
+
 @chat_bp.route('/health', methods=['GET'])
 @cross_origin()
 def health():
@@ -62,6 +127,12 @@ def health():
         'message': 'AI 秘書服務正常運行'
     })
 
+@chat_bp.route('/pool-status', methods=['GET'])
+def pool_status():
+    """獲取 AI 秘書實例池狀態"""
+    secretary_pool.evict_idle()
+    return jsonify(secretary_pool.get_status())
+
 @chat_bp.route('/key-info', methods=['GET'])
 def key_info():
     """获取各模型的密钥信息"""
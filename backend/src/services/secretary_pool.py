@@ -0,0 +1,208 @@
+# services/secretary_pool.py
+import os
+import time
+import threading
+import logging
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _create_secretary(model: str, api_key: str):
+    """默认的 AISecretary 工厂（延迟导入，避免循环依赖）"""
+    from main import AISecretary
+    return AISecretary(model, api_key)
+
+
+class SecretaryPool:
+    """按 (model, api_key) 分组的 AISecretary 实例池
+
+    - checkout/checkin: 同一实例同一时间只借给一个请求
+    - max_size: 池内实例总数上限（包括借出中的）
+    - idle_timeout: 空闲超过该秒数的实例会被关闭回收
+    """
+
+    def __init__(self, factory: Callable[[str, str], Any] = None,
+                 max_size: int = None, idle_timeout: float = None,
+                 checkout_timeout: float = None):
+        self.factory = factory or _create_secretary
+        self.max_size = max_size or int(os.getenv('SECRETARY_POOL_MAX_SIZE', 4))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else \
+            float(os.getenv('SECRETARY_POOL_IDLE_TIMEOUT', 600))
+        self.checkout_timeout = checkout_timeout if checkout_timeout is not None else \
+            float(os.getenv('SECRETARY_POOL_CHECKOUT_TIMEOUT', 30))
+
+        self._lock = threading.Condition()
+        # key -> deque[(instance, last_used)]，右端为最近归还
+        self._idle: Dict[Tuple[str, str], deque] = defaultdict(deque)
+        self._leased: Dict[int, Tuple[str, str]] = {}
+        self._creating = 0
+        self._closed = False
+        self.stats = defaultdict(int)
+        logger.info(f"Secretary pool initialized (max_size={self.max_size}, idle_timeout={self.idle_timeout}s)")
+
+    def _total(self) -> int:
+        """当前实例总数（空闲 + 借出 + 创建中）"""
+        return sum(len(q) for q in self._idle.values()) + len(self._leased) + self._creating
+
+    def _pop_expired(self) -> list:
+        """取出空闲超时的实例（调用方需持有锁）"""
+        expired = []
+        if self.idle_timeout <= 0:
+            return expired
+        deadline = time.monotonic() - self.idle_timeout
+        for key in list(self._idle):
+            queue = self._idle[key]
+            while queue and queue[0][1] < deadline:
+                expired.append(queue.popleft()[0])
+            if not queue:
+                del self._idle[key]
+        return expired
+
+    def _pop_lru_idle(self) -> Optional[Any]:
+        """取出最久未使用的空闲实例以腾出容量（调用方需持有锁）"""
+        oldest_key, oldest_time = None, None
+        for key, queue in self._idle.items():
+            if queue and (oldest_time is None or queue[0][1] < oldest_time):
+                oldest_key, oldest_time = key, queue[0][1]
+        if oldest_key is None:
+            return None
+        instance = self._idle[oldest_key].popleft()[0]
+        if not self._idle[oldest_key]:
+            del self._idle[oldest_key]
+        return instance
+
+    def _close_instances(self, instances: list):
+        """在锁外关闭实例"""
+        for instance in instances:
+            try:
+                instance.close()
+            except Exception as e:
+                logger.warning(f"Failed to close pooled secretary: {e}")
+            self.stats['evicted'] += 1
+
+    def add(self, model: str, api_key: str, instance: Any):
+        """把已创建好的实例（例如启动时预加载的实例）放入池中"""
+        with self._lock:
+            self._idle[(model, api_key)].append((instance, time.monotonic()))
+            self._lock.notify_all()
+
+    def checkout(self, model: str, api_key: str, timeout: float = None):
+        """借出一个实例；无空闲实例时创建，达到上限时等待"""
+        key = (model, api_key)
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        to_close = []
+        timed_out = False
+
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Secretary pool is closed")
+                to_close.extend(self._pop_expired())
+
+                queue = self._idle.get(key)
+                if queue:
+                    instance = queue.pop()[0]
+                    if not queue:
+                        del self._idle[key]
+                    self._leased[id(instance)] = key
+                    self.stats['hits'] += 1
+                    break
+
+                if self._total() >= self.max_size:
+                    victim = self._pop_lru_idle()
+                    if victim is not None:
+                        to_close.append(victim)
+
+                if self._total() < self.max_size:
+                    self._creating += 1
+                    instance = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    timed_out = True
+                    break
+                self._lock.wait(remaining)
+
+        self._close_instances(to_close)
+        if timed_out:
+            raise TimeoutError(f"No secretary available for model {model} within {timeout}s")
+        if instance is not None:
+            return instance
+
+        # 在锁外创建新实例（初始化可能需要数秒）
+        try:
+            instance = self.factory(model, api_key)
+        except Exception:
+            with self._lock:
+                self._creating -= 1
+                self._lock.notify_all()
+            raise
+        with self._lock:
+            self._creating -= 1
+            self._leased[id(instance)] = key
+            self.stats['misses'] += 1
+        return instance
+
+    def checkin(self, instance: Any, discard: bool = False):
+        """归还实例；discard=True 时直接关闭（例如实例处于异常状态）"""
+        with self._lock:
+            key = self._leased.pop(id(instance), None)
+            if key is not None and not discard and not self._closed:
+                self._idle[key].append((instance, time.monotonic()))
+                instance = None
+            self._lock.notify_all()
+        if instance is not None:
+            self._close_instances([instance])
+
+    @contextmanager
+    def lease(self, model: str, api_key: str, timeout: float = None):
+        """with 语法借用实例，结束后自动归还"""
+        instance = self.checkout(model, api_key, timeout)
+        try:
+            yield instance
+        except Exception:
+            self.checkin(instance, discard=True)
+            raise
+        else:
+            self.checkin(instance)
+
+    def evict_idle(self) -> int:
+        """主动回收空闲超时的实例，返回回收数量"""
+        with self._lock:
+            expired = self._pop_expired()
+            self._lock.notify_all()
+        self._close_instances(expired)
+        return len(expired)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取池状态"""
+        with self._lock:
+            idle_by_model = defaultdict(int)
+            for (model, _), queue in self._idle.items():
+                idle_by_model[model] += len(queue)
+            return {
+                'max_size': self.max_size,
+                'idle': sum(idle_by_model.values()),
+                'idle_by_model': dict(idle_by_model),
+                'leased': len(self._leased),
+                'stats': dict(self.stats),
+            }
+
+    def close(self):
+        """关闭池内所有空闲实例，借出中的实例在归还时关闭"""
+        with self._lock:
+            self._closed = True
+            instances = [item[0] for queue in self._idle.values() for item in queue]
+            self._idle.clear()
+            self._lock.notify_all()
+        self._close_instances(instances)
+
+
+# 单例模式实例
+secretary_pool = SecretaryPool()
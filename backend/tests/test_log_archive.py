@@ -0,0 +1,134 @@
+"""
+對話日誌歸檔的崩潰注入測試
+在歸檔批次的各個步驟之間模擬進程崩潰, 重啟後重跑, 檢查訊息不遺失也不重複
+
+用法: python -m unittest discover backend/tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_archive import ConversationArchiver
+
+
+class Crash(Exception):
+    """模擬的進程崩潰."""
+
+
+class FakeLogger:
+    """只實現歸檔器用到的 ConversationLogger 介面."""
+
+    def __init__(self, db_path: str, rows):
+        self.db_path = db_path
+        self.rows = {row["id"]: row for row in rows}
+
+    @staticmethod
+    def now_ms() -> int:
+        return int(datetime(2026, 1, 1).timestamp() * 1000)
+
+    @staticmethod
+    def format_timestamp(value) -> str:
+        return datetime.fromtimestamp(value / 1000).isoformat()
+
+    def get_archivable_messages(self, before_ms: int, limit: int = 1000):
+        rows = sorted(self.rows.values(), key=lambda row: (row["timestamp"], row["id"]))
+        return [dict(row) for row in rows if row["timestamp"] < before_ms][:limit]
+
+    def delete_messages(self, message_ids) -> int:
+        return sum(self.rows.pop(message_id, None) is not None for message_id in message_ids)
+
+    def vacuum(self):
+        pass
+
+
+def make_rows():
+    """兩個會話、兩個月份的訊息 (同一批次跨月)."""
+    rows = []
+    for message_id in range(1, 9):
+        month = 1 if message_id <= 4 else 2
+        rows.append({
+            "id": message_id,
+            "session_id": "s1" if message_id % 2 == 0 else "s2",
+            "timestamp": int(datetime(2025, month, message_id).timestamp() * 1000),
+            "speaker": "user",
+            "message": f"message {message_id}",
+            "status": "processed",
+        })
+    return rows
+
+
+class ArchiveCrashTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.archive_dir = os.path.join(self._tmp.name, "log_archive")
+        self.logger = FakeLogger(os.path.join(self._tmp.name, "conversation_logs.db"), make_rows())
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def archiver(self) -> ConversationArchiver:
+        return ConversationArchiver(self.logger, archive_dir=self.archive_dir, max_age_days=0,
+                                    compression="gzip", batch_size=100)
+
+    def assert_archived_once(self):
+        archiver = self.archiver()
+        archiver.run()
+        self.assertEqual(self.logger.rows, {})
+        self.assertEqual([row["id"] for row in archiver.get_session_messages("s1")], [2, 4, 6, 8])
+        self.assertEqual([row["id"] for row in archiver.get_session_messages("s2")], [1, 3, 5, 7])
+        self.assertEqual(sum(segment["count"] for segment in archiver.list_segments()), 8)
+
+    def crash_on_call(self, target: str, call: int):
+        """第 call 次調用 ConversationArchiver.<target> 完成後拋出 Crash."""
+        original = getattr(ConversationArchiver, target)
+        calls = []
+
+        def wrapper(*args, **kwargs):
+            result = original(*args, **kwargs)
+            calls.append(1)
+            if len(calls) == call:
+                raise Crash(target)
+            return result
+
+        return mock.patch.object(ConversationArchiver, target, wrapper)
+
+    def test_crash_after_first_month_index_replaced(self):
+        with self.crash_on_call("_append_month", 1), self.assertRaises(Crash):
+            self.archiver().run()
+        self.assert_archived_once()
+
+    def test_crash_after_all_months_before_delete_journal(self):
+        with self.crash_on_call("_append_month", 2), self.assertRaises(Crash):
+            self.archiver().run()
+        self.assert_archived_once()
+
+    def test_crash_after_delete_journal_before_delete(self):
+        with mock.patch.object(FakeLogger, "delete_messages", side_effect=Crash), self.assertRaises(Crash):
+            self.archiver().run()
+        self.assert_archived_once()
+
+    def test_retry_in_same_process(self):
+        archiver = self.archiver()
+        with self.crash_on_call("_append_month", 1), self.assertRaises(Crash):
+            archiver.run()
+        archiver.run()
+        self.assertEqual([row["id"] for row in archiver.get_session_messages("s1")], [2, 4, 6, 8])
+
+    def test_legacy_journal(self):
+        os.makedirs(self.archive_dir)
+        with open(os.path.join(self.archive_dir, ConversationArchiver.JOURNAL_NAME), "w") as f:
+            f.write("[1, 2]")
+        self.archiver()
+        self.assertNotIn(1, self.logger.rows)
+        self.assertNotIn(2, self.logger.rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
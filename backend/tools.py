@@ -87,14 +87,24 @@ class TaskManagementTool(BaseTool):
         else:
             return f"不支援的操作：{action}。支援的操作：create, list, update, complete。"
 
+SOURCE_NAMES = {
+    "vector_search": "向量搜索",
+    "graph_search": "圖搜索",
+    "fulltext_search": "全文搜索",
+}
+
 class MemorySearchInput(BaseModel):
     """記憶搜索工具的輸入模式。"""
     query: str = Field(description="搜索查詢，例如 '張三的聯絡方式' 或 '上次討論的專案'")
+    speaker: Optional[str] = Field(default=None, description="只搜索某一方說的話：'user'（使用者）或 'assistant'（助理）")
+    session_id: Optional[str] = Field(default=None, description="只搜索指定會話的對話")
+    since: Optional[str] = Field(default=None, description="起始時間（含），ISO 格式，例如 '2025-07-01' 或 '2025-07-01T09:00'")
+    until: Optional[str] = Field(default=None, description="結束時間（含），ISO 格式；只有日期時包含當天整天")
 
 class MemorySearchTool(BaseTool):
     """記憶搜索工具。"""
     name: str = "memory_search"
-    description: str = "搜索使用者的長期記憶，包括個人資訊、對話歷史、重要決定等。"
+    description: str = "搜索使用者的長期記憶，包括個人資訊、對話歷史、重要決定等。可按說話者、會話或時間範圍過濾對話記錄。"
     args_schema: Type[BaseModel] = MemorySearchInput
     memory_manager: Any = Field(default=None, exclude=True) # 將 memory_manager 定義為 Pydantic 字段，並排除在序列化之外
 
@@ -102,76 +112,114 @@ class MemorySearchTool(BaseTool):
         super().__init__(**kwargs)
         self.memory_manager = memory_manager
 
-    def _run(self, query: str) -> str:
+    def _run(self, query: str, speaker: Optional[str] = None, session_id: Optional[str] = None,
+             since: Optional[str] = None, until: Optional[str] = None) -> str:
         """執行記憶搜索。"""
         if not self.memory_manager:
             return "記憶管理器未初始化。"
         
         try:
-            results = self.memory_manager.search_memory(query)
-            
-            # 優先使用智能搜索結果
-            smart_results = results.get("smart_results", [])
-            if smart_results:
-                result_text = f"找到與 '{query}' 相關的記憶：\n\n"
-                
-                for i, result in enumerate(smart_results[:5], 1):  # 顯示前5個結果
-                    source_type = "向量搜索" if result["source"] == "vector_search" else "圖搜索"
-                    score = result.get("enhanced_score", result.get("score", 0.0))
-                    priority = result.get("priority_score", 0.0)
-                    
-                    result_text += f"{i}. [{source_type}] (分數: {score:.2f}, 重要性: {priority:.2f})\n"
-                    result_text += f"   {result['content'][:150]}...\n"
-                    
-                    # 添加分類信息
-                    classification = result.get("classification", {})
-                    if classification:
-                        primary_type = classification.get("primary_type", "")
-                        if primary_type != "general":
-                            result_text += f"   類型: {primary_type}\n"
-                    
-                    # 添加元數據信息
-                    metadata = result.get("metadata", {})
-                    if metadata:
-                        if "speaker" in metadata:
-                            result_text += f"   來源: {metadata['speaker']}\n"
-                        if "timestamp" in metadata:
-                            result_text += f"   時間: {metadata['timestamp']}\n"
-                    
-                    result_text += "\n"
-                
-                # 添加摘要
-                summary = results.get("summary", "")
-                if summary and len(smart_results) > 3:
-                    result_text += f"\n📋 記憶摘要：\n{summary}"
-                
-                return result_text
-            
-            # 回退到組合搜索結果
-            combined_results = results.get("combined_results", [])
-            if combined_results:
-                result_text = f"找到與 '{query}' 相關的記憶：\n\n"
-                
-                for i, result in enumerate(combined_results[:5], 1):
-                    source_type = "向量搜索" if result["source"] == "vector_search" else "圖搜索"
-                    score = result.get("score", 0.0)
-                    
-                    result_text += f"{i}. [{source_type}] (相關性: {score:.2f})\n"
-                    result_text += f"   {result['content'][:150]}...\n"
-                    
-                    metadata = result.get("metadata", {})
-                    if metadata and "speaker" in metadata:
-                        result_text += f"   來源: {metadata['speaker']}\n"
-                    
-                    result_text += "\n"
-                
-                return result_text
-            
-            return f"未找到與 '{query}' 相關的記憶。"
-            
+            filters = self._parse_filters(speaker, session_id, since, until)
+        except ValueError as e:
+            return f"時間格式錯誤：{str(e)}"
+        try:
+            results = self.memory_manager.search_memory(query, **filters)
+            return self._format_results(query, results)
         except Exception as e:
             return f"搜索記憶時發生錯誤：{str(e)}"
 
+    async def _arun(self, query: str, speaker: Optional[str] = None, session_id: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None) -> str:
+        """異步執行記憶搜索（串流對話時三個搜索通道並行）。"""
+        if not self.memory_manager:
+            return "記憶管理器未初始化。"
+        
+        try:
+            filters = self._parse_filters(speaker, session_id, since, until)
+        except ValueError as e:
+            return f"時間格式錯誤：{str(e)}"
+        try:
+            results = await self.memory_manager.asearch_memory(query, **filters)
+            return self._format_results(query, results)
+        except Exception as e:
+            return f"搜索記憶時發生錯誤：{str(e)}"
+
+    @staticmethod
+    def _parse_filters(speaker: Optional[str], session_id: Optional[str],
+                       since: Optional[str], until: Optional[str]) -> dict:
+        """把工具參數轉換為 search_memory 的過濾條件（時間為 datetime，只有日期的結束時間延伸到當天結束）。"""
+        filters = {"speaker": speaker or None, "session_id": session_id or None, "since": None, "until": None}
+        if since:
+            filters["since"] = datetime.datetime.fromisoformat(since.strip())
+        if until:
+            until = until.strip()
+            filters["until"] = datetime.datetime.fromisoformat(until)
+            if len(until) == 10:
+                filters["until"] += datetime.timedelta(days=1, milliseconds=-1)
+        return filters
+
+    def _format_results(self, query: str, results: dict) -> str:
+        """把搜索結果格式化為文本。"""
+        # 優先使用智能搜索結果
+        smart_results = results.get("smart_results", [])
+        if smart_results:
+            result_text = f"找到與 '{query}' 相關的記憶：\n\n"
+
+            for i, result in enumerate(smart_results[:5], 1):  # 顯示前5個結果
+                source_type = SOURCE_NAMES.get(result["source"], "圖搜索")
+                score = result.get("enhanced_score", result.get("score", 0.0))
+                priority = result.get("priority_score", 0.0)
+
+                result_text += f"{i}. [{source_type}] (分數: {score:.2f}, 重要性: {priority:.2f})\n"
+                result_text += f"   {result['content'][:150]}...\n"
+
+                # 添加分類信息
+                classification = result.get("classification", {})
+                if classification:
+                    primary_type = classification.get("primary_type", "")
+                    if primary_type != "general":
+                        result_text += f"   類型: {primary_type}\n"
+
+                # 添加元數據信息
+                metadata = result.get("metadata", {})
+                if metadata:
+                    if "speaker" in metadata:
+                        result_text += f"   來源: {metadata['speaker']}\n"
+                    if "timestamp" in metadata:
+                        result_text += f"   時間: {metadata['timestamp']}\n"
+
+                result_text += "\n"
+
+            # 添加摘要
+            summary = results.get("summary", "")
+            if summary and len(smart_results) > 3:
+                result_text += f"\n📋 記憶摘要：\n{summary}"
+
+            return result_text
+
+        # 回退到組合搜索結果
+        combined_results = results.get("combined_results", [])
+        if combined_results:
+            result_text = f"找到與 '{query}' 相關的記憶：\n\n"
+
+            for i, result in enumerate(combined_results[:5], 1):
+                source_type = SOURCE_NAMES.get(result["source"], "圖搜索")
+                score = result.get("score", 0.0)
+
+                result_text += f"{i}. [{source_type}] (相關性: {score:.2f})\n"
+                result_text += f"   {result['content'][:150]}...\n"
+
+                metadata = result.get("metadata", {})
+                if metadata and "speaker" in metadata:
+                    result_text += f"   來源: {metadata['speaker']}\n"
+
+                result_text += "\n"
+
+            return result_text
+
+        return f"未找到與 '{query}' 相關的記憶。"
+
+
 def get_all_tools(memory_manager=None):
     """獲取所有可用的工具。"""
     tools = [
@@ -0,0 +1,518 @@
+"""
+量化向量引擎模組
+單租戶部署下 1e4-1e6 條訊息的向量搜索不需要 chromadb: 嵌入以 int8 標量量化存放在記憶體映射的 NumPy 數組中,
+以向量化的暴力掃描 (或 IVF 倒排聚類) 取得候選, 再以 float32 原始向量精確重排;
+與 VectorMemoryStore 介面相同 (store_message / store_messages / search_similar / count / reset)
+"""
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy 隨 chromadb 安裝; 只有 VECTOR_ENGINE=quantized 時需要
+    np = None
+
+from embedding_cache import CachedEmbeddingFunction
+
+
+class QuantizedVectorStore:
+    """量化向量存儲
+
+    目錄結構 (VECTOR_STORE_PATH, 預設為 conversation_logs.db 旁的 vector_index):
+    - codes.i8 / scales.f32: 每條向量的 int8 碼與縮放係數 (向量 ≈ scale * codes), 搜索時只掃描這部分
+    - norms.f32: 原始向量的平方範數, 用於估算 L2 距離
+    - vectors.f32: float32 原始向量, 只讀取重排候選所在的行
+    - assign.i32 / ivf.npz: IVF 聚類中心與每條向量所屬的聚類 (VECTOR_ENGINE_INDEX=ivf)
+    - meta.jsonl: 每行一條 id / 文檔 / 元數據, 向量落盤後才追加, 行數即為有效向量數
+    距離與 chromadb 預設相同 (平方 L2), 搜索結果格式與 collection.query 相同;
+    元數據按欄位存為列 (字串編碼為整數, 數字為 float64), where 過濾以向量化比較得到候選行
+    """
+
+    # (文件名, dtype, 每行元素數; None 表示向量維度)
+    ARRAYS = (
+        ("codes.i8", "int8", None),
+        ("vectors.f32", "float32", None),
+        ("scales.f32", "float32", 1),
+        ("norms.f32", "float32", 1),
+        ("assign.i32", "int32", 1),
+    )
+    INITIAL_CAPACITY = 1024
+    # 支援的 where 運算子 (chromadb 語法的子集, 另支援 $and / $or / $in / $nin)
+    OPERATORS = {"$eq": "equal", "$ne": "not_equal", "$gt": "greater", "$gte": "greater_equal",
+                 "$lt": "less", "$lte": "less_equal"}
+    # 每次掃描的行數: int8 碼轉為 float32 的臨時數組 (SCAN_BLOCK * dim * 4 位元組) 留在 CPU 快取內
+    SCAN_BLOCK = 4096
+    # IVF 預設探測聚類數的 1/8 (至少 8 個), 即掃描約 12.5% 的向量; bench_vector_engines.py 實測 recall@10:
+    # 預設參數 (2 萬條 384 維聚類數據) 0.998; 3 萬條 64 維均勻隨機數據 (--clusters 0, 最壞情況) 0.65,
+    # 固定探測 8 個時只有 0.22; flat 為 1.000, 需要精確召回時使用 flat
+    IVF_PROBE_FRACTION = 1 / 8
+    IVF_MIN_PROBE = 8
+    ASSIGN_BLOCK = 4096
+
+    _instances: Dict[Tuple[str, str], "QuantizedVectorStore"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str = None, embedding_function=None, index: str = None,
+                 rerank_factor: int = None, ivf_lists: int = None, ivf_probe: int = None,
+                 ivf_min_size: int = None, add_chunk_size: int = None):
+        if np is None:
+            raise ImportError("VECTOR_ENGINE=quantized 需要 numpy (pip install numpy)")
+        self.mode = "persistent"
+        self.path = os.path.abspath(path or os.getenv("VECTOR_STORE_PATH", "vector_index"))
+        self.embedding_function = embedding_function
+        self.index = (index or os.getenv("VECTOR_ENGINE_INDEX", "flat")).lower()
+        if self.index not in ("flat", "ivf"):
+            raise ValueError(f"unsupported vector engine index: {self.index}")
+        # 以 int8 估算距離取 n_results * rerank_factor 個候選, 再以 float32 精確重排
+        self.rerank_factor = rerank_factor or int(os.getenv("VECTOR_RERANK_FACTOR", "8"))
+        # 聚類數量 (0 = 4 * sqrt(向量數)), 每次查詢探測的聚類數量 (0 = 聚類數的 1/8, 至少 8 個),
+        # 向量數達到 ivf_min_size 才建立聚類
+        self.ivf_lists = ivf_lists if ivf_lists is not None else int(os.getenv("VECTOR_IVF_LISTS", "0"))
+        self.ivf_probe = ivf_probe if ivf_probe is not None else int(os.getenv("VECTOR_IVF_PROBE", "0"))
+        self.ivf_min_size = (ivf_min_size if ivf_min_size is not None
+                             else int(os.getenv("VECTOR_IVF_MIN_SIZE", "20000")))
+        self.add_chunk_size = add_chunk_size or int(os.getenv("VECTOR_ADD_CHUNK_SIZE", "256"))
+        self.needs_rebuild = False
+        self._owns_embedding_function = False
+        self._lock = threading.RLock()
+        try:
+            self._load()
+        except Exception as e:
+            self._quarantine(e)
+            self._load()
+
+    @classmethod
+    def shared(cls, path: str, cache_dir: str) -> "QuantizedVectorStore":
+        """同一目錄 (與嵌入模型) 在進程內只打開一次, 多個 AI 秘書實例共用 (避免多個實例同時追加同一組文件).
+
+        共用的存儲建立並擁有自己的嵌入函數 (cache_dir 下的嵌入向量快取), 不受任何 AI 秘書實例關閉影響,
+        進程結束時才關閉
+        """
+        key = (os.path.abspath(path), os.getenv("EMBEDDING_MODEL_ID", CachedEmbeddingFunction.DEFAULT_MODEL_ID))
+        with cls._instances_lock:
+            if key not in cls._instances:
+                store = cls(path=key[0], embedding_function=CachedEmbeddingFunction.from_env(cache_dir))
+                store._owns_embedding_function = True
+                atexit.register(store.close)
+                cls._instances[key] = store
+            return cls._instances[key]
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        """打開已有的索引 (或建立空目錄), 從 meta.jsonl 恢復 id 與偏移量."""
+        os.makedirs(self.path, exist_ok=True)
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self._arrays: Dict[str, Any] = {}
+        self._ids: List[str] = []
+        self._offsets: List[int] = []
+        self._row_by_id: Dict[str, int] = {}
+        # 元數據列: 字串欄位 -> 編碼 (-1 表示缺失), 數字欄位 -> 數值 (NaN 表示缺失)
+        self._labels: Dict[str, array] = {}
+        self._vocab: Dict[str, Dict[str, int]] = {}
+        self._numbers: Dict[str, array] = {}
+        self._centroids = None
+        self._trained_count = 0
+
+        header_path = self._file("header.json")
+        if not os.path.exists(header_path):
+            return
+        with open(header_path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.dim, self.capacity = int(header["dim"]), int(header["capacity"])
+        for name, dtype, width in self.ARRAYS:
+            expected = self.capacity * (width or self.dim) * np.dtype(dtype).itemsize
+            if os.path.getsize(self._file(name)) < expected:
+                raise ValueError(f"{name} is smaller than the recorded capacity")
+        self._open_arrays()
+        self._load_meta()
+        if len(self._ids) > self.capacity:
+            raise ValueError("meta.jsonl has more rows than the vector files")
+        if os.path.exists(self._file("ivf.npz")):
+            with np.load(self._file("ivf.npz")) as data:
+                self._centroids = data["centroids"]
+                self._trained_count = int(data["trained_count"])
+
+    def _load_meta(self):
+        meta_path = self._file("meta.jsonl")
+        if not os.path.exists(meta_path):
+            return
+        offset = 0
+        with open(meta_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line)
+                message_id = record["id"]
+                self._index_metadata(record.get("metadata") or {})
+                self._row_by_id[message_id] = len(self._ids)
+                self._ids.append(message_id)
+                self._offsets.append(offset)
+                offset += len(line)
+        if offset < os.path.getsize(meta_path):
+            # 寫到一半中斷的最後一行: 對應的向量會在下次寫入時被覆蓋
+            with open(meta_path, "r+b") as f:
+                f.truncate(offset)
+
+    def _index_metadata(self, metadata: Dict[str, Any]):
+        """把下一行的元數據追加到各欄位的列 (沒有該欄位的行補缺失值)."""
+        row = len(self._ids)
+        for key, value in metadata.items():
+            if isinstance(value, str):
+                if key not in self._labels:
+                    self._labels[key] = array("i", [-1]) * row
+                    self._vocab[key] = {}
+                vocab = self._vocab[key]
+                if value not in vocab:
+                    vocab[value] = len(vocab)
+                self._labels[key].append(vocab[value])
+            elif isinstance(value, (int, float)):
+                if key not in self._numbers:
+                    self._numbers[key] = array("d", [math.nan]) * row
+                self._numbers[key].append(float(value))
+        for columns, missing in ((self._labels, -1), (self._numbers, math.nan)):
+            for column in columns.values():
+                if len(column) == row:
+                    column.append(missing)
+
+    def _open_arrays(self):
+        for name, dtype, width in self.ARRAYS:
+            shape = (self.capacity, self.dim) if width is None else (self.capacity,)
+            self._arrays[name] = np.memmap(self._file(name), dtype=dtype, mode="r+", shape=shape)
+
+    def _flush_arrays(self):
+        for array in self._arrays.values():
+            array.flush()
+
+    def _grow(self, min_capacity: int):
+        """按倍數擴大所有向量文件並重新映射."""
+        capacity = max(min_capacity, self.capacity * 2, self.INITIAL_CAPACITY)
+        self._flush_arrays()
+        self._arrays = {}
+        for name, dtype, width in self.ARRAYS:
+            with open(self._file(name), "a+b") as f:
+                f.truncate(capacity * (width or self.dim) * np.dtype(dtype).itemsize)
+        self.capacity = capacity
+        self._write_json("header.json", {"dim": self.dim, "capacity": self.capacity})
+        self._open_arrays()
+
+    def _write_json(self, name: str, data: Dict[str, Any]):
+        tmp_path = self._file(f"{name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._file(name))
+
+    def _quarantine(self, error: Exception):
+        """把無法打開的索引目錄移到旁邊 (保留現場), 之後建立空索引並標記需要重建."""
+        if os.path.exists(self.path):
+            corrupt_path = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, corrupt_path)
+            print(f"⚠️ 向量索引無法打開 ({error}), 已移至 {corrupt_path}")
+        self.needs_rebuild = True
+        print("⚠️ 請執行 python vector_rebuild.py 從 conversation_logs 重建向量索引")
+
+    def count(self) -> int:
+        """索引中的文檔數量."""
+        return len(self._ids)
+
+    def has_legacy_timestamps(self) -> bool:
+        """索引中是否有 ISO 字串格式的時間 (時間範圍過濾匹配不到, 需要重建)."""
+        return "timestamp" in self._labels
+
+    def reset(self):
+        """刪除所有向量與元數據 (重建索引前使用)."""
+        with self._lock:
+            self._arrays = {}
+            for name in [name for name, _, _ in self.ARRAYS] + ["meta.jsonl", "header.json", "ivf.npz"]:
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            self._load()
+            self.needs_rebuild = False
+
+    @staticmethod
+    def build_metadata(session_id: str, speaker: str, timestamp) -> Dict[str, Any]:
+        """訊息的向量元數據 (與 VectorMemoryStore 相同)."""
+        from memory_manager import VectorMemoryStore
+        return VectorMemoryStore.build_metadata(session_id, speaker, timestamp)
+
+    def _embed(self, texts: Sequence[str]) -> List[List[float]]:
+        if self.embedding_function is None:
+            from chromadb.utils import embedding_functions
+            self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        return self.embedding_function(list(texts))
+
+    @staticmethod
+    def quantize(matrix) -> Tuple[Any, Any]:
+        """逐行對稱 int8 量化, 返回 (codes, scales)."""
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def store_message(self, message_id: str, message: str, metadata: Dict[str, Any] = None):
+        """存儲訊息的向量嵌入."""
+        self.store_messages([(message_id, message, metadata)])
+
+    def store_messages(self, items: List[Tuple[Any, str, Optional[Dict[str, Any]]]]):
+        """批量存儲多條訊息 (message_id, message, metadata), 每 add_chunk_size 條調用一次嵌入函數."""
+        for start in range(0, len(items), self.add_chunk_size):
+            chunk = items[start:start + self.add_chunk_size]
+            self.store_embeddings(chunk, self._embed([message for _, message, _ in chunk]))
+
+    def store_embeddings(self, items: List[Tuple[Any, str, Optional[Dict[str, Any]]]],
+                         embeddings: Sequence[Sequence[float]]):
+        """寫入已計算好的嵌入; 與 chromadb 相同, 已存在的 id 不會被覆蓋."""
+        with self._lock:
+            fresh = {}
+            for (message_id, message, metadata), embedding in zip(items, embeddings):
+                key = str(message_id)
+                if key not in self._row_by_id and key not in fresh:
+                    fresh[key] = (message, metadata or {}, embedding)
+            if not fresh:
+                return
+
+            matrix = np.asarray([embedding for _, _, embedding in fresh.values()], dtype=np.float32)
+            if self.dim is None:
+                self.dim = int(matrix.shape[1])
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"embedding dimension {matrix.shape[1]} does not match index dimension {self.dim}")
+            start = self.count()
+            end = start + len(fresh)
+            if end > self.capacity:
+                self._grow(end)
+
+            codes, scales = self.quantize(matrix)
+            self._arrays["codes.i8"][start:end] = codes
+            self._arrays["scales.f32"][start:end] = scales
+            self._arrays["vectors.f32"][start:end] = matrix
+            self._arrays["norms.f32"][start:end] = np.einsum("ij,ij->i", matrix, matrix)
+            if self._centroids is not None:
+                self._arrays["assign.i32"][start:end] = self._nearest_centroids(matrix, self._centroids)
+            # 向量先落盤, meta 行寫入後才算有效 (中斷時最多丟失本批, 可由 vector_rebuild.py 補回)
+            self._flush_arrays()
+
+            meta_path = self._file("meta.jsonl")
+            offset = os.path.getsize(meta_path) if os.path.exists(meta_path) else 0
+            lines = []
+            for key, (message, metadata, _) in fresh.items():
+                line = (json.dumps({"id": key, "document": message, "metadata": metadata},
+                                   ensure_ascii=False) + "\n").encode("utf-8")
+                self._index_metadata(metadata)
+                self._row_by_id[key] = len(self._ids)
+                self._ids.append(key)
+                self._offsets.append(offset)
+                offset += len(line)
+                lines.append(line)
+            with open(meta_path, "ab") as f:
+                f.write(b"".join(lines))
+
+            if self.index == "ivf" and self.count() >= self.ivf_min_size \
+                    and (self._centroids is None or self.count() >= 2 * self._trained_count):
+                self.train_ivf()
+
+    @classmethod
+    def _nearest_centroids(cls, matrix, centroids):
+        """每行最近的聚類中心 (分塊計算, 距離矩陣不超過 ASSIGN_BLOCK * 聚類數)."""
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        labels = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), cls.ASSIGN_BLOCK):
+            block = np.asarray(matrix[start:start + cls.ASSIGN_BLOCK], dtype=np.float32)
+            labels[start:start + len(block)] = np.argmin(centroid_norms - 2.0 * block @ centroids.T, axis=1)
+        return labels
+
+    def train_ivf(self, iterations: int = 10, seed: int = 0):
+        """以抽樣的 k-means 建立 IVF 聚類, 並重新分配所有向量 (向量數翻倍時自動重新訓練)."""
+        with self._lock:
+            total = self.count()
+            if total == 0:
+                return
+            started = time.monotonic()
+            nlist = min(self.ivf_lists or max(1, int(4 * math.sqrt(total))), total)
+            rng = np.random.default_rng(seed)
+            sample_size = min(total, max(nlist * 32, 10000), 100000)
+            sample = np.asarray(self._arrays["vectors.f32"][np.sort(rng.choice(total, sample_size, replace=False))])
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = self._nearest_centroids(sample, centroids)
+                counts = np.bincount(labels, minlength=nlist)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = counts == 0
+                centroids[~empty] = sums[~empty] / counts[~empty, None]
+                if empty.any():
+                    centroids[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+
+            # 先刪除舊的聚類中心: 重新分配中斷時退回暴力掃描, 下次寫入再訓練
+            self._centroids = None
+            if os.path.exists(self._file("ivf.npz")):
+                os.remove(self._file("ivf.npz"))
+            assign = self._arrays["assign.i32"]
+            for start in range(0, total, self.SCAN_BLOCK):
+                stop = min(start + self.SCAN_BLOCK, total)
+                assign[start:stop] = self._nearest_centroids(self._arrays["vectors.f32"][start:stop], centroids)
+            assign.flush()
+            with open(self._file("ivf.npz.tmp"), "wb") as f:
+                np.savez(f, centroids=centroids, trained_count=np.int64(total))
+            os.replace(self._file("ivf.npz.tmp"), self._file("ivf.npz"))
+            self._centroids = centroids
+            self._trained_count = total
+            print(f"🧭 IVF 聚類已建立: {nlist} 個聚類, {total} 條向量, 耗時 {time.monotonic() - started:.2f} 秒")
+
+    def probe_count(self) -> int:
+        """每次查詢探測的聚類數量: 預設隨聚類數增長, 掃描的向量比例不因索引變大而下降."""
+        nlist = len(self._centroids) if self._centroids is not None else 0
+        return min(self.ivf_probe or max(self.IVF_MIN_PROBE, math.ceil(nlist * self.IVF_PROBE_FRACTION)), nlist)
+
+    def _probe_mask(self, query, total: int):
+        """IVF: 屬於與查詢最近的 probe_count() 個聚類的行."""
+        distances = np.einsum("ij,ij->i", self._centroids - query, self._centroids - query)
+        probe = self.probe_count()
+        probes = np.argpartition(distances, probe - 1)[:probe]
+        return np.isin(self._arrays["assign.i32"][:total], probes)
+
+    def _where_mask(self, where: Dict[str, Any], total: int):
+        """計算 where 條件 (chromadb 語法) 匹配的行."""
+        mask = np.ones(total, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._where_mask(clause, total)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._where_mask(clause, total) for clause in condition])
+            else:
+                for op, value in (condition.items() if isinstance(condition, dict) else [("$eq", condition)]):
+                    mask &= self._field_mask(key, op, value, total)
+        return mask
+
+    def _field_mask(self, key: str, op: str, value, total: int):
+        if op in ("$in", "$nin"):
+            matched = np.zeros(total, dtype=bool)
+            for item in value:
+                matched |= self._field_mask(key, "$eq", item, total)
+            return matched if op == "$in" else ~matched
+        if op not in self.OPERATORS:
+            raise ValueError(f"unsupported where operator: {op}")
+        compare = getattr(np, self.OPERATORS[op])
+        if isinstance(value, str):
+            if op not in ("$eq", "$ne"):
+                raise ValueError(f"operator {op} requires a numeric value")
+            column = self._labels.get(key)
+            labels = np.frombuffer(column, dtype=np.intc) if column else np.full(total, -1, dtype=np.intc)
+            return compare(labels[:total], self._vocab.get(key, {}).get(value, -2))
+        column = self._numbers.get(key)
+        numbers = np.frombuffer(column, dtype=np.float64) if column else np.full(total, np.nan)
+        return compare(numbers[:total], float(value))
+
+    def _scan(self, query, rows, total: int, k: int):
+        """以 int8 碼估算平方 L2 距離, 返回估算距離最小的 k 個行號.
+
+        ||q - v||² = ||q||² + ||v||² - 2 q·v, 其中 q·v ≈ scale * (q·codes)
+        """
+        query_norm = float(query @ query)
+        codes, scales, norms = (self._arrays["codes.i8"], self._arrays["scales.f32"], self._arrays["norms.f32"])
+        size = total if rows is None else len(rows)
+        best_rows, best_distances = [], []
+        for start in range(0, size, self.SCAN_BLOCK):
+            stop = min(start + self.SCAN_BLOCK, size)
+            if rows is None:
+                block_rows = np.arange(start, stop)
+                block = slice(start, stop)
+            else:
+                block_rows = block = rows[start:stop]
+            approx = norms[block] + query_norm - 2.0 * scales[block] * (codes[block].astype(np.float32) @ query)
+            if len(approx) > k:
+                keep = np.argpartition(approx, k - 1)[:k]
+                block_rows, approx = block_rows[keep], approx[keep]
+            best_rows.append(block_rows)
+            best_distances.append(approx)
+        candidates, distances = np.concatenate(best_rows), np.concatenate(best_distances)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(distances, k - 1)[:k]]
+        return candidates
+
+    def search_by_vector(self, embedding: Sequence[float], n_results: int = 5,
+                         where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        """以查詢向量搜索, 返回與 collection.query 相同格式的結果 (where 過濾在掃描之前進行)."""
+        empty = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        with self._lock:
+            total = self.count()
+            if total == 0 or n_results <= 0:
+                return empty
+            query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+            if len(query) != self.dim:
+                raise ValueError(f"query dimension {len(query)} does not match index dimension {self.dim}")
+
+            allowed = self._where_mask(where, total) if where else None
+            rows = None
+            if self.index == "ivf" and self._centroids is not None:
+                probed = self._probe_mask(query, total)
+                if allowed is not None:
+                    probed &= allowed
+                if probed.sum() >= n_results:
+                    rows = np.flatnonzero(probed)
+            if rows is None and allowed is not None:
+                # 探測的聚類中匹配不足 n_results 條時, 掃描所有匹配的行
+                rows = np.flatnonzero(allowed)
+                if len(rows) == 0:
+                    return empty
+            candidates = np.sort(self._scan(query, rows, total, max(n_results * self.rerank_factor, n_results)))
+
+            # float32 精確重排: 只讀取候選所在的行
+            diff = self._arrays["vectors.f32"][candidates] - query
+            distances = np.einsum("ij,ij->i", diff, diff)
+            order = np.argsort(distances)[:n_results]
+            records = self._read_records(candidates[order])
+        return {
+            "ids": [[record["id"] for record in records]],
+            "documents": [[record["document"] for record in records]],
+            "metadatas": [[record["metadata"] for record in records]],
+            "distances": [[float(distance) for distance in distances[order]]],
+        }
+
+    def _read_records(self, rows) -> List[Dict[str, Any]]:
+        with open(self._file("meta.jsonl"), "rb") as f:
+            records = []
+            for row in rows:
+                f.seek(self._offsets[row])
+                records.append(json.loads(f.readline()))
+        return records
+
+    def search_similar(self, query: str, n_results: int = 5,
+                       where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        """搜索語義相似的訊息 (where 為 VectorMemoryStore.build_where 產生的過濾條件)."""
+        return self.search_by_vector(self._embed([query])[0], n_results=n_results, where=where)
+
+    def close(self):
+        """把向量寫回磁碟, 並關閉自己擁有的嵌入函數."""
+        with self._lock:
+            self._flush_arrays()
+            if self._owns_embedding_function and hasattr(self.embedding_function, "close"):
+                self.embedding_function.close()
+                self._owns_embedding_function = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """索引大小與記憶體佔用 (搜索時掃描的 int8 部分與只在重排時讀取的 float32 部分)."""
+        with self._lock:
+            total, dim = self.count(), self.dim or 0
+            disk_bytes = sum(os.path.getsize(self._file(name)) for name in os.listdir(self.path)
+                             if os.path.isfile(self._file(name)))
+            return {
+                "engine": "quantized",
+                "index": "ivf" if self._centroids is not None else "flat",
+                "ivf_lists": len(self._centroids) if self._centroids is not None else 0,
+                "ivf_probe": self.probe_count(),
+                "count": total,
+                "dim": dim,
+                "scan_bytes": total * (dim + 12),
+                "float32_bytes": total * dim * 4,
+                "disk_bytes": disk_bytes,
+            }
@@ -0,0 +1,104 @@
+"""
+向量索引重建模組
+按 id 鍵集分頁串流讀取 conversation_logs, 每批一次寫入向量索引 (用於索引遺失或損壞時),
+每批完成後持久化檢查點, 中斷後重新執行會從上次的位置繼續
+"""
+
+import argparse
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class VectorIndexRebuilder:
+    """從對話記錄重建向量索引"""
+
+    def __init__(self, conversation_logger, vector_store, name: str = "vector_rebuild", batch_size: int = None):
+        self.logger = conversation_logger
+        self.vector_store = vector_store
+        self.name = name
+        self.batch_size = batch_size or int(os.getenv("VECTOR_REBUILD_BATCH_SIZE", "256"))
+        self.checkpoint = self.logger.get_checkpoint(name)
+
+    def reset(self):
+        """清空向量索引與檢查點, 從第一條訊息開始重建"""
+        self.vector_store.reset()
+        self.checkpoint = {"name": self.name, "last_id": 0, "processed": 0,
+                           "stored": 0, "skipped": 0, "failed": 0, "updated_at": None}
+        self.logger.save_checkpoint(self.checkpoint)
+
+    def run(self, max_messages: Optional[int] = None) -> Dict[str, Any]:
+        """重建直到讀完所有訊息或達到 max_messages"""
+        started = time.monotonic()
+        indexed = 0
+        while max_messages is None or indexed < max_messages:
+            limit = self.batch_size if max_messages is None else min(self.batch_size, max_messages - indexed)
+            rows = self.logger.get_messages(after_id=self.checkpoint["last_id"], limit=limit)
+            if not rows:
+                break
+            self.vector_store.store_messages([
+                (row["id"], row["message"],
+                 self.vector_store.build_metadata(row["session_id"], row["speaker"], row["timestamp"]))
+                for row in rows
+            ])
+            indexed += len(rows)
+            self.checkpoint["last_id"] = rows[-1]["id"]
+            self.checkpoint["processed"] += len(rows)
+            self.checkpoint["stored"] += len(rows)
+            self.logger.save_checkpoint(self.checkpoint)
+            elapsed = time.monotonic() - started
+            print(f"🔁 向量索引重建: 本次 {indexed} 條, 累計 {self.checkpoint['processed']} 條, "
+                  f"{indexed / elapsed if elapsed > 0 else 0:.1f} 條/秒, 檢查點 id={self.checkpoint['last_id']}")
+
+        elapsed = time.monotonic() - started
+        return {
+            "indexed": indexed,
+            "total_indexed": self.checkpoint["processed"],
+            "collection_count": self.vector_store.count(),
+            "remaining": self.logger.count_messages(after_id=self.checkpoint["last_id"]),
+            "elapsed_seconds": round(elapsed, 2),
+            "messages_per_second": round(indexed / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+def main():
+    """命令行入口: python vector_rebuild.py [--reset] [--limit N]"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    from embedding_cache import CachedEmbeddingFunction
+    from memory_manager import ConversationLogger, VectorMemoryStore
+
+    parser = argparse.ArgumentParser(description="從 conversation_logs 重建向量索引")
+    parser.add_argument("--db", default="conversation_logs.db", help="對話記錄數據庫路徑")
+    parser.add_argument("--path", default=None, help="向量索引目錄 (預設為數據庫旁的 chroma_db 或 vector_index)")
+    parser.add_argument("--batch-size", type=int, default=None, help="每批寫入的訊息數量")
+    parser.add_argument("--limit", type=int, default=None, help="本次最多重建的訊息數量")
+    parser.add_argument("--reset", action="store_true", help="清空索引後從頭重建")
+    args = parser.parse_args()
+
+    logger = ConversationLogger(args.db)
+    data_dir = os.path.dirname(os.path.abspath(args.db))
+    # 與應用共用嵌入向量快取: 索引損壞時, 快取中已有的訊息不需要重新嵌入 (quantized 引擎自帶嵌入函數)
+    embedding_function = None
+    if VectorMemoryStore.engine() == "chroma":
+        embedding_function = CachedEmbeddingFunction.from_env(data_dir)
+    # 重建只對持久化索引有意義
+    os.environ["VECTOR_STORE_MODE"] = "persistent"
+    vector_store = VectorMemoryStore.from_env(data_dir, embedding_function=embedding_function, path=args.path)
+    rebuilder = VectorIndexRebuilder(logger, vector_store, batch_size=args.batch_size)
+    # 索引損壞被移走、目錄被刪除或仍是舊的時間格式時檢查點已無意義, 同樣從頭開始
+    if args.reset or vector_store.needs_rebuild or vector_store.has_legacy_timestamps() \
+            or (vector_store.count() == 0 and rebuilder.checkpoint["last_id"]):
+        rebuilder.reset()
+    try:
+        print(f"✅ 向量索引重建完成: {rebuilder.run(max_messages=args.limit)}")
+    except KeyboardInterrupt:
+        print("\n⏹️ 重建已中斷, 下次執行從檢查點繼續")
+    finally:
+        if embedding_function is not None:
+            embedding_function.close()
+        logger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+向量寫入緩衝模組
+把多條訊息累積後以一次 collection.add 寫入向量索引 (按數量或時間觸發),
+嵌入函數每批只調用一次, 索引也只更新一次
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+
+class VectorWriteBuffer:
+    """向量寫入緩衝
+
+    - max_batch: 緩衝的訊息數量達到即寫入
+    - max_wait_ms: 最早一條訊息的最長等待時間, 超過即寫入 (在此之前訊息還不能被向量搜索到)
+    - 批次寫入失敗時逐條重試, 單條錯誤的訊息不影響其他訊息
+    """
+
+    def __init__(self, vector_store, max_batch: int = None, max_wait_ms: float = None):
+        self.vector_store = vector_store
+        self.max_batch = max_batch or int(os.getenv("VECTOR_WRITE_BUFFER_SIZE", "64"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else
+                         float(os.getenv("VECTOR_WRITE_BUFFER_WAIT_MS", "200"))) / 1000.0
+
+        self._cond = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._closed = False
+        self.stats = {"messages": 0, "batches": 0, "calls_saved": 0, "failed": 0}
+        self._flusher = threading.Thread(target=self._flush_loop, name="vector-write-buffer", daemon=True)
+        self._flusher.start()
+
+    def add(self, message_id, message: str, metadata: Optional[Dict[str, Any]] = None) -> Future:
+        """加入一條訊息, 返回寫入結果的 Future"""
+        future: Future = Future()
+        item = {
+            "item": (message_id, message, metadata),
+            "future": future,
+            "added_at": time.monotonic(),
+        }
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("VectorWriteBuffer is closed")
+            self._pending.append(item)
+            self.stats["messages"] += 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        return future
+
+    def pending_count(self) -> int:
+        """尚未寫入的訊息數量"""
+        with self._cond:
+            return len(self._pending)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        """取出一批待寫入的訊息 (調用方需持有鎖)"""
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        return batch
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending:
+                        wait = self._pending[0]["added_at"] + self.max_wait - time.monotonic()
+                        if len(self._pending) >= self.max_batch or wait <= 0 or self._closed:
+                            break
+                        self._cond.wait(wait)
+                    elif self._closed:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = self._take_batch()
+            self._commit(batch)
+
+    def flush(self):
+        """立即寫入所有緩衝中的訊息"""
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._commit(batch)
+
+    def _commit(self, batch: List[Dict[str, Any]]):
+        with self._commit_lock:
+            try:
+                self.vector_store.store_messages([entry["item"] for entry in batch])
+                self.stats["batches"] += 1
+                self.stats["calls_saved"] += len(batch) - 1
+                committed = batch
+            except Exception as e:
+                print(f"⚠️ 向量批次寫入失敗, 改為逐條寫入 ({len(batch)} 條): {e}")
+                committed = []
+                for entry in batch:
+                    try:
+                        self.vector_store.store_messages([entry["item"]])
+                        self.stats["batches"] += 1
+                        committed.append(entry)
+                    except Exception as item_error:
+                        # 可由 vector_rebuild.py 從對話記錄補回
+                        self.stats["failed"] += 1
+                        print(f"向量寫入錯誤 (訊息 {entry['item'][0]}): {item_error}")
+                        entry["future"].set_exception(item_error)
+
+        for entry in committed:
+            entry["future"].set_result(True)
+
+    def close(self):
+        """寫入剩餘的訊息並停止緩衝"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join(timeout=5)
+        self.flush()
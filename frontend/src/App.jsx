@@ -53,8 +53,15 @@ function App() {
     setInputMessage('')
     setIsLoading(true)
 
+    const assistantId = Date.now() + 1
+    const updateAssistant = (update) => {
+      setMessages(prev => prev.map(message =>
+        message.id === assistantId ? { ...message, ...update(message) } : message
+      ))
+    }
+
     try {
-      const response = await fetch('/api/chat', {
+      const response = await fetch('/api/chat/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -64,33 +71,84 @@ function App() {
         })
       })
 
-      const data = await response.json()
+      if (!response.ok || !response.body) {
+        const data = await response.json()
+        throw new Error(data.error || response.statusText)
+      }
+
+      setMessages(prev => [...prev, {
+        id: assistantId,
+        type: 'assistant',
+        content: '',
+        steps: [],
+        timestamp: new Date()
+      }])
+
+      // 逐段讀取 SSE 串流，每個事件以空行分隔
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
 
-      if (data.success) {
-        const assistantMessage = {
-          id: Date.now() + 1,
-          type: 'assistant',
-          content: data.response,
-          timestamp: new Date()
+      const handleEvent = (event) => {
+        switch (event.type) {
+          case 'token':
+            updateAssistant(message => ({ content: message.content + event.content }))
+            break
+          case 'thought':
+            updateAssistant(message => {
+              const steps = [...message.steps]
+              const last = steps[steps.length - 1]
+              if (last && last.type === 'thought') {
+                steps[steps.length - 1] = { ...last, content: last.content + event.content }
+              } else {
+                steps.push({ type: 'thought', content: event.content })
+              }
+              return { steps }
+            })
+            break
+          case 'tool_start':
+            updateAssistant(message => ({
+              steps: [...message.steps, { type: 'tool', content: `🔧 ${event.tool}: ${JSON.stringify(event.input)}` }]
+            }))
+            break
+          case 'final':
+            updateAssistant(message => ({ content: message.content || event.content }))
+            break
+          case 'error':
+            updateAssistant(() => ({ content: `抱歉，發生了錯誤：${event.content}` }))
+            break
+          default:
+            break
         }
-        setMessages(prev => [...prev, assistantMessage])
-      } else {
-        const errorMessage = {
-          id: Date.now() + 1,
-          type: 'assistant',
-          content: `抱歉，發生了錯誤：${data.error}`,
-          timestamp: new Date()
+      }
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        let separator
+        while ((separator = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, separator)
+          buffer = buffer.slice(separator + 2)
+          const data = frame
+            .split('\n')
+            .filter(line => line.startsWith('data:'))
+            .map(line => line.slice(5).trim())
+            .join('\n')
+          if (data) {
+            handleEvent(JSON.parse(data))
+          }
         }
-        setMessages(prev => [...prev, errorMessage])
       }
     } catch (error) {
       const errorMessage = {
-        id: Date.now() + 1,
+        id: assistantId,
         type: 'assistant',
         content: `抱歉，無法連接到服務器：${error.message}`,
         timestamp: new Date()
       }
-      setMessages(prev => [...prev, errorMessage])
+      setMessages(prev => [...prev.filter(message => message.id !== assistantId), errorMessage])
     } finally {
       setIsLoading(false)
     }
@@ -148,6 +206,13 @@ function App() {
                           : 'bg-gray-100 text-gray-800'
                       }`}
                     >
+                      {message.steps && message.steps.length > 0 && (
+                        <div className="mb-2 space-y-1 border-l-2 border-gray-300 pl-2 text-xs text-gray-500">
+                          {message.steps.map((step, index) => (
+                            <p key={index} className="whitespace-pre-wrap">{step.content}</p>
+                          ))}
+                        </div>
+                      )}
                       <p className="whitespace-pre-wrap">{message.content}</p>
                       <p
                         className={`text-xs mt-1 ${
@@ -168,7 +233,7 @@ function App() {
                   </div>
                 ))}
                 
-                {isLoading && (
+                {isLoading && messages[messages.length - 1]?.type === 'user' && (
                   <div className="flex gap-3 justify-start">
                     <div className="w-8 h-8 rounded-full bg-blue-600 flex items-center justify-center flex-shrink-0">
                       <Bot className="w-5 h-5 text-white" />